@@ -1,6 +1,5 @@
 from elftools.common.utils import bytes2str
-from elftools.dwarf.descriptions import describe_form_class
-from elftools.elf.elffile import ELFFile
+from emdbg.analyze.elfindex import ElfIndex
 import pandas as pd
 from pyroaring import BitMap
 import numpy as np
@@ -13,8 +12,8 @@ elf_path = None
 roar_path = None
 bitmap = None
 
-# Documentation for dwarf classes in pyelftools can be found here:
-# https://github.com/eliben/pyelftools/tree/main/elftools/dwarf
+# The DWARF data is read from the persistent index of emdbg, see
+# `emdbg.analyze.elfindex`, which is keyed by the build-id of the ELF file.
 
 def set_elffile_and_bitmap(elf_path_input, roar_path_input):
     global elf_path
@@ -22,56 +21,28 @@ def set_elffile_and_bitmap(elf_path_input, roar_path_input):
     elf_path = elf_path_input
     roar_path = roar_path_input
 
+def _unit_path(name, comp_dir):
+    if ".cpp" in name or comp_dir is None:
+        return name
+    return comp_dir + '/' + name
+
 def get_all_function_names():
     if elf_path is None:
         print("Please set the elf file")
         return
-    
-    print('Processing file:', elf_path)
-    with open(elf_path, 'rb') as f:
-        elffile = ELFFile(f)
 
-        if not elffile.has_dwarf_info():
+    print('Processing file:', elf_path)
+    # The index is only built on the first run for each firmware build
+    with ElfIndex(elf_path) as index:
+        if not index.units():
             print('  file has no DWARF info')
             return
 
-        # get_dwarf_info returns a DWARFInfo context object, which is the
-        # starting point for all DWARF-based processing in pyelftools.
-        dwarfinfo = elffile.get_dwarf_info()
-
         # Return Pandas DataFrame with all function information
-        df = pd.DataFrame(columns=['File','Function Name'])
-
-        #count = 0
-        for CU in dwarfinfo.iter_CUs():
-            #if count > 100:
-            #    break
-            #count += 1
-            TOP_DIE = CU.get_top_DIE()
-            if ".cpp" in bytes2str(TOP_DIE.attributes['DW_AT_name'].value):
-                path = TOP_DIE.attributes['DW_AT_name'].value
-            else:
-                path = TOP_DIE.attributes['DW_AT_comp_dir'].value + bytes('/', 'utf-8') + TOP_DIE.attributes['DW_AT_name'].value
-            for DIE in CU.iter_DIEs():
-                # check for function tag
-                if DIE.tag == 'DW_TAG_subprogram':
-                    try:
-                        if DIE.attributes['DW_AT_inline'].value == 3:
-                            continue
-                    except KeyError:
-                        pass
-                    try:
-                        DIE.attributes['DW_AT_low_pc'].value
-                        DIE.attributes['DW_AT_high_pc'].value
-                    except KeyError:
-                        continue
-                    # check for function name
-                    try :
-                        if DIE.attributes['DW_AT_name'] is not None:
-                            df = pd.concat([df, pd.DataFrame({'File': [bytes2str(path)], 'Function Name': [bytes2str(DIE.attributes['DW_AT_name'].value)]})])
-                    except KeyError:
-                        continue
-        return df
+        rows = [(_unit_path(unit, comp_dir), name)
+                for unit, comp_dir, name, low_pc, high_pc, inline, *_ in index.subprograms()
+                if inline != 3 and low_pc is not None and name is not None]
+        return pd.DataFrame(rows, columns=['File','Function Name'])
 
 
 def get_function_info(function_path, function_name):
@@ -79,84 +50,62 @@ def get_function_info(function_path, function_name):
     if elf_path is None:
         print("Please set the elf file")
         return
-    
-    with open(elf_path, 'rb') as f:
-        elffile = ELFFile(f)
 
-        if not elffile.has_dwarf_info():
+    with ElfIndex(elf_path) as index:
+        if not index.units():
             print('  file has no DWARF info')
             return
 
-        # get_dwarf_info returns a DWARFInfo context object, which is the
-        # starting point for all DWARF-based processing in pyelftools.
-        dwarfinfo = elffile.get_dwarf_info()
-
-        # Return Pandas DataFrame with all function information
-        source_code = decode_funcname( dwarfinfo, function_path, function_name)
+        source_code = decode_funcname(index, function_path, function_name)
 
     return source_code
 
 
-def decode_funcname(dwarfinfo, function_path, function_name):
+def decode_funcname(index, function_path, function_name):
     source_code = []
-    for CU in dwarfinfo.iter_CUs():
-        try:
-            TOP_DIE = CU.get_top_DIE()
-            if ".cpp" in bytes2str(TOP_DIE.attributes['DW_AT_name'].value):
-                path = TOP_DIE.attributes['DW_AT_name'].value
-            else:
-                path = TOP_DIE.attributes['DW_AT_comp_dir'].value + bytes('/', 'utf-8') + TOP_DIE.attributes['DW_AT_name'].value
-            if(path == function_path):
-                for DIE in CU.iter_DIEs():
-                    # check for function tag
-                    if DIE.tag == 'DW_TAG_subprogram':
-                        # check for function name
-                        try :
-                            DIE.attributes['DW_AT_name'].value
-                        except KeyError:
-                            continue
-                        if DIE.attributes['DW_AT_name'].value == function_name:
-                            low_line, high_line, l, a, inline = get_max_min_line(CU, dwarfinfo)
-                            if low_line is not None and high_line is not None:
-                                source_code = get_code_lines(function_path, low_line, high_line)
-                                lines = np.arange(low_line, high_line)
-                                for i,line in enumerate(lines):
-                                    idx = np.where(np.isin(l, line))
-                                    if len(idx[0]) > 0 and len(source_code) > i:
-                                        # check if address is in bitmap
-                                        if a[idx[0][0]] in bitmap:
-                                            print(f"Line {line} with Address {hex(a[idx[0][0]])} is covered")
-                                            source_code[i] = html.Mark(source_code[i], style={'background-color': "rgba(0, 255, 0, 0.1)"})
-                                        else:
-                                            source_code[i] = html.Mark(source_code[i], style={'background-color': "rgba(255, 0, 0, 0.1)"})
-        except KeyError:
+    function_path, function_name = bytes2str(function_path), bytes2str(function_name)
+    functions = {(_unit_path(unit, comp_dir), name) for unit, comp_dir, name, *_ in index.subprograms()}
+    if (function_path, function_name) not in functions:
+        return source_code
+    for offset, name, comp_dir in index.units():
+        if _unit_path(name, comp_dir) != function_path:
             continue
+        low_line, high_line, l, a, inline = get_max_min_line(index.line_table(offset))
+        if low_line is not None and high_line is not None:
+            source_code = get_code_lines(function_path, low_line, high_line)
+            lines = np.arange(low_line, high_line)
+            for i,line in enumerate(lines):
+                idx = np.where(np.isin(l, line))
+                if len(idx[0]) > 0 and len(source_code) > i:
+                    # check if address is in bitmap
+                    if a[idx[0][0]] in bitmap:
+                        print(f"Line {line} with Address {hex(a[idx[0][0]])} is covered")
+                        source_code[i] = html.Mark(source_code[i], style={'background-color': "rgba(0, 255, 0, 0.1)"})
+                    else:
+                        source_code[i] = html.Mark(source_code[i], style={'background-color': "rgba(255, 0, 0, 0.1)"})
     return source_code
 
-def get_max_min_line(CU, dwarfinfo):
-    lineprog = dwarfinfo.line_program_for_CU(CU)
+def get_max_min_line(line_table):
     max = 0
     min = 100000
     prev_addr = 0
     lines = []
     addresses = []
     inline = []
-    for entry in lineprog.get_entries():
-        if entry.state is None:
-            continue
-        if prev_addr != entry.state.address:
-            prev_addr = entry.state.address
-            if entry.state.line not in lines:
-                lines.append(entry.state.line)
-                addresses.append(entry.state.address)
-                if entry.state.file != 1:
+    for address, file, line in line_table:
+        if prev_addr != address:
+            prev_addr = address
+            if line not in lines:
+                lines.append(line)
+                addresses.append(address)
+                if file != 1:
                     inline.append(True)
                 else:
                     inline.append(False)
-        if entry.state.line > max:
-            max = entry.state.line
-        if entry.state.line < min:
-            min = entry.state.line
+        if line > max:
+            max = line
+        if line < min:
+            min = line
     if max == 0 or min == 100000:
         return None, None, None, None, None
     
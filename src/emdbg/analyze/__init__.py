@@ -6,7 +6,7 @@ This module provides common analyzers for trace data and debug logs.
 """
 
 from .backtrace import Backtrace, FileSystemBacktrace, SpiBacktrace, I2cBacktrace
-from .backtrace import CanBacktrace, UartBacktrace, SemaphoreBacktrace
-from .callgraph import callgraph_from_backtrace
+from .backtrace import CanBacktrace, UartBacktrace, SemaphoreBacktrace, backtrace_class_from_file
+from .callgraph import callgraph_from_backtrace, callgraph_from_log, callgraph_diff
 from .priority import summarize_semaphore_boostlog
 from .hardfault import convert as convert_hardfault
@@ -2,36 +2,129 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 from __future__ import annotations
-import re
+import re, sys
+import copyreg
 from pathlib import Path
 from .priority import _BoostOperation
 
+class FrameTable:
+    """
+    Interns the strings of parsed frames and assigns integer IDs to their
+    functions and locations. Identical frames share the same string objects
+    and can be compared by their IDs instead of their strings.
+    """
+    def __init__(self):
+        self._cwd = Path().cwd()
+        self._paths = {}
+        self._frames = {}
+        self._functions = {}
+        self._locations = {}
+
+    def relative_path(self, filename: str) -> str:
+        """:return: the filename relative to the CWD if possible"""
+        if (path := self._paths.get(filename)) is None:
+            try: path = str(Path(filename).relative_to(self._cwd))
+            except ValueError: path = filename
+            path = self._paths[filename] = sys.intern(path)
+        return path
+
+    def intern(self, function_name: str, args: str, filename: str, line: str) -> tuple:
+        """
+        :return: the function ID, location ID and the interned strings of the
+                 function name, arguments, filename, line, function, location,
+                 and unique location.
+        """
+        key = (function_name, args, filename, line)
+        if (frame := self._frames.get(key)) is None:
+            function_name, args, filename, line = map(sys.intern, key)
+            function = sys.intern(f"{function_name}({args})")
+            location = sys.intern(f"{self.relative_path(filename)}:{line}")
+            unique_location = sys.intern(function + "\n" + location)
+            function_id = self._functions.setdefault((function, filename), len(self._functions))
+            location_id = self._locations.setdefault(unique_location, len(self._locations))
+            frame = self._frames[key] = (function_id, location_id, function_name, args,
+                                         filename, line, function, location, unique_location)
+        return frame
+
+
+_FRAME_TABLE = FrameTable()
+_TASK_PATTERN = re.compile(r"(?:(\d+)us> +(?:(\d+)cyc> +)?)?Task=(.+)")
+_FRAME_PATTERN = re.compile(r"#(\d+) +(?:0x.+? in )?(.+)\((.*?)\) at (.+?):(\d+)")
+
+
+class RuleSet:
+    """
+    Matches strings against an ordered list of regex patterns.
+
+    All patterns are compiled into a single alternation, which rejects strings
+    matching none of the rules in one pass. Only if it matches, the individual
+    patterns are searched to preserve the rule order. The result is memoized
+    per string, so that every unique function is only classified once.
+    """
+    def __init__(self, patterns: list[str]):
+        """
+        :param patterns: The regex patterns in priority order.
+        """
+        self.patterns = list(patterns)
+        self._patterns = [re.compile(p) for p in self.patterns]
+        self._any = None
+        # Backreferences cannot be renumbered in an alternation
+        if self.patterns and not any(re.search(r"\\[1-9]|\(\?P=", p) for p in self.patterns):
+            try: self._any = re.compile("|".join(f"(?:{p})" for p in self.patterns))
+            except re.error: pass
+        self._cache = {}
+
+    def matches(self, string: str) -> tuple[int, ...]:
+        """:return: the indices of all patterns matching the string in rule order."""
+        if (indices := self._cache.get(string)) is None:
+            if not self._patterns or (self._any is not None and self._any.search(string) is None):
+                indices = ()
+            else:
+                indices = tuple(i for i, p in enumerate(self._patterns) if p.search(string))
+            self._cache[string] = indices
+        return indices
+
+
+_RULE_SETS = {}
+
+def _rule_set(rules: dict, patterns: list[str]) -> RuleSet:
+    # Keep a reference to the rules dictionary, so that its ID is not reused
+    if (entry := _RULE_SETS.get(id(rules))) is None:
+        entry = _RULE_SETS[id(rules)] = (rules, RuleSet(patterns))
+    return entry[1]
+
+
 class Frame:
     """
     Parses a GDB frame of a `backtrace` or `px4_backtrace` command.
     """
-    def __init__(self, description: str):
+    __slots__ = ("is_valid", "description", "index", "function_name", "args",
+                 "filename", "line", "function", "location", "_unique_location",
+                 "function_id", "location_id")
+
+    def __init__(self, description: str, table: FrameTable = None):
         """
         :param description: A single line of the backtrace command starting with a `#`
+        :param table: The table to intern the frame in. Defaults to a global table.
         """
         self.is_valid = False
         self.description = description
-        if match := re.match(r"#(\d+) +(?:0x.+? in )?(.+)\((.*?)\) at (.+?):(\d+)", description):
+        if match := _FRAME_PATTERN.match(description):
             self.index = int(match.group(1))
-            self.function_name = match.group(2)
-            self.args = match.group(3)
-            self.filename = match.group(4)
-            self.line = match.group(5)
+            (self.function_id, self.location_id, self.function_name, self.args,
+             self.filename, self.line, self.function, self.location,
+             self._unique_location) = (table or _FRAME_TABLE).intern(*match.group(2, 3, 4, 5))
             self.is_valid = True
-            self.function = f"{self.function_name}({self.args})"
-            self.location = f"{Path(self.filename).relative_to(Path().cwd())}:{self.line}"
-            self._unique_location = self.function + "\n" + self.location
+
+    def __reduce__(self):
+        # Intern the frame again when unpickling it in another process
+        return (self.__class__, (self.description,))
 
     def __hash__(self) -> int:
-        return hash(self._node)
+        return hash(self.function_id)
 
     def __eq__(self, other) -> int:
-        return self.function == other.function and self.filename == other.filename
+        return self.function_id == other.function_id
 
     def __repr__(self) -> str:
         return self.function
@@ -43,37 +136,58 @@ class Frame:
 class Backtrace:
     """
     Holds the entire call chain of a `backtrace` or `px4_backtrace` command.
+
+    Backtraces compare equal if their frames have the same functions in the
+    same files, regardless of the line numbers.
     """
     EDGES = {}
+    """Mapping of backtrace type to a pattern matching any function of the
+    backtrace. The first matching pattern determines the type."""
     COLORS = {}
+    """Mapping of a pattern matching a node to its graphviz style. The styles
+    of all matching patterns are applied in order."""
 
     def __init__(self, description: str):
         """
         :param description: All lines of the backtrace command
         """
         self.description = description
-        tasks = (re.match(r"Task=(.+)", d) for d in description.splitlines())
-        tasks = [t.group(1) for t in tasks if t is not None]
-        self.task = tasks[0] if tasks else None
+        lines = description.splitlines()
+        tasks = (_TASK_PATTERN.search(d) for d in lines)
+        tasks = [t for t in tasks if t is not None]
+        self.task = tasks[0].group(3) if tasks else None
         self.type = self.task
+        self.uptime = int(tasks[0].group(1)) if tasks and tasks[0].group(1) else None
+        """The HRT uptime in microseconds when the backtrace was taken"""
+        self.cycles = int(tasks[0].group(2)) if tasks and tasks[0].group(2) else None
+        """The DWT CYCCNT when the backtrace was taken"""
 
-        frames = (Frame(d) for d in description.splitlines())
+        frames = (Frame(d) for d in lines if d.startswith("#"))
         self.frames = [f for f in frames if f.is_valid]
+        self.key = tuple(f.function_id for f in self.frames)
+        self._hash = hash(self.key)
         self.is_valid = len(self.frames)
         if self.is_valid:
-            funcs = {f.function for f in self.frames}
-            for name, pattern in self.EDGES.items():
-                if any(re.search(pattern, f) for f in funcs):
-                    self.type = name
-                    break
+            edges = _rule_set(self.EDGES, self.EDGES.values())
+            indices = [i for f in self.frames for i in edges.matches(f.function)[:1]]
+            if indices:
+                self.type = list(self.EDGES)[min(indices)]
+
+    @classmethod
+    def node_style(cls, node: str) -> dict[str, str]:
+        """:return: the merged graphviz style of all `COLORS` matching the node."""
+        colors = _rule_set(cls.COLORS, cls.COLORS.keys())
+        styles = list(cls.COLORS.values())
+        style = {}
+        for index in colors.matches(node):
+            style.update(styles[index])
+        return style
 
     def __hash__(self) -> int:
-        return hash("".join(f.filename + f.function for f in self.frames))
+        return self._hash
 
     def __eq__(self, other) -> int:
-        ours = "".join(f.filename + f.function for f in self.frames)
-        others = "".join(f.filename + f.function for f in other.frames)
-        return ours == others
+        return self.key == other.key
 
     def __repr__(self) -> str:
         return str(self.frames)
@@ -212,3 +326,59 @@ class SemaphoreBacktrace(Backtrace):
                 self.type += "_255"
             else:
                 self.type = "255"
+
+
+# -----------------------------------------------------------------------------
+class _RulesMeta(type):
+    pass
+
+def _rules_class(name: str, base: type, edges: dict, colors: dict) -> type:
+    return _RulesMeta(name, (base,), {"EDGES": edges, "COLORS": colors})
+
+# Classes loaded from a file cannot be pickled by reference, so pickle them by
+# value to pass them to worker processes.
+copyreg.pickle(_RulesMeta, lambda cls: (_rules_class, (cls.__name__, cls.__base__,
+                                                       cls.EDGES, cls.COLORS)))
+
+
+def backtrace_class_from_file(path: Path, base: type = Backtrace) -> type:
+    """
+    Loads `EDGES` and `COLORS` rules from a YAML or TOML file to create a new
+    backtrace class without a code change. The colors are either a fill color
+    name or a dictionary of graphviz node attributes:
+
+    ```toml
+    name = "DmaBacktrace"
+    [edges]
+    START = "^stm32_dmastart$"
+    IRQ = "^stm32_dma_interrupt$"
+    [colors]
+    "^stm32_dma.*$" = "LightCyan"
+    "^stm32_dmastart$" = { style = "bold,filled", fillcolor = "Silver" }
+    ```
+
+    :param path: The `.toml`, `.yaml` or `.yml` rules file.
+    :param base: The backtrace class to derive from.
+    :return: A subclass of `base` with the rules of the file.
+    :raises ImportError: if the parser of the file format is not installed,
+        see the `rules` extra of the package.
+    """
+    path = Path(path)
+    if path.suffix in {".yaml", ".yml"}:
+        try: import yaml
+        except ImportError:
+            raise ImportError("YAML rules files require PyYAML: pip install 'emdbg[rules]'") from None
+        rules = yaml.safe_load(path.read_text())
+    else:
+        try: import tomllib
+        except ImportError:
+            try: import tomli as tomllib
+            except ImportError:
+                raise ImportError("TOML rules files require tomli before Python 3.11: "
+                                  "pip install 'emdbg[rules]'") from None
+        rules = tomllib.loads(path.read_text())
+    edges = {str(name): str(pattern) for name, pattern in (rules.get("edges") or {}).items()}
+    colors = {str(pattern): (_fill(style) if isinstance(style, str) else dict(style))
+              for pattern, style in (rules.get("colors") or {}).items()}
+    name = rules.get("name", "".join(p.title() for p in re.split(r"\W+", path.stem)) + "Backtrace")
+    return _rules_class(name, base, edges, colors)
@@ -8,59 +8,471 @@
 from __future__ import annotations
 import re, os
 import itertools
+import heapq
 import logging
+import hashlib
+import sqlite3
 from pathlib import Path
-from collections import defaultdict
-from .backtrace import Backtrace
-from .utils import read_gdb_log
+from collections import defaultdict, deque
+from typing import Iterable
+from .backtrace import Backtrace, Frame
+from .utils import iter_gdb_log_records, is_mi_log, record_offsets
 LOGGER = logging.getLogger(__name__)
 
+# Shards per job to even out the load between workers
+_SHARDS_PER_JOB = 4
+# Descriptions per batch when parsing an iterable in parallel
+_BATCH_SIZE = 10000
 
-def callgraph_from_backtrace(backtraces: list[str],
+
+
+class CallGraph:
+    """
+    Collects the unique backtraces of each backtrace type together with how
+    many samples were taken of them. Backtraces are unique by their functions,
+    see `emdbg.analyze.backtrace.Backtrace`, and the first sample is kept.
+
+    Call graphs can be merged in order, which allows building them in parallel
+    from consecutive parts of a log while producing the same result.
+    """
+    def __init__(self):
+        self.backtraces: dict[str, dict[tuple[int], list]] = defaultdict(dict)
+        """Backtrace type -> function IDs -> [frames, number of samples]"""
+
+    def add(self, btype: str, frames: list[Frame], samples: int = 1, key: tuple[int] = None):
+        """Add the frames of a backtrace of a type with a number of samples."""
+        if key is None:
+            key = tuple(f.function_id for f in frames)
+        if (entry := self.backtraces[btype].get(key)) is None:
+            self.backtraces[btype][key] = [frames, samples]
+        else:
+            entry[1] += samples
+
+    def add_backtrace(self, backtrace: Backtrace):
+        """Add a single sample of a parsed backtrace."""
+        self.add(backtrace.type, backtrace.frames, key=backtrace.key)
+
+    def merge(self, other: CallGraph):
+        """Merge the backtraces of a call graph built from a later part of the log."""
+        for btype, backtraces in other.backtraces.items():
+            for frames, samples in backtraces.values():
+                # The frame IDs may come from another process, so rebuild the key
+                self.add(btype, frames, samples)
+
+    @property
+    def nodes(self) -> dict[str, Frame]:
+        """The unique locations of all frames"""
+        return {frame._unique_location: frame
+                for backtraces in self.backtraces.values()
+                for frames, _ in backtraces.values()
+                for frame in frames}
+
+    @property
+    def edges(self) -> dict[tuple[str, str, str], int]:
+        """
+        The (caller, callee, backtrace type) edges and the number of unique
+        backtraces they are part of.
+        """
+        edges = defaultdict(int)
+        for btype, backtraces in self.backtraces.items():
+            btype = str((btype or "").lower())
+            for frames, _ in backtraces.values():
+                for f1, f2 in itertools.pairwise(frames):
+                    edges[(f2._unique_location, f1._unique_location, btype)] += 1
+        return edges
+
+    @property
+    def samples(self) -> dict[str, int]:
+        """The number of samples per backtrace type"""
+        return {btype: sum(s for _, s in backtraces.values())
+                for btype, backtraces in self.backtraces.items()}
+
+    @property
+    def sample_nodes(self) -> dict[str, int]:
+        """The unique locations of all frames and the number of samples they are part of"""
+        nodes = defaultdict(int)
+        for backtraces in self.backtraces.values():
+            for frames, samples in backtraces.values():
+                for location in {f._unique_location for f in frames}:
+                    nodes[location] += samples
+        return nodes
+
+    @property
+    def sample_edges(self) -> dict[tuple[str, str, str], int]:
+        """The (caller, callee, backtrace type) edges and the number of samples they are part of"""
+        edges = defaultdict(int)
+        for btype, backtraces in self.backtraces.items():
+            btype = str((btype or "").lower())
+            for frames, samples in backtraces.values():
+                for f1, f2 in itertools.pairwise(frames):
+                    edges[(f2._unique_location, f1._unique_location, btype)] += samples
+        return edges
+
+    def top(self, count: int) -> CallGraph:
+        """
+        :param count: The number of backtraces to keep.
+        :return: a call graph of only the unique backtraces with the most samples.
+        """
+        backtraces = ((btype, frames, samples)
+                      for btype, bts in self.backtraces.items()
+                      for frames, samples in bts.values())
+        graph = CallGraph()
+        for btype, frames, samples in heapq.nlargest(count, backtraces, key=lambda b: b[2]):
+            graph.add(btype, frames, samples)
+        return graph
+
+    def without_recursion(self) -> CallGraph:
+        """:return: a call graph with consecutive calls of the same function collapsed."""
+        graph = CallGraph()
+        for btype, backtraces in self.backtraces.items():
+            for frames, samples in backtraces.values():
+                frames = [next(group) for _, group in
+                          itertools.groupby(frames, key=lambda f: f.function_id)]
+                graph.add(btype, frames, samples)
+        return graph
+
+
+def _prune_edges(nodes: dict, edges: dict, min_count: int):
+    for edge in [e for e, count in edges.items() if count < min_count]:
+        del edges[edge]
+    connected = {node for edge in edges for node in edge[:2]}
+    for node in [n for n in nodes if n not in connected]:
+        del nodes[node]
+
+
+def _collapse_chains(nodes: dict, edges: dict, min_length: int) -> dict:
+    """
+    Contracts chains of at least `min_length` nodes that only have a single
+    caller and a single callee of the same type and count into one edge.
+
+    :return: the contracted edges and the number of nodes removed from them.
+    """
+    callers, callees = defaultdict(list), defaultdict(list)
+    for edge in edges:
+        callees[edge[0]].append(edge)
+        callers[edge[1]].append(edge)
+    def _is_inner(node):
+        return (len(callers[node]) == 1 and len(callees[node]) == 1 and
+                callers[node][0][2] == callees[node][0][2] and
+                edges[callers[node][0]] == edges[callees[node][0]])
+
+    collapsed = {}
+    for head in list(nodes):
+        if head not in nodes or _is_inner(head): continue
+        for edge in list(callees[head]):
+            chain, node = [], edge[1]
+            while _is_inner(node) and node != head and len(chain) < len(nodes):
+                chain.append(node)
+                node = callees[node][0][1]
+            new_edge = (head, node, edge[2])
+            if len(chain) < min_length or new_edge in edges: continue
+            edges[new_edge] = edges[edge]
+            callees[head].append(new_edge)
+            callers[node].append(new_edge)
+            for inner in chain:
+                out_edge = callees[inner][0]
+                callers[out_edge[1]].remove(out_edge)
+                del edges[out_edge], nodes[inner]
+            callees[head].remove(edge)
+            del edges[edge]
+            collapsed[new_edge] = len(chain)
+    return collapsed
+
+
+def _callgraph_from_descriptions(descriptions: Iterable[str], BacktraceClass: Backtrace) -> CallGraph:
+    graph = CallGraph()
+    for description in descriptions:
+        bt = BacktraceClass(description)
+        if bt.is_valid:
+            graph.add_backtrace(bt)
+        else:
+            LOGGER.error(bt)
+            LOGGER.error(bt.description)
+    return graph
+
+
+def _callgraph_from_shard(logfile: Path, start: int, end: int | None, is_mi: bool,
+                          BacktraceClass: Backtrace, hold_last: bool = False) \
+                            -> tuple[CallGraph, tuple[int, str] | None]:
+    records = iter_gdb_log_records(logfile, offset=start, end=end, is_mi=is_mi)
+    # Shards start at a record separator, the text before it belongs to the previous shard
+    if start: next(records, None)
+    last = None
+    def _descriptions():
+        nonlocal last
+        for record in records:
+            if last is not None: yield last[1]
+            last = record
+        if not hold_last and last is not None: yield last[1]
+    graph = _callgraph_from_descriptions(_descriptions(), BacktraceClass)
+    return graph, (last if hold_last else None)
+
+
+def _callgraph_from_log(logfile: Path, BacktraceClass: Backtrace, start: int = 0,
+                        jobs: int = 1) -> tuple[CallGraph, tuple[int, str] | None]:
+    """
+    Parses the log file from a record separator and holds back the last record,
+    since it may still be incomplete if the log is being written to.
+
+    :return: the call graph and the byte offset and description of the last record.
+    """
+    is_mi = is_mi_log(logfile)
+    if jobs <= 1:
+        return _callgraph_from_shard(logfile, start, None, is_mi, BacktraceClass, hold_last=True)
+
+    from concurrent.futures import ProcessPoolExecutor
+    graph, tail = CallGraph(), None
+    with ProcessPoolExecutor(jobs) as executor:
+        # Shard the log file at record boundaries and parse it in the workers
+        offsets = record_offsets(logfile, jobs * _SHARDS_PER_JOB, start=start, is_mi=is_mi)
+        futures = [executor.submit(_callgraph_from_shard, logfile, begin, end, is_mi,
+                                   BacktraceClass, hold_last=end is None)
+                   for begin, end in zip([start] + offsets, offsets + [None])]
+        for future in futures:
+            shard, tail = future.result()
+            graph.merge(shard)
+    return graph, tail
+
+
+def _callgraph_parallel(backtraces: Iterable[str], BacktraceClass: Backtrace,
+                        jobs: int) -> CallGraph:
+    from concurrent.futures import ProcessPoolExecutor
+    graph = CallGraph()
+    with ProcessPoolExecutor(jobs) as executor:
+        # Send batches of descriptions to the workers, but limit the memory usage
+        futures = deque()
+        # islice only advances iterators, a list would return its first batch forever
+        backtraces = iter(backtraces)
+        batches = iter(lambda: list(itertools.islice(backtraces, _BATCH_SIZE)), [])
+        for batch in batches:
+            futures.append(executor.submit(_callgraph_from_descriptions, batch, BacktraceClass))
+            if len(futures) >= 2 * jobs:
+                graph.merge(futures.popleft().result())
+        while futures:
+            graph.merge(futures.popleft().result())
+    return graph
+
+
+class _CallGraphCache:
+    """
+    SQLite cache of the unique backtraces parsed from a log file per backtrace
+    class. The parsed part of the log is identified by its content hash, so
+    that an appended log only needs to parse the new tail.
+    """
+    VERSION = 2
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._db = sqlite3.connect(self.path)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            self._db.executescript(f"""
+                DROP TABLE IF EXISTS logs;
+                DROP TABLE IF EXISTS frames;
+                DROP TABLE IF EXISTS backtraces;
+                CREATE TABLE logs (class TEXT PRIMARY KEY, size INTEGER, mtime INTEGER,
+                                   offset INTEGER, digest TEXT);
+                CREATE TABLE frames (class TEXT, id INTEGER, description TEXT,
+                                     PRIMARY KEY (class, id));
+                CREATE TABLE backtraces (class TEXT, position INTEGER, type TEXT,
+                                         frames TEXT, samples INTEGER,
+                                         PRIMARY KEY (class, position));
+                PRAGMA user_version = {self.VERSION};""")
+
+    @staticmethod
+    def _class_key(BacktraceClass: Backtrace) -> str:
+        rules = repr(sorted(BacktraceClass.EDGES.items()))
+        rules = hashlib.blake2b(rules.encode(), digest_size=8).hexdigest()
+        return f"{BacktraceClass.__module__}.{BacktraceClass.__qualname__}:{rules}"
+
+    @staticmethod
+    def _hash(logfile: Path, start: int, end: int, hasher=None):
+        hasher = hasher or hashlib.blake2b()
+        with Path(logfile).open("rb") as f:
+            f.seek(start)
+            while start < end and (chunk := f.read(min(1 << 20, end - start))):
+                hasher.update(chunk)
+                start += len(chunk)
+        return hasher
+
+    def load(self, logfile: Path, BacktraceClass: Backtrace) -> tuple[CallGraph, int, "hashlib.blake2b"]:
+        """
+        :return: the cached call graph, the byte offset up to which the log was
+                 parsed and the hasher of the log up to this offset.
+        """
+        key = self._class_key(BacktraceClass)
+        stat = Path(logfile).stat()
+        row = self._db.execute("SELECT size, mtime, offset, digest FROM logs WHERE class = ?",
+                               (key,)).fetchone()
+        if row is None or row[2] > stat.st_size:
+            return CallGraph(), 0, hashlib.blake2b()
+        size, mtime, offset, digest = row
+        hasher = None
+        if (size, mtime) != (stat.st_size, stat.st_mtime_ns):
+            # The log has changed, check that it was only appended to
+            hasher = self._hash(logfile, 0, offset)
+            if hasher.hexdigest() != digest:
+                LOGGER.info(f"Log '{logfile}' has changed, discarding the cache")
+                return CallGraph(), 0, hashlib.blake2b()
+
+        frames = {fid: Frame(description) for fid, description in self._db.execute(
+                  "SELECT id, description FROM frames WHERE class = ?", (key,))}
+        graph = CallGraph()
+        for btype, fids, samples in self._db.execute(
+                "SELECT type, frames, samples FROM backtraces WHERE class = ? ORDER BY position", (key,)):
+            graph.add(btype, [frames[int(fid)] for fid in fids.split()], samples)
+        return graph, offset, hasher
+
+    def store(self, logfile: Path, BacktraceClass: Backtrace, graph: CallGraph, offset: int, digest: str):
+        """Replaces the cached call graph that was parsed up to the byte offset."""
+        key = self._class_key(BacktraceClass)
+        stat = Path(logfile).stat()
+        frames, backtraces = {}, []
+        for btype, bts in graph.backtraces.items():
+            for bt_frames, samples in bts.values():
+                fids = (frames.setdefault(f.description, len(frames)) for f in bt_frames)
+                backtraces.append((key, len(backtraces), btype, " ".join(map(str, fids)), samples))
+        with self._db:
+            self._db.execute("DELETE FROM frames WHERE class = ?", (key,))
+            self._db.execute("DELETE FROM backtraces WHERE class = ?", (key,))
+            self._db.executemany("INSERT INTO frames VALUES (?, ?, ?)",
+                                 ((key, fid, d) for d, fid in frames.items()))
+            self._db.executemany("INSERT INTO backtraces VALUES (?, ?, ?, ?, ?)", backtraces)
+            self._db.execute("INSERT OR REPLACE INTO logs VALUES (?, ?, ?, ?, ?)",
+                             (key, stat.st_size, stat.st_mtime_ns, offset, digest))
+
+    def close(self):
+        self._db.close()
+
+
+def callgraph_from_log(logfile: Path, BacktraceClass: Backtrace = None, jobs: int = 1,
+                       cache: Path | bool = False) -> CallGraph:
+    """
+    Parses a GDB log file of backtraces into a call graph.
+
+    :param logfile: The GDB log containing the backtraces.
+    :param BacktraceClass: One of the classes of `emdbg.analyze.backtrace`.
+    :param jobs: Number of processes to parse and classify the backtraces with.
+        The log file is split into shards at backtrace boundaries, which are
+        processed in parallel and merged in order.
+    :param cache: Path to a cache file, or `True` to place it next to the log
+        file with a `.callgraph` suffix. The cache stores the parsed backtraces
+        per backtrace class and is reused as long as the log was only appended
+        to, in which case only the new part of the log is parsed.
+    :return: The call graph of the entire log.
+    """
+    if BacktraceClass is None:
+        BacktraceClass = Backtrace
+    logfile = Path(logfile)
+    if not cache:
+        graph, tail = _callgraph_from_log(logfile, BacktraceClass, jobs=jobs)
+    else:
+        if cache is True:
+            cache = logfile.with_name(logfile.name + ".callgraph")
+        cache = _CallGraphCache(cache)
+        try:
+            graph, offset, hasher = cache.load(logfile, BacktraceClass)
+            new_graph, tail = _callgraph_from_log(logfile, BacktraceClass, offset, jobs)
+            if tail[0] != offset:
+                LOGGER.debug(f"Parsed log '{logfile}' from {offset} to {tail[0]}")
+                # Continue hashing the log from the previous to the new offset
+                if hasher is None: hasher = cache._hash(logfile, 0, offset)
+                hasher = cache._hash(logfile, offset, tail[0], hasher)
+                graph.merge(new_graph)
+                cache.store(logfile, BacktraceClass, graph, tail[0], hasher.hexdigest())
+            else:
+                LOGGER.debug(f"Loaded log '{logfile}' from cache '{cache.path}'")
+        finally:
+            cache.close()
+    # The last record is never cached, since it may still be incomplete
+    if tail is not None:
+        graph.merge(_callgraph_from_descriptions([tail[1]], BacktraceClass))
+    return graph
+
+
+def callgraph_from_backtrace(backtraces: Iterable[str] | Path,
                              BacktraceClass: Backtrace = None,
                              output_graphviz: Path = None,
-                             output_pyvis: Path = None):
+                             output_pyvis: Path = None,
+                             jobs: int = 1,
+                             cache: Path | bool = False,
+                             output_folded: Path = None,
+                             output_speedscope: Path = None,
+                             top: int = None,
+                             min_edge_count: int = 0,
+                             min_edge_percent: float = 0,
+                             collapse_recursion: bool = False,
+                             collapse_chains: int = 0,
+                             cluster: str = None) -> CallGraph:
     """
     Convert a GDB backtrace log file into a dot, svg and pyvis file.
 
-    :param backtraces: list of strings each containing a backtrace.
+    :param backtraces: iterable of strings each containing a backtrace, or the
+        path to a GDB log file, which is then parsed via `callgraph_from_log()`.
     :param BacktraceClass: One of the classes of `emdbg.analyze.backtrace`.
     :param output_graphviz: Output path of the graphviz file (`.dot` suffix).
         If you set its suffix to `.svg`, the `dot` command is used to generate
         a SVG file instead.
     :param output_pyvis: Output path to a pyvis file. (Requires the `pyvis`
         module to be installed).
+    :param jobs: Number of processes to parse and classify the backtraces with.
+    :param cache: Cache for parsing a log file, see `callgraph_from_log()`.
+    :param output_folded: Output path of the folded stacks for flame graphs,
+        see `emdbg.analyze.flamegraph.write_folded_stacks()`.
+    :param output_speedscope: Output path of the speedscope JSON file,
+        see `emdbg.analyze.flamegraph.write_speedscope()`.
+    :param top: Only render the given number of unique backtraces with the
+        most samples.
+    :param min_edge_count: Only render edges that are part of at least this
+        many unique backtraces.
+    :param min_edge_percent: Only render edges that are part of at least this
+        percentage of all unique backtraces.
+    :param collapse_recursion: Render consecutive calls of the same function as
+        one node.
+    :param collapse_chains: Contract chains of at least this many nodes with
+        only a single caller and callee into one dashed edge.
+    :param cluster: Group the graphviz nodes by their `"file"` or `"module"`,
+        which is the directory of the file.
+    :return: The call graph of the backtraces. The pruning options only apply
+        to the graphviz and pyvis output.
     """
 
     if BacktraceClass is None:
         BacktraceClass = Backtrace
 
-    backts = defaultdict(set)
-    for description in backtraces:
-        bt = BacktraceClass(description)
-        if bt.is_valid:
-            backts[bt.type].add(bt)
-            # if bt.type == "unknown":
-            #     print(bt)
-            #     print(bt.description)
-        else:
-            LOGGER.error(bt)
-            LOGGER.error(bt.description)
+    if isinstance(backtraces, (str, Path)):
+        graph = callgraph_from_log(backtraces, BacktraceClass, jobs, cache)
+    elif jobs > 1:
+        graph = _callgraph_parallel(backtraces, BacktraceClass, jobs)
+    else:
+        graph = _callgraph_from_descriptions(backtraces, BacktraceClass)
 
-    nodes = {}
-    edges = defaultdict(int)
+    if output_folded:
+        from .flamegraph import write_folded_stacks
+        write_folded_stacks(graph, output_folded)
+    if output_speedscope:
+        from .flamegraph import write_speedscope
+        write_speedscope(graph, output_speedscope)
+    if not (output_graphviz or output_pyvis):
+        return graph
 
-    def itertools_pairwise(iterable):
-        a, b = itertools.tee(iterable)
-        next(b, None)
-        return zip(a, b)
-
-    for btype, bts in backts.items():
-        for bt in bts:
-            for frame in bt.frames:
-                nodes[frame._unique_location] = frame
-            for f1, f2 in itertools_pairwise(bt.frames):
-                edges[(f2._unique_location, f1._unique_location, str((btype or "").lower()))] += 1
+    nodes_count, edges_count = len(graph.nodes), len(graph.edges)
+    if top:
+        graph = graph.top(top)
+    if collapse_recursion:
+        graph = graph.without_recursion()
+    nodes = graph.nodes
+    edges = graph.edges
+    min_edge_count = max(min_edge_count, min_edge_percent / 100 *
+                         sum(len(bts) for bts in graph.backtraces.values()))
+    if min_edge_count:
+        _prune_edges(nodes, edges, min_edge_count)
+    collapsed = _collapse_chains(nodes, edges, collapse_chains) if collapse_chains else {}
+    if len(nodes) != nodes_count or len(edges) != edges_count:
+        LOGGER.info(f"Pruned {nodes_count - len(nodes)} of {nodes_count} nodes and "
+                    f"{edges_count - len(edges)} of {edges_count} edges")
+    if not edges:
+        LOGGER.warning("No edges left to render")
+        return graph
 
     sources = set(nodes)
     sinks = set(nodes)
@@ -91,40 +503,161 @@ def callgraph_from_backtrace(backtraces: list[str],
         output_graphviz = Path(output_graphviz)
         import graphviz
         dot = graphviz.Digraph()
+        clusters = defaultdict(list)
         for node in sorted(nodes):
             frame = nodes[node]
             kwargs = {
                 "label": f"{frame.function}:{frame.line}",
                 "URL": f"subl://open?url={Path(frame.filename).absolute()}&line={frame.line}",
             }
-            for pattern, style in BacktraceClass.COLORS.items():
-                if re.search(pattern, node):
-                    kwargs.update(style)
+            kwargs.update(BacktraceClass.node_style(node))
             if node in sinks:
                 kwargs.update({"style": "bold,filled", "fillcolor": "LightBlue"})
             elif node in sources:
                 kwargs.update({"style": "bold,filled", "fillcolor": "LightGreen"})
-            dot.node(_n(node), **kwargs)
+            if cluster:
+                path = frame.location.rsplit(":", 1)[0]
+                clusters[path if cluster == "file" else os.path.dirname(path)].append((node, kwargs))
+            else:
+                dot.node(_n(node), **kwargs)
+        for index, (name, cnodes) in enumerate(sorted(clusters.items())):
+            with dot.subgraph(name=f"cluster_{index}") as subgraph:
+                subgraph.attr(label=name or ".", style="rounded")
+                for node, kwargs in cnodes:
+                    subgraph.node(_n(node), **kwargs)
         for edge in sorted(edges):
-            dot.edge(_n(edge[0]), _n(edge[1]), label=edge[2] or str(edges[edge]),
+            kwargs = {"label": edge[2] or str(edges[edge])}
+            if (count := collapsed.get(edge)) is not None:
+                kwargs.update({"label": f"{kwargs['label']} (+{count})", "style": "dashed"})
+            dot.edge(_n(edge[0]), _n(edge[1]), **kwargs,
                      penwidth=str(max(edges[edge]/max_calls * 10, 0.5)))
         output_dot = output_graphviz.with_suffix(".dot")
         output_dot.write_text(dot.source)
         if output_graphviz.suffix == ".svg":
             os.system(f"dot -Tsvg -o {output_graphviz} {output_dot}")
             os.system(f"rm {output_dot}")
+    return graph
+
+
+def _diff_style(old: float, new: float) -> tuple[str, str]:
+    if not old: return "Red", "new"
+    if not new: return "Blue", "gone"
+    change = new / old - 1
+    if change >= 1: color = "Red"
+    elif change >= 0.25: color = "Salmon"
+    elif change <= -0.5: color = "Blue"
+    elif change <= -0.2: color = "LightBlue"
+    else: color = "Gray"
+    return color, f"{change:+.0%}"
+
+
+def callgraph_diff(old: Path, new: Path, BacktraceClass: Backtrace = None,
+                   output_graphviz: Path = None, jobs: int = 1,
+                   cache: Path | bool = False) -> list[tuple[tuple[str, str, str], float, float]]:
+    """
+    Compares the call graphs of two GDB backtrace logs, for example of the same
+    scenario captured on two firmware versions. The edges are weighted by
+    their number of samples and normalized by the total samples of each log.
+    Nodes and edges are colored by their relative change: red for an increase,
+    blue for a decrease and gray for no significant change.
+
+    :param old: The GDB log of the baseline.
+    :param new: The GDB log to compare against the baseline.
+    :param BacktraceClass: One of the classes of `emdbg.analyze.backtrace`.
+    :param output_graphviz: Output path of the graphviz file (`.dot` suffix).
+        If you set its suffix to `.svg`, the `dot` command is used to generate
+        a SVG file instead.
+    :param jobs: Number of processes to parse the logs with.
+    :param cache: Cache for parsing the logs, see `callgraph_from_log()`.
+    :return: The edges with their old and new share of samples, sorted by the
+        largest increase first.
+    """
+    if BacktraceClass is None:
+        BacktraceClass = Backtrace
+    graphs = [callgraph_from_log(log, BacktraceClass, jobs, cache) for log in (old, new)]
+    totals = [sum(g.samples.values()) or 1 for g in graphs]
+    old_edges, new_edges = ({e: s / total for e, s in g.sample_edges.items()}
+                            for g, total in zip(graphs, totals))
+    old_nodes, new_nodes = ({n: s / total for n, s in g.sample_nodes.items()}
+                            for g, total in zip(graphs, totals))
+    changes = [(edge, old_edges.get(edge, 0), new_edges.get(edge, 0))
+               for edge in old_edges.keys() | new_edges.keys()]
+    changes.sort(key=lambda c: (c[1] - c[2], c[0]))
+
+    if output_graphviz:
+        output_graphviz = Path(output_graphviz)
+        import graphviz
+        frames = {**graphs[0].nodes, **graphs[1].nodes}
+        max_share = max(max(o, n) for _, o, n in changes) if changes else 1
+        def _n(name):
+            return re.sub(r"[, :<>]", "_", name)
+
+        dot = graphviz.Digraph()
+        for node in sorted(frames):
+            frame = frames[node]
+            color, change = _diff_style(old_nodes.get(node, 0), new_nodes.get(node, 0))
+            dot.node(_n(node), label=f"{frame.function}:{frame.line}\n{change}",
+                     URL=f"subl://open?url={Path(frame.filename).absolute()}&line={frame.line}",
+                     style="filled", fillcolor=color if color != "Gray" else "White")
+        for edge, old_share, new_share in sorted(changes):
+            color, change = _diff_style(old_share, new_share)
+            label = f"{edge[2]} {change}" if edge[2] else change
+            dot.edge(_n(edge[0]), _n(edge[1]), label=label, color=color,
+                     style="dashed" if not new_share else "solid",
+                     penwidth=str(max(max(old_share, new_share) / max_share * 10, 0.5)))
+        output_dot = output_graphviz.with_suffix(".dot")
+        output_dot.write_text(dot.source)
+        if output_graphviz.suffix == ".svg":
+            os.system(f"dot -Tsvg -o {output_graphviz} {output_dot}")
+            os.system(f"rm {output_dot}")
+
+    return changes
+
+
+def callgraph_diff_as_table(changes: list[tuple[tuple[str, str, str], float, float]],
+                            count: int = 20) -> "rich.table.Table":
+    """
+    :param changes: The edges returned by `callgraph_diff()`.
+    :param count: The number of edges with the largest increase to show.
+    :return: A rich table of the edges with the largest increase in samples.
+    """
+    import rich.box
+    from rich.table import Table
+    table = Table(box=rich.box.MINIMAL_DOUBLE_HEAD)
+    table.add_column("Caller")
+    table.add_column("Callee")
+    table.add_column("Type")
+    table.add_column("Old %", justify="right")
+    table.add_column("New %", justify="right")
+    table.add_column("Change", justify="right")
+    def _name(node):
+        function, location = node.split("\n")
+        return f"{function}:{location.rsplit(':', 1)[-1]}"
+    for (caller, callee, btype), old, new in changes[:count]:
+        if new <= old: break
+        table.add_row(_name(caller), _name(callee), btype,
+                      f"{old * 100:.2f}", f"{new * 100:.2f}", _diff_style(old, new)[1])
+    return table
 
 
 # -----------------------------------------------------------------------------
 if __name__ == "__main__":
     import argparse
+    import emdbg
     from .backtrace import *
 
     parser = argparse.ArgumentParser(description="Backtrace Analyzer")
     parser.add_argument(
         "file",
         type=Path,
+        nargs="?",
         help="The GDB log containing the backtraces.")
+    parser.add_argument(
+        "--diff",
+        type=Path,
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="Compare the backtraces of two GDB logs instead.")
     parser.add_argument(
         "--graphviz",
         type=Path,
@@ -138,6 +671,60 @@ if __name__ == "__main__":
         "--pyvis",
         type=Path,
         help="The file to render the pyvis graph in.")
+    parser.add_argument(
+        "--folded",
+        type=Path,
+        help="The file to write the folded stacks for flame graphs to.")
+    parser.add_argument(
+        "--speedscope",
+        type=Path,
+        help="The file to write the speedscope JSON profile to.")
+    parser.add_argument(
+        "--top",
+        type=int,
+        help="Only render the backtraces with the most samples.")
+    parser.add_argument(
+        "--min-edge-count",
+        type=int,
+        default=0,
+        help="Only render edges that are part of this many backtraces.")
+    parser.add_argument(
+        "--min-edge-percent",
+        type=float,
+        default=0,
+        help="Only render edges that are part of this percentage of backtraces.")
+    parser.add_argument(
+        "--collapse-recursion",
+        action="store_true",
+        default=False,
+        help="Render recursive calls as one node.")
+    parser.add_argument(
+        "--collapse-chains",
+        type=int,
+        default=0,
+        help="Contract chains of this many nodes with a single caller and callee.")
+    parser.add_argument(
+        "--cluster",
+        choices=["file", "module"],
+        help="Group the nodes by file or module.")
+    parser.add_argument(
+        "-v",
+        dest="verbosity",
+        action="count",
+        default=0,
+        help="Verbosity level.")
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of processes to parse the log with.")
+    parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        default=True,
+        help="Do not cache the parsed log next to the log file.")
     values = {
         "FileSystem": FileSystemBacktrace,
         "SPI": SpiBacktrace,
@@ -151,29 +738,52 @@ if __name__ == "__main__":
         "--type",
         choices=values.keys(),
         help="The backtrace class to use.")
+    parser.add_argument(
+        "--rules",
+        type=Path,
+        help="A YAML or TOML file with the EDGES and COLORS of the backtrace class.")
     args = parser.parse_args()
+    emdbg.logger.configure(args.verbosity)
+    if not args.file and not args.diff:
+        parser.error("the GDB log file or --diff is required")
+    logfile = args.diff[1] if args.diff else args.file
     BacktraceClass = values.get(args.type)
+    if args.rules:
+        BacktraceClass = backtrace_class_from_file(args.rules, BacktraceClass or Backtrace)
 
     if BacktraceClass is None:
-        if "_sdmmc" in args.file.name:
+        if "_sdmmc" in logfile.name:
             BacktraceClass = FileSystemBacktrace
-        elif "_spi" in args.file.name:
+        elif "_spi" in logfile.name:
             BacktraceClass = SpiBacktrace
-        elif "_i2c" in args.file.name:
+        elif "_i2c" in logfile.name:
             BacktraceClass = I2cBacktrace
-        elif "_can" in args.file.name:
+        elif "_can" in logfile.name:
             BacktraceClass = CanBacktrace
-        elif "_uart" in args.file.name:
+        elif "_uart" in logfile.name:
             BacktraceClass = UartBacktrace
-        elif "_semaphore" in args.file.name:
+        elif "_semaphore" in logfile.name:
             BacktraceClass = SemaphoreBacktrace
         else:
             BacktraceClass = Backtrace
 
     graphviz = args.graphviz
     if args.svg:
-        graphviz = Path(str(args.file.with_suffix(".svg")).replace("calltrace_", "callgraph_"))
+        graphviz = Path(str(logfile.with_suffix(".svg")).replace("calltrace_", "callgraph_"))
+        if args.diff:
+            graphviz = graphviz.with_stem(graphviz.stem + "_diff")
+
+    if args.diff:
+        import rich
+        changes = callgraph_diff(*args.diff, BacktraceClass, output_graphviz=graphviz,
+                                 jobs=args.jobs, cache=args.cache)
+        rich.print(callgraph_diff_as_table(changes))
+        exit(0)
 
-    backtraces = re.split(r"(?:Breakpoint|Hardware .*?watchpoint) \d", read_gdb_log(args.file)[20:])
-    callgraph_from_backtrace(backtraces, BacktraceClass,
-                             output_graphviz=graphviz, output_pyvis=args.pyvis)
+    callgraph_from_backtrace(args.file, BacktraceClass, output_graphviz=graphviz,
+                             output_pyvis=args.pyvis, jobs=args.jobs, cache=args.cache,
+                             output_folded=args.folded, output_speedscope=args.speedscope,
+                             top=args.top, min_edge_count=args.min_edge_count,
+                             min_edge_percent=args.min_edge_percent,
+                             collapse_recursion=args.collapse_recursion,
+                             collapse_chains=args.collapse_chains, cluster=args.cluster)
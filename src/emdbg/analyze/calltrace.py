@@ -10,7 +10,6 @@ if __name__ == "__main__":
     import emdbg
     import argparse
     from pathlib import Path
-    from .utils import read_gdb_log
     from ..bench.fmu import _arguments
 
     values = {
@@ -38,6 +37,11 @@ if __name__ == "__main__":
             choices=values.keys(),
             default="Generic",
             help="The backtrace class to use.")
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of processes to analyze the log with.")
 
     args, backend = _arguments("Generate call graphs of a function or memory location", _modifier)
     print(f"Logging for: {', '.join(args.commands)}")
@@ -58,6 +62,6 @@ if __name__ == "__main__":
         bench.gdb.interrupt_and_wait()
         bench.gdb.execute("px4_log_stop")
 
-        backtraces = re.split(r"(?:Breakpoint|Hardware .*?watchpoint) \d", read_gdb_log(calltrace)[20:])
-        emdbg.analyze.callgraph_from_backtrace(backtraces, values.get(args.type),
-                                               output_graphviz=calltrace.with_suffix(".svg"))
+        emdbg.analyze.callgraph_from_backtrace(calltrace, values.get(args.type),
+                                               output_graphviz=calltrace.with_suffix(".svg"),
+                                               jobs=args.jobs)
@@ -0,0 +1,411 @@
+# Copyright (c) 2023, Auterion AG
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+# Fast DWARF DIE Scanner
+
+Parsing every DIE of a large firmware with pyelftools is slow, since it
+constructs objects for all attributes of all DIEs, including the large
+subtrees of types and variables. The `DieScanner` instead walks the DIEs of a
+compilation unit iteratively straight from the `.debug_info` section using the
+abbreviation tables. It only decodes the requested attributes of the requested
+tags and jumps over the subtrees of all other tags, either via their
+`DW_AT_sibling` attribute or by only computing the size of their attributes.
+
+Compilation units that use attribute forms the scanner cannot decode are
+transparently analyzed with pyelftools instead.
+"""
+
+from __future__ import annotations
+import hashlib
+import logging
+from pathlib import Path
+from typing import Iterator
+from elftools.dwarf.descriptions import describe_form_class
+from elftools.dwarf.ranges import RangeEntry
+
+LOGGER = logging.getLogger(__name__)
+
+# Tags whose children may contain subprograms or inlined subroutines
+_SCOPES = {"DW_TAG_compile_unit", "DW_TAG_subprogram", "DW_TAG_lexical_block",
+           "DW_TAG_inlined_subroutine", "DW_TAG_namespace"}
+# Tags whose children may contain subprogram declarations
+_TYPE_SCOPES = {"DW_TAG_structure_type", "DW_TAG_class_type", "DW_TAG_union_type"}
+
+_FIXED_SIZE = {
+    "DW_FORM_flag_present": 0, "DW_FORM_implicit_const": 0,
+    "DW_FORM_data1": 1, "DW_FORM_ref1": 1, "DW_FORM_flag": 1, "DW_FORM_strx1": 1, "DW_FORM_addrx1": 1,
+    "DW_FORM_data2": 2, "DW_FORM_ref2": 2, "DW_FORM_strx2": 2, "DW_FORM_addrx2": 2,
+    "DW_FORM_strx3": 3, "DW_FORM_addrx3": 3,
+    "DW_FORM_data4": 4, "DW_FORM_ref4": 4, "DW_FORM_strx4": 4, "DW_FORM_addrx4": 4,
+    "DW_FORM_ref_sup4": 4,
+    "DW_FORM_data8": 8, "DW_FORM_ref8": 8, "DW_FORM_ref_sig8": 8, "DW_FORM_ref_sup8": 8,
+    "DW_FORM_data16": 16,
+}
+_OFFSET_SIZE = {"DW_FORM_strp", "DW_FORM_line_strp", "DW_FORM_sec_offset", "DW_FORM_strp_sup",
+                "DW_FORM_GNU_strp_alt", "DW_FORM_GNU_ref_alt"}
+_ULEB = {"DW_FORM_udata", "DW_FORM_ref_udata", "DW_FORM_strx", "DW_FORM_addrx",
+         "DW_FORM_rnglistx", "DW_FORM_loclistx", "DW_FORM_GNU_str_index", "DW_FORM_GNU_addr_index"}
+# Forms whose values are plain unsigned integers
+_INTEGER = {"DW_FORM_data1", "DW_FORM_data2", "DW_FORM_data4", "DW_FORM_data8",
+            "DW_FORM_ref1", "DW_FORM_ref2", "DW_FORM_ref4", "DW_FORM_ref8", "DW_FORM_ref_addr",
+            "DW_FORM_addr", "DW_FORM_sec_offset", "DW_FORM_flag", "DW_FORM_udata",
+            "DW_FORM_ref_udata"}
+
+# Forms whose values depend on the layout of the other compilation units
+_VOLATILE = {"DW_FORM_addr", "DW_FORM_strp", "DW_FORM_line_strp", "DW_FORM_sec_offset",
+             "DW_FORM_strp_sup", "DW_FORM_GNU_strp_alt", "DW_FORM_strx1", "DW_FORM_strx2", "DW_FORM_strx3", "DW_FORM_strx4",
+             "DW_FORM_addrx1", "DW_FORM_addrx2", "DW_FORM_addrx3", "DW_FORM_addrx4"}
+# Forms whose values cannot be compared across builds
+_FOREIGN = {"DW_FORM_ref_addr", "DW_FORM_GNU_ref_alt", "DW_FORM_rnglistx"}
+_BLOCKS = {"DW_FORM_exprloc": 0, "DW_FORM_block": 0,
+           "DW_FORM_block1": 1, "DW_FORM_block2": 2, "DW_FORM_block4": 4}
+
+_INLINED_ATTRS = {"DW_AT_call_file", "DW_AT_call_line", "DW_AT_abstract_origin",
+                  "DW_AT_high_pc", "DW_AT_ranges"}
+_DECL_ATTRS = {"DW_AT_decl_file", "DW_AT_decl_line"}
+_SUBPROGRAM_ATTRS = {"DW_AT_name", "DW_AT_low_pc", "DW_AT_high_pc", "DW_AT_inline"} | _DECL_ATTRS
+
+
+class UnsupportedDwarf(Exception):
+    """The DWARF data uses a feature the `DieScanner` cannot decode"""
+
+
+def _uleb(data: bytes, pos: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80: return result, pos
+        shift += 7
+
+
+def _sleb(data: bytes, pos: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return (result - (1 << shift)) if byte & 0x40 else result, pos
+
+
+class DieScanner:
+    """
+    Iterative scanner over the raw DIEs of the compilation units of a
+    `DWARFInfo`. Create it once per DWARF info, since it copies the sections.
+    """
+    def __init__(self, dwarf_info):
+        if not dwarf_info.config.little_endian:
+            raise UnsupportedDwarf("Big-endian DWARF data is not supported")
+        self._dwarf_info = dwarf_info
+        self._info = dwarf_info.debug_info_sec.stream.getvalue()
+        self._str = dwarf_info.debug_str_sec.stream.getvalue() if dwarf_info.debug_str_sec else b""
+        self._line_str = (dwarf_info.debug_line_str_sec.stream.getvalue()
+                          if getattr(dwarf_info, "debug_line_str_sec", None) else b"")
+        self._abbrevs = {}
+        self._origins = {}
+
+    def _abbrev(self, CU, code: int) -> tuple:
+        key = (CU["debug_abbrev_offset"], CU.structs.dwarf_format, CU["address_size"], CU["version"], code)
+        if (abbrev := self._abbrevs.get(key)) is None:
+            decl = CU.get_abbrev_table().get_abbrev(code)
+            offset_size = CU.structs.dwarf_format // 8
+            specs, fixed_size = [], 0
+            for spec in decl["attr_spec"]:
+                form = spec.form
+                if (size := _FIXED_SIZE.get(form)) is None:
+                    if form in _OFFSET_SIZE: size = offset_size
+                    elif form == "DW_FORM_addr": size = CU["address_size"]
+                    elif form == "DW_FORM_ref_addr":
+                        size = CU["address_size"] if CU["version"] == 2 else offset_size
+                if size is None: fixed_size = None
+                elif fixed_size is not None: fixed_size += size
+                specs.append((spec.name, form, size, spec.get("value")))
+            forms = {s[0]: s[1] for s in specs}
+            abbrev = self._abbrevs[key] = (decl["tag"], decl.has_children(), fixed_size,
+                                           tuple(specs), forms)
+        return abbrev
+
+    def _string(self, section: bytes, offset: int) -> str:
+        return section[offset:section.index(b"\0", offset)].decode()
+
+    def _attributes(self, specs: tuple, pos: int, names: set[str]) -> tuple[dict, int]:
+        data = self._info
+        values = {}
+        for name, form, size, const in specs:
+            wanted = name in names
+            if size is not None:
+                if wanted:
+                    if form == "DW_FORM_strp": values[name] = self._string(self._str, int.from_bytes(data[pos:pos + size], "little"))
+                    elif form == "DW_FORM_line_strp": values[name] = self._string(self._line_str, int.from_bytes(data[pos:pos + size], "little"))
+                    elif form == "DW_FORM_flag_present": values[name] = True
+                    elif form == "DW_FORM_implicit_const": values[name] = const
+                    elif form in _INTEGER: values[name] = int.from_bytes(data[pos:pos + size], "little")
+                    else: raise UnsupportedDwarf(f"Cannot decode {name} with {form}")
+                pos += size
+            elif form in _ULEB:
+                value, pos = _uleb(data, pos)
+                if wanted:
+                    if form not in _INTEGER: raise UnsupportedDwarf(f"Cannot decode {name} with {form}")
+                    values[name] = value
+            elif form == "DW_FORM_sdata":
+                value, pos = _sleb(data, pos)
+                if wanted: values[name] = value
+            elif form == "DW_FORM_string":
+                end = data.index(b"\0", pos)
+                if wanted: values[name] = data[pos:end].decode()
+                pos = end + 1
+            elif form in ("DW_FORM_exprloc", "DW_FORM_block"):
+                length, pos = _uleb(data, pos)
+                if wanted: raise UnsupportedDwarf(f"Cannot decode {name} with {form}")
+                pos += length
+            elif form in ("DW_FORM_block1", "DW_FORM_block2", "DW_FORM_block4"):
+                width = int(form[-1])
+                length = int.from_bytes(data[pos:pos + width], "little")
+                if wanted: raise UnsupportedDwarf(f"Cannot decode {name} with {form}")
+                pos += width + length
+            else:
+                raise UnsupportedDwarf(f"Unsupported form {form}")
+        return values, pos
+
+    def iter_dies(self, CU, tags: dict[str, set[str]], descend: set[str] = _SCOPES) \
+            -> Iterator[tuple[int, str, dict, dict]]:
+        """
+        Walks the DIEs of a compilation unit in the order of their offsets.
+
+        :param CU: The compilation unit to scan.
+        :param tags: Mapping of the tags to yield to the attributes to decode.
+        :param descend: The tags whose children are scanned. The subtrees of all
+                        other tags are skipped.
+        :return: a generator of the offset, tag, decoded attributes and the
+                 forms of all attributes of the DIEs with the requested tags.
+        """
+        data = self._info
+        pos, end = CU.cu_die_offset, CU.cu_offset + CU.size
+        # The depth below which the DIEs are skipped
+        depth, skip_depth = 0, None
+        while pos < end:
+            offset = pos
+            code, pos = _uleb(data, pos)
+            if code == 0:
+                depth -= 1
+                if depth == skip_depth: skip_depth = None
+                continue
+            tag, has_children, fixed_size, specs, forms = self._abbrev(CU, code)
+            if skip_depth is None and (names := tags.get(tag)) is not None:
+                values, pos = self._attributes(specs, pos, names)
+                yield offset, tag, values, forms
+            elif (skip_depth is None and has_children and tag not in descend and
+                  "DW_AT_sibling" in forms):
+                # Jump over the entire subtree
+                values, _ = self._attributes(specs, pos, {"DW_AT_sibling"})
+                pos = CU.cu_offset + values["DW_AT_sibling"]
+                continue
+            elif fixed_size is not None:
+                pos += fixed_size
+            else:
+                _, pos = self._attributes(specs, pos, ())
+            if has_children:
+                if skip_depth is None and tag not in descend:
+                    skip_depth = depth
+                depth += 1
+
+    def unit_bytes(self, CU) -> bytes:
+        """:return: the contribution of the compilation unit to `.debug_info`"""
+        return self._info[CU.cu_offset:CU.cu_offset + CU.size]
+
+    def abbrev_bytes(self, CU) -> bytes:
+        """:return: the raw abbreviation table of the compilation unit"""
+        data = self._dwarf_info.debug_abbrev_sec.stream.getbuffer()
+        start = pos = CU["debug_abbrev_offset"]
+        while True:
+            code, pos = _uleb(data, pos)
+            if code == 0: return bytes(data[start:pos])
+            _, pos = _uleb(data, pos)
+            pos += 1
+            while True:
+                name, pos = _uleb(data, pos)
+                form, pos = _uleb(data, pos)
+                if form == 0x21: _, pos = _sleb(data, pos)
+                if name == 0 and form == 0: break
+
+    def volatile_mask(self, CU) -> tuple[bytes, list[int]]:
+        """
+        Computes a mask of the compilation unit that clears all values that
+        depend on the layout of the other compilation units, such as addresses,
+        section and string offsets and location expressions. The sizes of the
+        variable length values are kept, so that two units with equal masked
+        bytes and abbreviation tables have the same DIE structure.
+
+        :return: the mask of the `unit_bytes()` and the positions of the
+                 `DW_AT_ranges` offsets of inlined subroutines in it.
+        :raises UnsupportedDwarf: if the unit refers to DIEs of other units or
+                                  its sizes cannot be compared across builds.
+        """
+        data, base = self._info, CU.cu_offset
+        mask = bytearray(b"\xff") * CU.size
+        # The header contains the offset of the abbreviation table
+        mask[:CU.cu_die_offset - base] = bytes(CU.cu_die_offset - base)
+        ranges = []
+        pos, end = CU.cu_die_offset, base + CU.size
+        while pos < end:
+            code, pos = _uleb(data, pos)
+            if code == 0: continue
+            tag, _, _, specs, _ = self._abbrev(CU, code)
+            for spec in specs:
+                name, form, _, _ = spec
+                # The inline analysis needs comparable sizes of the high PC and the ranges
+                if (form in _FOREIGN or (name == "DW_AT_high_pc" and form == "DW_FORM_addr") or
+                        (name == "DW_AT_ranges" and form != "DW_FORM_sec_offset")):
+                    raise UnsupportedDwarf(f"Unit @ {base} cannot be compared with form {form}")
+                start = pos
+                _, pos = self._attributes((spec, ), pos, ())
+                if form in _BLOCKS:
+                    # Only clear the content, but not the length of the block
+                    if (width := _BLOCKS[form]) == 0:
+                        _, start = _uleb(data, start)
+                    mask[start + width - base:pos - base] = bytes(pos - start - width)
+                elif form in _VOLATILE:
+                    mask[start - base:pos - base] = bytes(pos - start)
+                    if name == "DW_AT_ranges" and tag == "DW_TAG_inlined_subroutine":
+                        ranges.append(start - base)
+        return bytes(mask), ranges
+
+    def attributes(self, CU, offset: int, names: set[str]) -> dict:
+        """
+        :param offset: The section offset of a DIE in the compilation unit.
+        :return: the decoded attributes of the DIE, memoized by offset.
+        """
+        if (values := self._origins.get(offset)) is None:
+            code, pos = _uleb(self._info, offset)
+            values, _ = self._attributes(self._abbrev(CU, code)[3], pos, names)
+            self._origins[offset] = values
+        return values
+
+
+def masked_digest(data: bytes, mask: bytes) -> str:
+    """:return: the hash of the data with all bits cleared that are not set in the mask"""
+    value = int.from_bytes(data, "little") & int.from_bytes(mask, "little")
+    return hashlib.blake2b(value.to_bytes(len(data), "little"), digest_size=16).hexdigest()
+
+
+def die_scanner(dwarf_info) -> DieScanner | None:
+    """:return: the scanner of the DWARF info or `None` if it is not supported."""
+    try: return DieScanner(dwarf_info)
+    except UnsupportedDwarf as error:
+        LOGGER.debug(f"{error}, falling back to pyelftools")
+        return None
+
+
+def file_name(file_idx: int, line_program) -> str:
+    """
+    Returns a file name given a DIE file index, see
+    `emdbg.analyze.inline.InlineAnalyzer.get_file_name()`.
+    """
+    lp_header = line_program.header
+    file_entry = lp_header["file_entry"][file_idx - 1]
+    if (dir_index := file_entry["dir_index"]) == 0:
+        return str(Path(file_entry.name.decode()))
+    directory = lp_header["include_directory"][dir_index - 1]
+    return str(Path(directory.decode()) / file_entry.name.decode())
+
+
+def _size(CU, attrs: dict, range_lists) -> int:
+    # Same as `emdbg.analyze.inline.InlineAnalyzer.get_size()`
+    if "DW_AT_high_pc" in attrs:
+        return attrs["DW_AT_high_pc"]
+    if "DW_AT_ranges" in attrs:
+        if range_lists is None:
+            raise ValueError(f"DWARF info is missing debug ranges, which is required for DIE: {attrs}.")
+        range_list = range_lists.get_range_list_at_offset(attrs["DW_AT_ranges"], cu=CU)
+        return sum(e.end_offset - e.begin_offset for e in range_list if isinstance(e, RangeEntry))
+    return 0
+
+
+def range_sizes(CU, unit: bytes, positions: list[int], range_lists) -> list[int]:
+    """
+    :param unit: The `DieScanner.unit_bytes()` of the compilation unit.
+    :param positions: The positions of `DW_AT_ranges` offsets in the unit.
+    :return: the sizes of the referenced range lists.
+    """
+    width = CU.structs.dwarf_format // 8
+    return [_size(CU, {"DW_AT_ranges": int.from_bytes(unit[p:p + width], "little")}, range_lists)
+            for p in positions]
+
+
+def _scanned_dies(scanner: DieScanner, CU, tags: set[str], descend: set[str]) -> Iterator[tuple]:
+    tags = {tag: _SUBPROGRAM_ATTRS if tag == "DW_TAG_subprogram" else _INLINED_ATTRS for tag in tags}
+    for _, tag, attrs, forms in scanner.iter_dies(CU, tags, descend):
+        if "DW_AT_call_file" in attrs:
+            attrs["origin"] = scanner.attributes(
+                CU, CU.cu_offset + attrs["DW_AT_abstract_origin"], _DECL_ATTRS)
+        yield tag, attrs, forms
+
+
+def _parsed_dies(CU, tags: set[str]) -> Iterator[tuple]:
+    # The reference implementation using the pyelftools DIEs
+    for die in CU.iter_DIEs():
+        if die.tag not in tags: continue
+        attrs = {n: a.value for n, a in die.attributes.items()}
+        if isinstance(attrs.get("DW_AT_name"), bytes):
+            attrs["DW_AT_name"] = attrs["DW_AT_name"].decode()
+        if "DW_AT_call_file" in attrs and die.tag == "DW_TAG_inlined_subroutine":
+            origin = CU.get_DIE_from_refaddr(CU.cu_offset + attrs["DW_AT_abstract_origin"])
+            attrs["origin"] = {n: a.value for n, a in origin.attributes.items()}
+        yield die.tag, attrs, {n: a.form for n, a in die.attributes.items()}
+
+
+def scan_cu(scanner: DieScanner | None, CU, range_lists, line_program,
+            subprograms: bool = False) -> tuple[list, list]:
+    """
+    Extracts the subprograms and inlined subroutines of a compilation unit.
+
+    :param scanner: The scanner of the DWARF info, or `None` to use pyelftools.
+    :param CU: The compilation unit to scan.
+    :param range_lists: The range lists of the DWARF info.
+    :param line_program: The line program of the compilation unit.
+    :param subprograms: Also extract the subprograms, which requires scanning
+                        the type subtrees for declarations.
+    :return: the subprogram rows of name, low PC, high PC, `DW_AT_inline`,
+             declaration file and line and the inlined subroutine rows of
+             declaration file and line, call file, call line and size, both in
+             DIE order.
+    """
+    tags = {"DW_TAG_inlined_subroutine"}
+    if subprograms: tags.add("DW_TAG_subprogram")
+    if scanner is not None:
+        try:
+            return _rows(CU, _scanned_dies(scanner, CU, tags, _SCOPES | _TYPE_SCOPES if subprograms else _SCOPES),
+                         range_lists, line_program)
+        except UnsupportedDwarf as error:
+            LOGGER.debug(f"CU @ {CU.cu_offset}: {error}, falling back to pyelftools")
+    return _rows(CU, _parsed_dies(CU, tags), range_lists, line_program)
+
+
+def _rows(CU, dies: Iterator[tuple], range_lists, line_program) -> tuple[list, list]:
+    def decl(attrs):
+        if line_program is None or not _DECL_ATTRS <= attrs.keys():
+            return None, None
+        return file_name(attrs["DW_AT_decl_file"], line_program), attrs["DW_AT_decl_line"]
+
+    subprograms, inlined = [], []
+    for tag, attrs, forms in dies:
+        if tag == "DW_TAG_subprogram":
+            low_pc = high_pc = None
+            if "DW_AT_low_pc" in attrs and "DW_AT_high_pc" in attrs:
+                low_pc, high_pc = attrs["DW_AT_low_pc"], attrs["DW_AT_high_pc"]
+                if describe_form_class(forms["DW_AT_high_pc"]) == "constant":
+                    high_pc += low_pc
+            subprograms.append((attrs.get("DW_AT_name"), low_pc, high_pc,
+                                attrs.get("DW_AT_inline"), *decl(attrs)))
+
+        elif line_program is not None and "DW_AT_call_file" in attrs:
+            decl_file, decl_line = decl(attrs["origin"])
+            if decl_file is not None:
+                inlined.append((decl_file, decl_line,
+                                file_name(attrs["DW_AT_call_file"], line_program),
+                                attrs["DW_AT_call_line"], _size(CU, attrs, range_lists)))
+    return subprograms, inlined
@@ -0,0 +1,284 @@
+# Copyright (c) 2023, Auterion AG
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+# Persistent ELF Index
+
+Several analyzers derive the same facts from the same firmware ELF file on
+every run, which takes minutes for the DWARF data of PX4. The `ElfIndex`
+extracts the symbols, the compilation units and their line tables, the
+subprograms and the inlined subroutines once and stores them in an SQLite
+database, which is keyed by the GNU build-id of the ELF file, or its content
+hash if it has none. All later runs on the same firmware only query the
+database.
+
+The index is stored in `~/.cache/emdbg` or `$XDG_CACHE_HOME/emdbg` by default.
+It is used by `emdbg.analyze.inline`, `emdbg.analyze.pcsample` and
+`emdbg.analyze.triage`.
+
+
+## Command Line Interface
+
+To build the index ahead of time and show its statistics:
+
+```sh
+python3 -m emdbg.analyze.elfindex firmware.elf --jobs 8
+```
+"""
+
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import sqlite3
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Iterator
+from elftools.elf.elffile import ELFFile
+from elftools.elf.sections import NoteSection, SymbolTableSection
+from .dwarfscan import DieScanner, die_scanner, scan_cu
+
+LOGGER = logging.getLogger(__name__)
+
+
+def default_cache_dir() -> Path:
+    """:return: the directory of the persistent caches of emdbg"""
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "emdbg"
+
+
+def build_id(elf: Path) -> str:
+    """
+    :return: the GNU build-id of the ELF file as hex string, or the hash of the
+             file content if it has no build-id.
+    """
+    with Path(elf).open("rb") as f:
+        for section in ELFFile(f).iter_sections():
+            if not isinstance(section, NoteSection): continue
+            for note in section.iter_notes():
+                if note["n_type"] == "NT_GNU_BUILD_ID":
+                    return note["n_desc"]
+        f.seek(0)
+        hasher = hashlib.blake2b(digest_size=20)
+        while chunk := f.read(1 << 20):
+            hasher.update(chunk)
+        return hasher.hexdigest()
+
+
+def _index_cu(dwarf_info, scanner: DieScanner | None, CU, range_lists) -> tuple:
+    """
+    Extracts the index rows of a single compilation unit.
+
+    :return: the unit name, compilation directory and line table, and the
+             subprogram and inlined subroutine rows in DIE order.
+    """
+    top_die = CU.get_top_DIE()
+    attrs = top_die.attributes
+    name = attrs["DW_AT_name"].value.decode() if "DW_AT_name" in attrs else ""
+    comp_dir = attrs["DW_AT_comp_dir"].value.decode() if "DW_AT_comp_dir" in attrs else None
+
+    line_program = dwarf_info.line_program_for_CU(CU)
+    lines = array("Q")
+    if line_program is None:
+        LOGGER.warning(f"CU @ {CU.cu_offset} DWARF info is missing line program.")
+    else:
+        for entry in line_program.get_entries():
+            if entry.state is not None:
+                lines.extend((entry.state.address, entry.state.file, entry.state.line))
+
+    subprograms, inlined = scan_cu(scanner, CU, range_lists, line_program, subprograms=True)
+    return name, comp_dir, lines.tobytes(), subprograms, inlined
+
+
+# The DWARF info of each worker process and the ELF file it is read from
+_WORKER = None
+
+def _init_worker(elf: Path):
+    global _WORKER
+    elf_file = open(elf, "rb")
+    dwarf_info = ELFFile(elf_file).get_dwarf_info()
+    _WORKER = (dwarf_info, die_scanner(dwarf_info), dwarf_info.range_lists(), elf_file)
+
+
+def _index_cu_at(cu_offset: int) -> tuple:
+    dwarf_info, scanner, range_lists, _ = _WORKER
+    return _index_cu(dwarf_info, scanner, dwarf_info.get_CU_at(cu_offset), range_lists)
+
+
+class ElfIndex:
+    """
+    SQLite index of the symbols and DWARF data of an ELF file. The index is
+    built when it is first opened for an ELF file with a new build-id.
+    """
+    VERSION = 2
+
+    def __init__(self, elf: Path, cache_dir: Path = None, jobs: int = 1):
+        """
+        :param elf: The ELF file to index.
+        :param cache_dir: The directory of the index files, see `default_cache_dir()`.
+        :param jobs: Number of processes to build the index with. `None` uses all CPUs.
+        """
+        self.elf = Path(elf)
+        self.key = build_id(self.elf)
+        cache_dir = Path(cache_dir or default_cache_dir())
+        self.path = cache_dir / f"{self.key}.elfindex"
+        if not self.path.exists():
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            self._build(jobs)
+        self._db = sqlite3.connect(self.path)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            self._db.close()
+            self._build(jobs)
+            self._db = sqlite3.connect(self.path)
+        self._files = dict(self._db.execute("SELECT id, path FROM files"))
+
+    def _build(self, jobs: int):
+        LOGGER.info(f"Indexing '{self.elf}' into '{self.path}'")
+        # Build into a temporary file so that an interrupted build is not used
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}")
+        db = sqlite3.connect(tmp_path)
+        db.executescript("""
+            CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT UNIQUE);
+            CREATE TABLE symbols (address INTEGER, size INTEGER, type TEXT, name TEXT);
+            CREATE TABLE units (id INTEGER PRIMARY KEY, offset INTEGER, name TEXT,
+                                comp_dir TEXT, lines BLOB);
+            CREATE TABLE subprograms (unit INTEGER, name TEXT, low_pc INTEGER, high_pc INTEGER,
+                                      inline INTEGER, decl_file INTEGER, decl_line INTEGER);
+            CREATE TABLE inlined (unit INTEGER, decl_file INTEGER, decl_line INTEGER,
+                                  call_file INTEGER, call_line INTEGER, size INTEGER);""")
+        files = {}
+        def fid(path):
+            if path is None: return None
+            return files.setdefault(path, len(files))
+
+        with self.elf.open("rb") as f:
+            elf_file = ELFFile(f)
+            symbols = []
+            for section in elf_file.iter_sections():
+                if not isinstance(section, SymbolTableSection): continue
+                for symbol in section.iter_symbols():
+                    if symbol.name and symbol["st_shndx"] != "SHN_UNDEF":
+                        symbols.append((symbol["st_value"], symbol["st_size"],
+                                        symbol["st_info"]["type"], symbol.name))
+            db.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?)", symbols)
+
+            offsets, dwarf_info = [], None
+            if elf_file.has_dwarf_info():
+                dwarf_info = elf_file.get_dwarf_info()
+                # Only the CU headers are parsed here
+                offsets = [CU.cu_offset for CU in dwarf_info.iter_CUs()]
+
+            with (nullcontext() if jobs == 1 else ProcessPoolExecutor(
+                    jobs or os.cpu_count(), initializer=_init_worker, initargs=(self.elf,))) as executor:
+                if executor is None:
+                    range_lists = dwarf_info.range_lists() if dwarf_info else None
+                    scanner = die_scanner(dwarf_info) if dwarf_info else None
+                    units = (_index_cu(dwarf_info, scanner, dwarf_info.get_CU_at(o), range_lists)
+                             for o in offsets)
+                else:
+                    units = executor.map(_index_cu_at, offsets)
+
+                for unit, (offset, (name, comp_dir, lines, subprograms, inlined)) in \
+                        enumerate(zip(offsets, units)):
+                    db.execute("INSERT INTO units VALUES (?, ?, ?, ?, ?)",
+                               (unit, offset, name, comp_dir, lines))
+                    db.executemany("INSERT INTO subprograms VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   ((unit, n, l, h, i, fid(df), dl) for n, l, h, i, df, dl in subprograms))
+                    db.executemany("INSERT INTO inlined VALUES (?, ?, ?, ?, ?, ?)",
+                                   ((unit, fid(df), dl, fid(cf), cl, s) for df, dl, cf, cl, s in inlined))
+
+        db.executemany("INSERT INTO files VALUES (?, ?)", ((i, p) for p, i in files.items()))
+        db.execute(f"PRAGMA user_version = {self.VERSION}")
+        db.commit()
+        db.close()
+        os.replace(tmp_path, self.path)
+
+    def symbols(self, types: tuple[str] = ("STT_FUNC", )) -> Iterator[tuple[int, int, str]]:
+        """
+        :param types: The symbol types to return, or `None` for all.
+        :return: the address, size and name of the defined symbols in the order
+                 of the symbol tables.
+        """
+        query = "SELECT address, size, name FROM symbols"
+        if types is not None:
+            query += f" WHERE type IN ({', '.join('?' * len(types))})"
+        yield from self._db.execute(query + " ORDER BY rowid", types or ())
+
+    def units(self) -> list[tuple[int, str, str | None]]:
+        """:return: the offset, name and compilation directory of all compilation units"""
+        return self._db.execute("SELECT offset, name, comp_dir FROM units ORDER BY id").fetchall()
+
+    def line_table(self, offset: int) -> list[tuple[int, int, int]]:
+        """
+        :param offset: The offset of the compilation unit.
+        :return: the address, file index and line of all line program states.
+        """
+        row = self._db.execute("SELECT lines FROM units WHERE offset = ?", (offset, )).fetchone()
+        if row is None: return []
+        lines = array("Q")
+        lines.frombytes(row[0])
+        return list(zip(lines[0::3], lines[1::3], lines[2::3]))
+
+    def subprograms(self) -> Iterator[tuple]:
+        """
+        :return: the unit name, compilation directory, name, low PC, high PC,
+                 `DW_AT_inline` value, declaration file and line of all
+                 subprogram DIEs in DIE order. Missing attributes are `None`.
+        """
+        for row in self._db.execute(
+                "SELECT u.name, u.comp_dir, s.name, s.low_pc, s.high_pc, s.inline, s.decl_file, "
+                "s.decl_line FROM subprograms s JOIN units u ON s.unit = u.id ORDER BY s.rowid"):
+            yield *row[:6], self._files.get(row[6]), row[7]
+
+    def inlined_subroutines(self) -> Iterator[tuple[str, int, str, str, int, int]]:
+        """
+        :return: the declaration file and line, unit name, call file, call line
+                 and size of all inlined subroutines in DIE order.
+        """
+        for decl_file, decl_line, unit, call_file, call_line, size in self._db.execute(
+                "SELECT i.decl_file, i.decl_line, u.name, i.call_file, i.call_line, i.size "
+                "FROM inlined i JOIN units u ON i.unit = u.id ORDER BY i.rowid"):
+            yield self._files[decl_file], decl_line, unit, self._files[call_file], call_line, size
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse, rich, emdbg
+
+    parser = argparse.ArgumentParser(description="Persistent ELF Index")
+    parser.add_argument(
+        "elf",
+        type=Path,
+        help="The ELF file to index.")
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="The directory of the index files.")
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=0,
+        help="Number of processes to build the index with, defaults to all CPUs.")
+    parser.add_argument(
+        "-v",
+        dest="verbosity",
+        action="count",
+        help="Verbosity level.")
+    args = parser.parse_args()
+    emdbg.logger.configure(args.verbosity)
+
+    with ElfIndex(args.elf, args.cache_dir, args.jobs or None) as index:
+        counts = {table: index._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ["symbols", "units", "subprograms", "inlined", "files"]}
+        rich.print(f"{index.path}: " + ", ".join(f"{c} {t}" for t, c in counts.items()))
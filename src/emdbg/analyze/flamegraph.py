@@ -0,0 +1,128 @@
+# Copyright (c) 2023, Auterion AG
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Exports the backtraces of a `emdbg.analyze.callgraph.CallGraph` as folded
+stacks for Brendan Gregg's `flamegraph.pl` and compatible viewers, or as
+[speedscope](https://www.speedscope.app) JSON. In contrast to graphviz, these
+formats scale to millions of samples.
+
+Stacks are weighted by their number of samples and are grouped by the
+backtrace type as root frame, if the backtrace class classified them.
+"""
+
+from __future__ import annotations
+import json
+from pathlib import Path
+from typing import Iterator
+from .callgraph import CallGraph
+from .backtrace import Frame
+
+
+def _frame_name(frame: Frame) -> str:
+    # Semicolons separate the frames of folded stacks
+    return frame.function_name.strip().replace(";", ":")
+
+
+def _frame_file(frame: Frame) -> str:
+    return frame.location.rsplit(":", 1)[0]
+
+
+def iter_stacks(graph: CallGraph) -> Iterator[tuple[list, int]]:
+    """
+    :param graph: The call graph of the parsed backtraces.
+    :return: a generator of the root-to-leaf frames of every unique backtrace,
+             starting with the backtrace type if it is known, and its number of
+             samples.
+    """
+    for btype, backtraces in graph.backtraces.items():
+        root = [] if btype is None else [str(btype)]
+        for frames, samples in backtraces.values():
+            yield root + frames[::-1], samples
+
+
+def folded_stacks(graph: CallGraph) -> dict[str, int]:
+    """
+    Folds the backtraces into `root;caller;callee` lines. Backtraces that only
+    differ in their function arguments are merged.
+
+    :param graph: The call graph of the parsed backtraces.
+    :return: the folded stacks and their number of samples.
+    """
+    stacks = {}
+    for frames, samples in iter_stacks(graph):
+        stack = ";".join(f.replace(";", ":") if isinstance(f, str) else _frame_name(f)
+                         for f in frames)
+        stacks[stack] = stacks.get(stack, 0) + samples
+    return stacks
+
+
+def write_folded_stacks(graph: CallGraph, output: Path):
+    """
+    Writes the folded stacks into a file for `flamegraph.pl` or compatible
+    viewers like speedscope, inferno or the Firefox profiler.
+
+    :param graph: The call graph of the parsed backtraces.
+    :param output: The output path, usually with a `.folded` suffix.
+    """
+    with Path(output).open("w") as f:
+        for stack, samples in folded_stacks(graph).items():
+            f.write(f"{stack} {samples}\n")
+
+
+def speedscope(graph: CallGraph, name: str = None) -> dict:
+    """
+    Converts the backtraces into a sampled speedscope profile, where every
+    unique backtrace is a single sample weighted by its number of samples.
+
+    :param graph: The call graph of the parsed backtraces.
+    :param name: The name of the profile.
+    :return: the speedscope file as JSON compatible dictionary.
+    """
+    frames, indices = [], {}
+    def _index(frame) -> int:
+        if isinstance(frame, str):
+            key, value = frame, {"name": frame}
+        else:
+            # GDB leaves a space between the function name and its arguments
+            key = (frame.function_name.strip(), frame.filename)
+            value = {"name": key[0], "file": _frame_file(frame)}
+        if (index := indices.get(key)) is None:
+            index = indices[key] = len(frames)
+            frames.append(value)
+        return index
+
+    samples, weights = [], []
+    for stack, count in iter_stacks(graph):
+        samples.append([_index(f) for f in stack])
+        weights.append(count)
+    total = sum(weights)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name or "Backtraces",
+        "exporter": "emdbg",
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name or "Backtraces",
+            "unit": "none",
+            "startValue": 0,
+            "endValue": total,
+            "samples": samples,
+            "weights": weights,
+        }],
+    }
+
+
+def write_speedscope(graph: CallGraph, output: Path, name: str = None):
+    """
+    Writes the backtraces into a speedscope JSON file.
+
+    :param graph: The call graph of the parsed backtraces.
+    :param output: The output path, usually with a `.speedscope.json` suffix.
+    :param name: The name of the profile. Defaults to the output file name.
+    """
+    output = Path(output)
+    profile = speedscope(graph, name or output.name.split(".")[0])
+    output.write_text(json.dumps(profile, separators=(",", ":")))
@@ -23,6 +23,15 @@ python3 -m emdbg.analyze.hardfault hardfault.log
 # or with an explicit name
 python3 -m emdbg.analyze.hardfault hardfault.log -o custom_name.txt
 ```
+
+To convert it to a sparse ARM ELF core file instead, which only contains the
+known memory and can be loaded by GDB natively:
+
+```sh
+# convert to hardfault_coredump.core
+python3 -m emdbg.analyze.hardfault hardfault.log --elf
+arm-none-eabi-gdb firmware.elf hardfault_coredump.core
+```
 """
 
 from __future__ import annotations
@@ -31,6 +40,7 @@ from pathlib import Path
 import statistics
 import itertools
 from collections import defaultdict
+from ..debug.px4.elfcore import words_to_memories, write_elf_core
 
 # FIXME: hardcoded for FMUv6x memory layout (also works for FMUv5x)
 _ADDR_RANGES = [
@@ -54,12 +64,13 @@ _UNKNOWN_REGS = [
     "d0", "d1", "d2", "d3", "d4", "d5", "d6", "d7", "d8", "d9", "d10", "d11", "d12", "d13", "d14", "d15",
 ]
 
-def convert(log: str) -> str:
+def _parse(log: str) -> tuple[dict[int, int], dict[str, int]]:
     """
-    Convert a hardfault log to
+    Parses the known memory words and registers out of a hardfault log.
+    Unknown registers are set to `0xfeedc0de`.
 
     :param log: The content of a hardfault log file.
-    :return: A formatted string containing the coredump.
+    :return: The known memory words by address and the register values.
     """
     lines = log.splitlines()
 
@@ -103,7 +114,18 @@ def convert(log: str) -> str:
     known_mems[0xE000_ED38] = fault_regs.get("b", 0)
     known_mems[0xE000_ED3C] = fault_regs.get("a", 0)
     known_mems[0xE000_EFA8] = fault_regs.get("ab", 0)
+    return known_mems, regs
+
+
+def convert(log: str) -> str:
+    """
+    Convert a hardfault log to the CrashDebug text format. Unknown memory is
+    filled with `0xfeedc0de`.
 
+    :param log: The content of a hardfault log file.
+    :return: A formatted string containing the coredump.
+    """
+    known_mems, regs = _parse(log)
     output = []
     for mem_start, mem_size in _ADDR_RANGES:
         for addr in range(mem_start, mem_start + mem_size, 16):
@@ -120,6 +142,21 @@ def convert(log: str) -> str:
     return "\n".join(output)
 
 
+def convert_to_elf(log: str, filename: Path) -> int:
+    """
+    Convert a hardfault log to a sparse ARM ELF core file, that only contains
+    the known memory and that GDB can load natively, see
+    `emdbg.debug.px4.elfcore`.
+
+    :param log: The content of a hardfault log file.
+    :param filename: The core file to write.
+    :return: The size of the core file in bytes.
+    """
+    known_mems, regs = _parse(log)
+    regs = {r: v for r, v in regs.items() if v != _UNKNOWN_MEM}
+    return write_elf_core(filename, words_to_memories(known_mems), regs)
+
+
 
 # -----------------------------------------------------------------------------
 if __name__ == "__main__":
@@ -136,12 +173,20 @@ if __name__ == "__main__":
         type=Path,
         default=None,
         help="The GDB log containing the semaphore boost trace.")
+    parser.add_argument(
+        "--elf",
+        action="store_true",
+        default=False,
+        help="Write a sparse ARM ELF core file instead.")
     args = parser.parse_args()
 
     if (outfile := args.output) is None:
-        outfile = args.log.with_suffix("_coredump.txt")
+        outfile = args.log.with_name(args.log.stem + ("_coredump.core" if args.elf else "_coredump.txt"))
 
-    outfile.write_text(convert(args.log.read_text()))
+    if args.elf:
+        convert_to_elf(args.log.read_text(), outfile)
+    else:
+        outfile.write_text(convert(args.log.read_text()))
 
 
 
@@ -18,6 +18,26 @@ python3 -m emdbg.analyze.inline -f test.elf
 ```
 
 The analysis can take some time as it has to traverse all DIEs of the DWARF data.
+The compilation units can be traversed in parallel with the same result:
+
+```sh
+python3 -m emdbg.analyze.inline -f test.elf --jobs 8
+```
+
+The DWARF data can also be indexed once per firmware build, so that later runs
+on the same ELF file only take a moment, see `emdbg.analyze.elfindex`:
+
+```sh
+python3 -m emdbg.analyze.inline -f test.elf --cache
+```
+
+When analyzing successive builds, for example in CI, the results of the
+compilation units that did not change since a previous build can be reused, so
+that only the changed units are analyzed:
+
+```sh
+python3 -m emdbg.analyze.inline -f test.elf --incremental
+```
 """
 
 from __future__ import annotations
@@ -25,14 +45,24 @@ from collections import defaultdict
 from dataclasses import dataclass
 from pathlib import Path
 import argparse
+import hashlib
+import json
 import logging
+import os
 import posixpath
+import sqlite3
+import time
+import zlib
 
 from elftools.elf.elffile import ELFFile
+from elftools.dwarf.compileunit import CompileUnit
 from elftools.dwarf.die import DIE
 from elftools.dwarf.lineprogram import LineProgram
 from elftools.dwarf.ranges import RangeEntry, RangeLists
 
+from .dwarfscan import DieScanner, UnsupportedDwarf, die_scanner, masked_digest, range_sizes, scan_cu
+from .elfindex import default_cache_dir
+
 import rich
 from rich.console import Console
 from rich.table import Table
@@ -148,14 +178,26 @@ class InlineAnalyzer:
     def __init__(self, call_overhead: int):
         self._call_overhead = call_overhead
         self._raw_inlined_functions = defaultdict(list)
+        self.reused_units = 0
+        """number of compilation units whose results were reused by the last incremental analysis."""
+        self.total_units = 0
+        """number of compilation units of the last incremental analysis."""
 
 
-    def get_inlined_functions(self, file_name: str) -> AnalysisResult:
+    def get_inlined_functions(self, file_name: str, jobs: int = 1, cache: Path | bool = False,
+                              incremental: Path | bool = False) -> AnalysisResult:
         """
         Returns the identified `InlinedFunction` in the given ELF file.
         This is only possible if DWARF debugging data is available which contains debug ranges and line program.
 
         :param file_name: path to the ELF file to analyze.
+        :param jobs: number of processes to traverse the compilation units with. `None` uses all CPUs.
+                     The result is identical to the serial traversal.
+        :param cache: use the persistent `emdbg.analyze.elfindex.ElfIndex` of the ELF file, which is only built once
+                      per build-id. `True` uses the default cache directory, otherwise the path of the directory.
+        :param incremental: reuse the results of unchanged compilation units from previous analyses of other builds,
+                            see `reused_units`. `True` uses `inline.cache` in the default cache directory, otherwise
+                            the path of the cache file.
 
         :return: on success, a `AnalysisResult` is returned. In case of errors an exception is raised.
 
@@ -164,6 +206,14 @@ class InlineAnalyzer:
         _LOGGER.info(f"Processing file: {file_name}")
         self._raw_inlined_functions.clear()
 
+        if cache:
+            from .elfindex import ElfIndex
+            with ElfIndex(file_name, None if cache is True else cache, jobs) as index:
+                for decl_file, decl_line, translation_unit, call_file, call_line, size in index.inlined_subroutines():
+                    called_function = InlinedInstance(translation_unit, Path(call_file), call_line, size)
+                    self._raw_inlined_functions[(Path(decl_file), decl_line)].append(called_function)
+            return self.raw_inlined_to_output()
+
         with open(file_name, "rb") as f:
             elf_file = ELFFile(f)
 
@@ -171,18 +221,108 @@ class InlineAnalyzer:
                 raise ValueError(f"{file_name} has no DWARF info.")
 
             dwarf_info = elf_file.get_dwarf_info()
-            range_lists = dwarf_info.range_lists()
 
-            for CU in dwarf_info.iter_CUs():
-                line_program = dwarf_info.line_program_for_CU(CU)
+            if incremental and (scanner := die_scanner(dwarf_info)) is not None:
+                cache = _InlinedCache(default_cache_dir() / "inline.cache" if incremental is True else incremental)
+                try: self._get_inlined_incremental(file_name, dwarf_info, scanner, cache, jobs)
+                finally: cache.close()
+                return self.raw_inlined_to_output()
+
+            if jobs == 1:
+                range_lists = dwarf_info.range_lists()
+                scanner = die_scanner(dwarf_info)
+                for CU in dwarf_info.iter_CUs():
+                    self.cu_get_inlined(CU, range_lists, scanner)
+                return self.raw_inlined_to_output()
+
+            # Only the CU headers are parsed here, the workers parse the DIEs
+            cu_sizes = [(CU.cu_offset, CU["unit_length"]) for CU in dwarf_info.iter_CUs()]
+
+        from concurrent.futures import ProcessPoolExecutor
+        # Schedule the largest CUs first to balance the load
+        order = sorted(range(len(cu_sizes)), key=lambda i: -cu_sizes[i][1])
+        with ProcessPoolExecutor(jobs or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(file_name, self._call_overhead)) as executor:
+            results = dict(zip(order, executor.map(_cu_get_inlined, (cu_sizes[i][0] for i in order))))
+
+        # Merge the partial results in CU order to preserve the serial order
+        for index in range(len(cu_sizes)):
+            for key, inlined_instances in results.pop(index):
+                self._raw_inlined_functions[key].extend(inlined_instances)
+        return self.raw_inlined_to_output()
 
-                if line_program is None:
-                    _LOGGER.warning("CU @ {CU.cu_offset} DWARF info is missing line program. Skipping CU.")
-                    continue
 
-                top_die = CU.get_top_DIE()
-                self.die_get_inlined_rec(top_die, line_program, range_lists)
-        return self.raw_inlined_to_output()
+    def _get_inlined_incremental(self, file_name: str, dwarf_info, scanner: DieScanner, cache: _InlinedCache,
+                                 jobs: int):
+        range_lists = dwarf_info.range_lists()
+        units, misses = [], []
+        for CU in dwarf_info.iter_CUs():
+            line_program = dwarf_info.line_program_for_CU(CU)
+
+            if line_program is None:
+                _LOGGER.warning(f"CU @ {CU.cu_offset} DWARF info is missing line program. Skipping CU.")
+                continue
+
+            translation_unit_name = self.get_translation_unit_name(CU.get_top_DIE())
+            shape = cache.shape(scanner, CU, translation_unit_name, line_program)
+            unit = scanner.unit_bytes(CU)
+            rows = cache.lookup(shape, unit, lambda positions: range_sizes(CU, unit, positions, range_lists))
+            if rows is None:
+                misses.append(len(units))
+            units.append([CU, translation_unit_name, shape, rows])
+
+        self.total_units, self.reused_units = len(units), len(units) - len(misses)
+        _LOGGER.info(f"Reusing {self.reused_units} of {self.total_units} CUs")
+
+        if jobs == 1:
+            scanned = (_scan_unit(dwarf_info, scanner, units[index][0], range_lists) for index in misses)
+            executor = None
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(jobs or os.cpu_count(), initializer=_init_worker,
+                                           initargs=(file_name, self._call_overhead))
+            scanned = executor.map(_cu_scan_unit, (units[index][0].cu_offset for index in misses))
+        try:
+            for index, (rows, mask, positions) in zip(misses, scanned):
+                CU, _, shape, _ = units[index]
+                units[index][3] = rows
+                if mask is not None:
+                    unit = scanner.unit_bytes(CU)
+                    cache.store(shape, unit, mask, positions, range_sizes(CU, unit, positions, range_lists), rows)
+        finally:
+            if executor is not None: executor.shutdown()
+
+        for _, translation_unit_name, _, rows in units:
+            for decl_file, decl_line, call_file, call_line, size in rows:
+                called_function = InlinedInstance(translation_unit_name, Path(call_file), call_line, size)
+                self._raw_inlined_functions[(Path(decl_file), decl_line)].append(called_function)
+
+
+    def cu_get_inlined(self, CU: CompileUnit, range_lists: RangeLists, scanner: DieScanner = None):
+        """
+        Extract information about inlined functions from all DIEs of a compilation unit.
+
+        :param CU: `CompileUnit` to be processed.
+        :param range_lists: `RangeLists` extracted from the DWARF debugging data.
+        :param scanner: `emdbg.analyze.dwarfscan.DieScanner` to only decode the required attributes and skip the
+                        subtrees that cannot contain inlined functions. If not set, all DIEs are traversed via
+                        `die_get_inlined_rec()`.
+        """
+        line_program = CU.dwarfinfo.line_program_for_CU(CU)
+
+        if line_program is None:
+            _LOGGER.warning(f"CU @ {CU.cu_offset} DWARF info is missing line program. Skipping CU.")
+            return
+
+        if scanner is None:
+            top_die = CU.get_top_DIE()
+            self.die_get_inlined_rec(top_die, line_program, range_lists)
+            return
+
+        translation_unit_name = self.get_translation_unit_name(CU.get_top_DIE())
+        for decl_file, decl_line, call_file, call_line, size in scan_cu(scanner, CU, range_lists, line_program)[1]:
+            called_function = InlinedInstance(translation_unit_name, Path(call_file), call_line, size)
+            self._raw_inlined_functions[(Path(decl_file), decl_line)].append(called_function)
 
 
     def die_get_inlined_rec(self, die: DIE, line_program: LineProgram, range_lists: RangeLists):
@@ -266,7 +406,7 @@ class InlineAnalyzer:
             if range_lists is None:
                 raise ValueError(f"DWARF info is missing debug ranges, which is required for DIE: {die}.")
 
-            range_list = range_lists.get_range_list_at_offset(die.attributes["DW_AT_ranges"].value)
+            range_list = range_lists.get_range_list_at_offset(die.attributes["DW_AT_ranges"].value, cu=die.cu)
             size = 0
             for entry in range_list:
                 if isinstance(entry, RangeEntry):
@@ -328,6 +468,97 @@ class InlineAnalyzer:
                               savings_total_size_wo_overhead, no_savings_total_size_wo_overhead)
 
 
+# -----------------------------------------------------------------------------
+class _InlinedCache:
+    """
+    SQLite cache of the inlined functions per compilation unit across builds.
+    A unit is looked up by its shape, which is its size, abbreviation table,
+    name and file names, and then identified by the hash of its content without
+    the values that depend on the layout of the other units, see
+    `emdbg.analyze.dwarfscan.DieScanner.volatile_mask()`.
+    """
+    VERSION = 1
+    CANDIDATES = 4
+    """number of units with the same shape to keep."""
+
+    def __init__(self, path: Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            self._db.executescript(f"""
+                DROP TABLE IF EXISTS units;
+                CREATE TABLE units (shape TEXT, digest TEXT, mask BLOB, ranges TEXT, rows TEXT,
+                                    used INTEGER, PRIMARY KEY (shape, digest));
+                PRAGMA user_version = {self.VERSION};""")
+
+    @staticmethod
+    def shape(scanner: DieScanner, CU: CompileUnit, translation_unit_name: str, line_program: LineProgram) -> str:
+        header = line_program.header
+        files = [(bytes(e.name), e.get("dir_index")) for e in header["file_entry"]]
+        directories = [bytes(getattr(d, "name", d)) for d in header["include_directory"]]
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(repr((CU["version"], CU["address_size"], CU.structs.dwarf_format, CU.size,
+                            translation_unit_name, files, directories)).encode())
+        hasher.update(scanner.abbrev_bytes(CU))
+        return hasher.hexdigest()
+
+    def lookup(self, shape: str, unit: bytes, range_sizes) -> list | None:
+        """:return: the cached rows of the unit or `None`."""
+        for digest, mask, ranges, rows in self._db.execute(
+                "SELECT digest, mask, ranges, rows FROM units WHERE shape = ? ORDER BY used DESC",
+                (shape, )).fetchall():
+            if masked_digest(unit, zlib.decompress(mask)) != digest: continue
+            # The range lists are stored outside the unit
+            positions, sizes = json.loads(ranges)
+            if range_sizes(positions) != sizes: continue
+            self._db.execute("UPDATE units SET used = ? WHERE shape = ? AND digest = ?",
+                             (time.time_ns(), shape, digest))
+            return json.loads(rows)
+        return None
+
+    def store(self, shape: str, unit: bytes, mask: bytes, positions: list[int], sizes: list[int], rows: list):
+        self._db.execute("INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?)",
+                         (shape, masked_digest(unit, mask), zlib.compress(mask, 1),
+                          json.dumps([positions, sizes]), json.dumps(rows), time.time_ns()))
+        self._db.execute("DELETE FROM units WHERE shape = ? AND digest NOT IN (SELECT digest FROM units "
+                         "WHERE shape = ? ORDER BY used DESC LIMIT ?)", (shape, shape, self.CANDIDATES))
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+def _scan_unit(dwarf_info, scanner: DieScanner, CU: CompileUnit, range_lists: RangeLists) -> tuple:
+    rows = scan_cu(scanner, CU, range_lists, dwarf_info.line_program_for_CU(CU))[1]
+    try: mask, positions = scanner.volatile_mask(CU)
+    except UnsupportedDwarf: mask, positions = None, []
+    return rows, mask, positions
+
+
+# -----------------------------------------------------------------------------
+# The ELF file and analyzer of each worker process
+_WORKER = None
+
+def _init_worker(file_name: str, call_overhead: int):
+    global _WORKER
+    elf_file = open(file_name, "rb")
+    dwarf_info = ELFFile(elf_file).get_dwarf_info()
+    _WORKER = (dwarf_info, dwarf_info.range_lists(), die_scanner(dwarf_info),
+               InlineAnalyzer(call_overhead), elf_file)
+
+
+def _cu_scan_unit(cu_offset: int) -> tuple:
+    dwarf_info, range_lists, scanner, *_ = _WORKER
+    return _scan_unit(dwarf_info, scanner, dwarf_info.get_CU_at(cu_offset), range_lists)
+
+
+def _cu_get_inlined(cu_offset: int) -> list[tuple[tuple[Path, int], list[InlinedInstance]]]:
+    dwarf_info, range_lists, scanner, inline_analyzer, _ = _WORKER
+    inline_analyzer._raw_inlined_functions.clear()
+    inline_analyzer.cu_get_inlined(dwarf_info.get_CU_at(cu_offset), range_lists, scanner)
+    return list(inline_analyzer._raw_inlined_functions.items())
+
+
 # -----------------------------------------------------------------------------
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Inline function analyzer to identify potential FLASH savings.")
@@ -361,12 +592,31 @@ if __name__ == "__main__":
         default=False,
         help="Include inlined functions that don't offer FLASH saving potential, i.e. functions that are only inlined once."
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        help="Number of processes to traverse the compilation units with. Defaults to 1, 0 uses all CPUs.",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Reuse the results of unchanged compilation units from the analyses of previous builds."
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        default=False,
+        help="Use the persistent index of the ELF file, which is only built on the first run for each firmware build."
+    )
 
     args = parser.parse_args()
 
     console = Console()
     inline_analyzer = InlineAnalyzer(args.overhead)
-    analysis_result = inline_analyzer.get_inlined_functions(args.file)
+    analysis_result = inline_analyzer.get_inlined_functions(args.file, args.jobs or None, args.cache, args.incremental)
 
     for i, inlined_function in enumerate(analysis_result.inlined_savings_list):
         if i < args.n or args.n == 0:
@@ -388,6 +638,9 @@ if __name__ == "__main__":
     console.print(f"Total potentially saveable space: {analysis_result.savings_total_size}")
     console.print(f"Total potentially saveable space without instruction overhead: {analysis_result.savings_total_size_wo_overhead}")
 
+    if args.incremental:
+        console.print(f"Reused compilation units: {inline_analyzer.reused_units} of {inline_analyzer.total_units}")
+
     if args.all:
         console.print(f"Total non-saveable space: {analysis_result.no_savings_total_size}")
         console.print(f"Total non-saveable space without instruction overhead: {analysis_result.no_savings_total_size_wo_overhead}")
@@ -0,0 +1,197 @@
+# Copyright (c) 2023, Auterion AG
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+# Latency Analysis of Calltraces
+
+The `px4_commands_backtrace` GDB commands stamp every backtrace with the HRT
+uptime and the DWT CYCCNT, which `emdbg.analyze.backtrace.Backtrace` parses
+into its `uptime` and `cycles` attributes. This module computes the latency
+between consecutive backtraces grouped by the transition of their type, for
+example from a `WRITE` to the `IRQ` of the SDMMC peripheral.
+
+.. note::
+   GDB halts the target for every breakpoint, which adds a constant overhead of
+   several milliseconds to every latency. Compare latencies relative to each
+   other, not to their absolute values.
+
+
+## Command Line Interface
+
+```sh
+python3 -m emdbg.analyze.latency calltrace_sdmmc.txt --type FileSystem
+# Only consider these backtrace types and use the CYCCNT at 216MHz
+python3 -m emdbg.analyze.latency calltrace_sdmmc.txt --type FileSystem \\
+    --types WRITE IRQ --frequency 216 --histogram
+```
+"""
+
+from __future__ import annotations
+import logging
+import math
+import statistics
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Iterator
+from .backtrace import Backtrace
+from .utils import iter_backtraces
+
+LOGGER = logging.getLogger(__name__)
+
+
+class LatencyHistogram:
+    """
+    Collects latencies in microseconds into power-of-two buckets.
+    """
+    def __init__(self):
+        self.latencies: list[float] = []
+        """All latencies in microseconds in the order they occurred"""
+
+    def add(self, latency: float):
+        self.latencies.append(latency)
+
+    @property
+    def buckets(self) -> dict[int, int]:
+        """The number of latencies per bucket with the upper bound in µs"""
+        buckets = defaultdict(int)
+        for latency in self.latencies:
+            buckets[2 ** max(0, math.ceil(math.log2(latency))) if latency > 0 else 0] += 1
+        return dict(sorted(buckets.items()))
+
+    def percentile(self, percent: float) -> float:
+        """:return: the latency below which the percentage of latencies fall"""
+        if len(self.latencies) < 2: return self.latencies[0]
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[
+            min(max(round(percent) - 1, 0), 98)]
+
+
+def _timestamp(backtrace: Backtrace) -> tuple[int, int | None] | None:
+    if backtrace.uptime is None: return None
+    return backtrace.uptime, backtrace.cycles
+
+
+def iter_latencies(backtraces: Iterable[Backtrace], types: list[str] = None,
+                   frequency: float = None) -> Iterator[tuple[str, str, float]]:
+    """
+    Computes the latency between consecutive backtraces with timestamps.
+
+    :param backtraces: The parsed backtraces in the order they were taken.
+    :param types: Only consider backtraces of these types and ignore all others.
+    :param frequency: The CPU frequency in MHz to convert the DWT CYCCNT into
+        microseconds. If not set, or the CYCCNT may have wrapped around, the
+        HRT uptime is used instead. If the CYCCNT does not advance while the
+        uptime does, the DWT is not enabled and the HRT uptime is used for all
+        remaining backtraces.
+    :return: a generator of the previous and current backtrace type and the
+             latency between them in microseconds.
+    """
+    previous = None
+    for backtrace in backtraces:
+        if types is not None and backtrace.type not in types: continue
+        if (stamp := _timestamp(backtrace)) is None: continue
+        if previous is not None:
+            (uptime0, cycles0), btype0 = previous
+            latency = stamp[0] - uptime0
+            if frequency and cycles0 is not None and stamp[1] is not None:
+                if stamp[1] == cycles0 and latency > 0:
+                    LOGGER.warning("The DWT CYCCNT is not counting, using the HRT uptime instead!")
+                    frequency = None
+                elif 0 <= latency < 0xffff_ffff / frequency:
+                    latency = ((stamp[1] - cycles0) & 0xffff_ffff) / frequency
+            yield btype0, backtrace.type, latency
+        previous = (stamp, backtrace.type)
+
+
+def latency_histograms(logfile: Path, BacktraceClass: Backtrace = None,
+                       types: list[str] = None, frequency: float = None) \
+                        -> dict[tuple[str, str], LatencyHistogram]:
+    """
+    Computes the latency histograms between the types of consecutive backtraces
+    in a GDB log.
+
+    :param logfile: The GDB log containing the timestamped backtraces.
+    :param BacktraceClass: One of the classes of `emdbg.analyze.backtrace`.
+    :param types: Only consider backtraces of these types, see `iter_latencies()`.
+    :param frequency: The CPU frequency in MHz, see `iter_latencies()`.
+    :return: The latency histogram for every (from, to) type transition.
+    """
+    if BacktraceClass is None:
+        BacktraceClass = Backtrace
+    backtraces = (BacktraceClass(d) for d in iter_backtraces(logfile))
+    histograms = defaultdict(LatencyHistogram)
+    for btype0, btype1, latency in iter_latencies(
+            (bt for bt in backtraces if bt.is_valid), types, frequency):
+        histograms[(btype0, btype1)].add(latency)
+    return dict(histograms)
+
+
+def latency_histograms_as_table(histograms: dict[tuple[str, str], LatencyHistogram]) \
+                                    -> "rich.table.Table":
+    """:return: a rich table of the latency statistics per transition"""
+    import rich.box
+    from rich.table import Table
+    table = Table(box=rich.box.MINIMAL_DOUBLE_HEAD)
+    table.add_column("Transition")
+    for column in ["Count", "Min", "P50", "P90", "P99", "Max"]:
+        table.add_column(column, justify="right")
+    for (btype0, btype1), histogram in sorted(histograms.items(), key=lambda h: -len(h[1].latencies)):
+        values = [min(histogram.latencies), histogram.percentile(50), histogram.percentile(90),
+                  histogram.percentile(99), max(histogram.latencies)]
+        table.add_row(f"{btype0} → {btype1}", str(len(histogram.latencies)),
+                      *(f"{v:.1f}µs" for v in values))
+    return table
+
+
+def format_histogram(histogram: LatencyHistogram, width: int = 50) -> str:
+    """:return: a text bar chart of the histogram buckets"""
+    buckets = histogram.buckets
+    largest = max(buckets.values())
+    return "\n".join(f"{'≤' + str(bound) + 'µs':>12} {count:>8} {'█' * math.ceil(count / largest * width)}"
+                     for bound, count in buckets.items())
+
+
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse, rich
+    from .backtrace import *
+
+    values = {
+        "FileSystem": FileSystemBacktrace,
+        "SPI": SpiBacktrace,
+        "I2C": I2cBacktrace,
+        "CAN": CanBacktrace,
+        "UART": UartBacktrace,
+        "Semaphore": SemaphoreBacktrace,
+        "Generic": Backtrace,
+    }
+    parser = argparse.ArgumentParser(description="Calltrace Latency Analyzer")
+    parser.add_argument(
+        "file",
+        type=Path,
+        help="The GDB log containing the timestamped backtraces.")
+    parser.add_argument(
+        "--type",
+        choices=values.keys(),
+        default="Generic",
+        help="The backtrace class to use.")
+    parser.add_argument(
+        "--types",
+        nargs="+",
+        help="Only consider backtraces of these types.")
+    parser.add_argument(
+        "--frequency",
+        type=float,
+        help="The CPU frequency in MHz to use the CYCCNT instead of the HRT uptime.")
+    parser.add_argument(
+        "--histogram",
+        action="store_true",
+        default=False,
+        help="Also print the histogram of every transition.")
+    args = parser.parse_args()
+
+    histograms = latency_histograms(args.file, values[args.type], args.types, args.frequency)
+    rich.print(latency_histograms_as_table(histograms))
+    if args.histogram:
+        for (btype0, btype1), histogram in histograms.items():
+            print(f"\n{btype0} → {btype1}:")
+            print(format_histogram(histogram))
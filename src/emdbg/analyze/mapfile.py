@@ -0,0 +1,216 @@
+# Copyright (c) 2024, Auterion AG
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+# GNU ld Map Files
+
+Parses the map file that GNU ld writes with `-Wl,-Map=firmware.map` into
+indexes of the discarded input sections, the input sections that were kept in
+each output section and the size that every library and object file
+contributes to the firmware.
+
+The `emdbg.analyze.size` analyzer uses it to remove the sections that the
+linker garbage collected from its results.
+
+
+## Command Line Interface
+
+To show the size contribution of all libraries and the largest object files:
+
+```sh
+python3 -m emdbg.analyze.mapfile firmware.map --objects 20
+```
+"""
+
+from __future__ import annotations
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+# An input section, whose values may be wrapped onto the next line if its name is long
+_INPUT_SECTION = re.compile(r"^ ([^\s*]\S*|\*fill\*)(?:\s+0x([0-9a-fA-F]+)\s+0x([0-9a-fA-F]+)(?:\s+(.+))?)?$")
+_OUTPUT_SECTION = re.compile(r"^([^\s*]\S*)(?:\s+0x([0-9a-fA-F]+)\s+0x([0-9a-fA-F]+))?(?:\s+load address.*)?$")
+_WRAPPED_VALUES = re.compile(r"^\s+0x([0-9a-fA-F]+)\s+0x([0-9a-fA-F]+)(?:\s+(.+))?$")
+_ARCHIVE_MEMBER = re.compile(r"^(.+\.a)\((.+)\)$")
+_KEYWORDS = ("LOAD ", "OUTPUT(", "START GROUP", "END GROUP", "INPUT(", "TARGET(")
+
+
+@dataclass
+class InputSection:
+    """An input section of an object file"""
+    name: str
+    """name of the input section."""
+    output_section: str | None
+    """name of the output section that contains the input section, `None` if it was discarded."""
+    address: int
+    """address of the input section."""
+    size: int
+    """size of the input section."""
+    archive: str | None
+    """path of the library that contains the object file, `None` for object files that were linked directly."""
+    object_file: str
+    """path or archive member name of the object file."""
+
+    @property
+    def library(self) -> str:
+        """The library or, if linked directly, the object file"""
+        return self.archive or self.object_file
+
+
+def _input_section(name: str, output_section: str | None, address: str, size: str, source: str) -> InputSection:
+    archive, object_file = None, source.strip()
+    if match := _ARCHIVE_MEMBER.match(object_file):
+        archive, object_file = match.groups()
+    return InputSection(name, output_section, int(address, 16), int(size, 16), archive, object_file)
+
+
+class MapFile:
+    """
+    Indexes of a GNU ld map file, which are built once, so that all queries
+    take constant time.
+
+    :param content: The contents of the map file.
+    """
+    def __init__(self, content: str):
+        self.input_sections: list[InputSection] = []
+        """all kept input sections in the order of the map file."""
+        self.discarded_sections: list[InputSection] = []
+        """all input sections that were removed by the linker."""
+        self.output_sections: dict[str, tuple[int, int]] = {}
+        """the address and size of all output sections."""
+        self._parse(content)
+        self._kept = {}
+        for section in self.input_sections:
+            self._kept.setdefault(section.name, []).append(section)
+        self._discarded = {section.name for section in self.discarded_sections}
+
+    @classmethod
+    def from_file(cls, path: Path) -> MapFile:
+        """:return: the parsed map file"""
+        return cls(Path(path).read_text(errors="replace"))
+
+    def _parse(self, content: str):
+        part, output_section = None, None
+        # The input or output section whose values are on the next line
+        pending = None
+        for line in content.splitlines():
+            if line.startswith("Discarded input sections"):
+                part = "discarded"
+                continue
+            if line.startswith("Memory Configuration"):
+                part = None
+                continue
+            if line.startswith("Linker script and memory map"):
+                part = "map"
+                continue
+            if part is None: continue
+
+            if pending is not None:
+                kind, name = pending
+                pending = None
+                if match := _WRAPPED_VALUES.match(line):
+                    address, size, source = match.groups()
+                    if kind == "output":
+                        self.output_sections[name] = (int(address, 16), int(size, 16))
+                    elif source is not None:
+                        self._add(name, output_section, address, size, source, part)
+                    continue
+
+            if part == "map" and (match := _OUTPUT_SECTION.match(line)) and not line.startswith(_KEYWORDS):
+                output_section, address, size = match.groups()
+                if address is None:
+                    pending = ("output", output_section)
+                else:
+                    self.output_sections[output_section] = (int(address, 16), int(size, 16))
+            elif match := _INPUT_SECTION.match(line):
+                name, address, size, source = match.groups()
+                if address is None:
+                    pending = ("input", name)
+                elif source is not None and name != "*fill*":
+                    self._add(name, output_section, address, size, source, part)
+
+    def _add(self, name: str, output_section: str | None, address: str, size: str, source: str, part: str):
+        if name == "*fill*": return
+        if part == "discarded" or output_section == "/DISCARD/":
+            self.discarded_sections.append(_input_section(name, None, address, size, source))
+        else:
+            self.input_sections.append(_input_section(name, output_section, address, size, source))
+
+    def is_kept(self, section_name: str) -> bool:
+        """:return: whether an input or output section of this name is part of the linked file."""
+        return section_name in self._kept or section_name in self.output_sections
+
+    def is_discarded(self, section_name: str) -> bool:
+        """:return: whether all input sections of this name were removed by the linker."""
+        return section_name in self._discarded and section_name not in self._kept
+
+    def output_section(self, section_name: str) -> str | None:
+        """:return: the output section that contains the first input section of this name, or `None`."""
+        if sections := self._kept.get(section_name):
+            return sections[0].output_section
+        return None
+
+    def _allocated_sections(self):
+        # Non-allocated output sections like the debug sections are located at address zero
+        for section in self.input_sections:
+            if self.output_sections.get(section.output_section, (0, 0))[0]:
+                yield section
+
+    def library_sizes(self) -> dict[str, int]:
+        """:return: the size of the allocated input sections per library, largest first."""
+        sizes = {}
+        for section in self._allocated_sections():
+            sizes[section.library] = sizes.get(section.library, 0) + section.size
+        return dict(sorted(sizes.items(), key=lambda s: (-s[1], s[0])))
+
+    def object_sizes(self) -> dict[tuple[str | None, str], int]:
+        """:return: the size of the allocated input sections per archive and object file, largest first."""
+        sizes = {}
+        for section in self._allocated_sections():
+            key = (section.archive, section.object_file)
+            sizes[key] = sizes.get(key, 0) + section.size
+        return dict(sorted(sizes.items(), key=lambda s: (-s[1], s[0][1])))
+
+
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse, rich, rich.box
+    from rich.table import Table
+
+    parser = argparse.ArgumentParser(description="GNU ld map file analyzer.")
+    parser.add_argument(
+        "map_file",
+        type=Path,
+        help="The map file of the linker.")
+    parser.add_argument(
+        "--objects",
+        type=int,
+        nargs="?",
+        const=20,
+        help="Also show the largest object files, 20 by default.")
+    args = parser.parse_args()
+
+    map_file = MapFile.from_file(args.map_file)
+    discarded_size = sum(section.size for section in map_file.discarded_sections)
+    rich.print(f"{len(map_file.input_sections)} input sections in {len(map_file.output_sections)} output sections, "
+               f"{len(map_file.discarded_sections)} discarded input sections ({discarded_size} bytes)")
+
+    library_sizes = map_file.library_sizes()
+    total_size = sum(library_sizes.values()) or 1
+    table = Table(box=rich.box.MINIMAL_DOUBLE_HEAD)
+    table.add_column("Library")
+    table.add_column("Size", justify="right")
+    table.add_column("%", justify="right")
+    for library, size in library_sizes.items():
+        table.add_row(library, str(size), f"{size / total_size * 100:.2f}")
+    rich.print(table)
+
+    if args.objects is not None:
+        table = Table(box=rich.box.MINIMAL_DOUBLE_HEAD)
+        table.add_column("Library")
+        table.add_column("Object file")
+        table.add_column("Size", justify="right")
+        table.add_column("%", justify="right")
+        for (archive, object_file), size in list(map_file.object_sizes().items())[:args.objects]:
+            table.add_row(archive or "", object_file, str(size), f"{size / total_size * 100:.2f}")
+        rich.print(table)
@@ -0,0 +1,302 @@
+# Copyright (c) 2023, Auterion AG
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+# Statistical PC Sampling Profiler
+
+In contrast to `emdbg.analyze.calltrace`, which halts the target on every
+breakpoint, the DWT can periodically sample the program counter and emit it as
+an ITM hardware packet over SWO without stopping the target. This module
+decodes these packets from a recorded SWO byte stream, symbolizes them using
+the ELF file and aggregates them into a flat profile per address and a profile
+per function.
+
+Configure the SWO trace with the `px4_trace_swo_stm32f7` or
+`px4_trace_swo_stm32h7` GDB commands, which write the raw ITM stream to
+`trace.swo`, then enable the PC sampling without halting the target:
+
+```
+(gdb) px4_trace_swo_stm32f7 0xffffffff 2000000
+(gdb) px4_trace_pc_sampling 2
+(gdb) continue
+```
+
+The sampling interval is `(POSTCNT reload + 1) * 1024` cycles, so `2` samples
+every 3072 cycles or ~14µs at 216MHz, which may overflow slow SWO links.
+Overflows and sleep samples are counted in the profile.
+
+.. note::
+   The decoder expects the raw ITM stream without TPIU formatting. If your
+   probe outputs TPIU frames, demultiplex them first, for example with
+   orbuculum.
+
+
+## Command Line Interface
+
+```sh
+python3 -m emdbg.analyze.pcsample trace.swo --elf firmware.elf
+# also show the 50 most sampled addresses
+python3 -m emdbg.analyze.pcsample trace.swo --elf firmware.elf --flat 50
+```
+"""
+
+from __future__ import annotations
+import bisect
+from collections import Counter
+from pathlib import Path
+from typing import Iterator
+from elftools.elf.elffile import ELFFile
+from elftools.elf.sections import SymbolTableSection
+
+# DWT hardware source packets: discriminator ID 2 with a 4-byte payload is a
+# periodic PC sample, with a 1-byte payload it is a sleep sample.
+_DWT_PC_SAMPLE = 0x17
+_DWT_PC_SLEEP = 0x15
+_OVERFLOW = 0x70
+_SOURCE_SIZE = (0, 1, 2, 4)
+
+
+class PcSampleDecoder:
+    """
+    Decodes the periodic PC samples of the DWT from an ITM byte stream.
+    Synchronization, overflow, timestamp and extension packets as well as other
+    instrumentation and hardware source packets are skipped. The stream can be
+    fed in arbitrary chunks, incomplete packets are kept until the next chunk.
+    """
+    def __init__(self):
+        self.samples = 0
+        """Number of decoded PC samples including sleep samples"""
+        self.sleeps = 0
+        """Number of samples taken while the core was sleeping"""
+        self.overflows = 0
+        """Number of overflow packets, after which samples were lost"""
+        self._pending = b""
+
+    def decode(self, data: bytes) -> Iterator[int | None]:
+        """
+        :param data: The next chunk of the raw ITM stream.
+        :return: a generator of the sampled PC values or `None` if the core was
+                 sleeping.
+        """
+        data = self._pending + data
+        index, size = 0, len(data)
+        while index < size:
+            header = data[index]
+            if header == 0:
+                # Synchronization: at least 47 zero bits followed by a one bit
+                end = index
+                while end < size and data[end] == 0:
+                    end += 1
+                if end == size: break
+                index = end + (data[end] == 0x80)
+            elif header == _OVERFLOW:
+                self.overflows += 1
+                index += 1
+            elif not header & 0x03:
+                # Timestamp and extension packets with continuation bytes
+                end = index + 1
+                if header & 0x80:
+                    while end < size and data[end] & 0x80:
+                        end += 1
+                    if end == size: break
+                    end += 1
+                index = end
+            else:
+                end = index + 1 + _SOURCE_SIZE[header & 0x03]
+                if end > size: break
+                if header == _DWT_PC_SAMPLE:
+                    self.samples += 1
+                    yield int.from_bytes(data[index + 1:end], "little")
+                elif header == _DWT_PC_SLEEP:
+                    self.samples += 1
+                    self.sleeps += 1
+                    yield None
+                index = end
+        self._pending = data[index:]
+
+
+def iter_pc_samples(swo_file: Path, decoder: PcSampleDecoder = None,
+                    chunk_size: int = 1 << 20) -> Iterator[int | None]:
+    """
+    Decodes the PC samples of a recorded SWO file in chunks.
+
+    :param swo_file: The raw ITM stream, for example `trace.swo`.
+    :param decoder: The decoder to use, which also counts sleeps and overflows.
+    :return: a generator of the sampled PC values or `None` if the core was
+             sleeping.
+    """
+    if decoder is None:
+        decoder = PcSampleDecoder()
+    with Path(swo_file).open("rb") as f:
+        while chunk := f.read(chunk_size):
+            yield from decoder.decode(chunk)
+
+
+class ElfSymbolizer:
+    """
+    Maps addresses to the function symbols of an ELF file via binary search.
+    """
+    def __init__(self, elf: Path, cache: Path | bool = False):
+        """
+        :param elf: The ELF file of the firmware running on the target.
+        :param cache: Read the symbols from the persistent
+            `emdbg.analyze.elfindex.ElfIndex` of the ELF file. `True` uses the
+            default cache directory, otherwise the path of the directory.
+        """
+        functions = {}
+        for address, size, name in self._functions_of(elf, cache):
+            # Clear the Thumb bit and prefer the symbol with a size
+            address &= ~1
+            if address not in functions or not functions[address][1]:
+                functions[address] = (name, size)
+        self._addresses = sorted(functions)
+        self._functions = [functions[a] for a in self._addresses]
+
+    @staticmethod
+    def _functions_of(elf: Path, cache: Path | bool) -> Iterator[tuple[int, int, str]]:
+        if cache:
+            from .elfindex import ElfIndex
+            with ElfIndex(elf, None if cache is True else cache) as index:
+                yield from index.symbols(("STT_FUNC", ))
+            return
+        with Path(elf).open("rb") as f:
+            for section in ELFFile(f).iter_sections():
+                if not isinstance(section, SymbolTableSection): continue
+                for symbol in section.iter_symbols():
+                    if (symbol["st_info"]["type"] == "STT_FUNC" and symbol.name and
+                            symbol["st_shndx"] != "SHN_UNDEF"):
+                        yield symbol["st_value"], symbol["st_size"], symbol.name
+
+    def lookup(self, address: int) -> tuple[str, int] | None:
+        """
+        :return: the function name and the offset of the address in it, or
+                 `None` if the address is not inside a function.
+        """
+        index = bisect.bisect_right(self._addresses, address) - 1
+        if index < 0: return None
+        name, size = self._functions[index]
+        offset = address - self._addresses[index]
+        # Symbols without a size extend to the next symbol
+        if size and offset >= size: return None
+        return name, offset
+
+
+class PcProfile:
+    """
+    Aggregates PC samples into a flat profile per address and per function.
+    """
+    def __init__(self, symbolizer: ElfSymbolizer = None):
+        """
+        :param symbolizer: Resolves the functions of the sampled addresses.
+        """
+        self.symbolizer = symbolizer
+        self.addresses = Counter()
+        """Number of samples per address"""
+        self.sleeps = 0
+        """Number of samples taken while the core was sleeping"""
+        self.overflows = 0
+        """Number of overflow packets, after which samples were lost"""
+
+    def add(self, samples: Iterator[int | None]):
+        """Add the PC values or `None` for sleep samples."""
+        for pc in samples:
+            if pc is None: self.sleeps += 1
+            else: self.addresses[pc] += 1
+
+    @property
+    def total(self) -> int:
+        """Number of all samples including sleep samples"""
+        return sum(self.addresses.values()) + self.sleeps
+
+    def symbol(self, address: int) -> str:
+        """:return: the symbol and offset of the address"""
+        if self.symbolizer and (symbol := self.symbolizer.lookup(address)):
+            return f"{symbol[0]}+{symbol[1]:#x}"
+        return f"{address:#010x}"
+
+    @property
+    def functions(self) -> Counter:
+        """Number of samples per function, unknown addresses are `None`"""
+        functions = Counter()
+        for address, count in self.addresses.items():
+            symbol = self.symbolizer.lookup(address) if self.symbolizer else None
+            functions[symbol[0] if symbol else None] += count
+        if self.sleeps:
+            functions["(sleep)"] += self.sleeps
+        return functions
+
+    def _table(self, title: str, rows: list[tuple[str, int]]) -> "rich.table.Table":
+        import rich.box
+        from rich.table import Table
+        total = self.total or 1
+        table = Table(box=rich.box.MINIMAL_DOUBLE_HEAD)
+        table.add_column(title)
+        table.add_column("Samples", justify="right")
+        table.add_column("%", justify="right")
+        for name, count in rows:
+            table.add_row(name, str(count), f"{count / total * 100:.2f}")
+        return table
+
+    def functions_as_table(self, count: int = None) -> "rich.table.Table":
+        """:return: a rich table of the functions with the most samples"""
+        rows = [(name or "(unknown)", c) for name, c in self.functions.most_common(count)]
+        return self._table("Function", rows)
+
+    def addresses_as_table(self, count: int = None) -> "rich.table.Table":
+        """:return: a rich table of the addresses with the most samples"""
+        rows = [(self.symbol(a), c) for a, c in self.addresses.most_common(count)]
+        return self._table("Address", rows)
+
+
+def profile_from_swo(swo_file: Path, elf: Path = None, cache: Path | bool = False) -> PcProfile:
+    """
+    Decodes a recorded SWO file into a PC sample profile.
+
+    :param swo_file: The raw ITM stream, for example `trace.swo`.
+    :param elf: The ELF file to symbolize the addresses with.
+    :param cache: Read the symbols from the persistent index, see `ElfSymbolizer`.
+    :return: the profile of all PC samples.
+    """
+    decoder = PcSampleDecoder()
+    profile = PcProfile(ElfSymbolizer(elf, cache) if elf else None)
+    profile.add(iter_pc_samples(swo_file, decoder))
+    profile.overflows = decoder.overflows
+    return profile
+
+
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse, rich
+
+    parser = argparse.ArgumentParser(description="PC Sampling Profiler")
+    parser.add_argument(
+        "file",
+        type=Path,
+        help="The raw ITM stream recorded from SWO.")
+    parser.add_argument(
+        "--elf",
+        type=Path,
+        help="The ELF file to symbolize the addresses with.")
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=30,
+        help="Number of functions to show.")
+    parser.add_argument(
+        "--flat",
+        type=int,
+        default=0,
+        help="Number of addresses to show.")
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        default=False,
+        help="Read the symbols from the persistent index of the ELF file.")
+    args = parser.parse_args()
+
+    profile = profile_from_swo(args.file, args.elf, args.cache)
+    rich.print(f"{profile.total} samples, {profile.sleeps} sleeping, "
+               f"{profile.overflows} overflows")
+    rich.print(profile.functions_as_table(args.top))
+    if args.flat:
+        rich.print(profile.addresses_as_table(args.flat))
@@ -16,6 +16,21 @@ You can summarize boost logs:
 python3 -m emdbg.analyze.priority log_semaphore_boosts.txt
 ```
 
+You can also follow a log that is still being written, for example by GDB or
+by `emdbg.serial.protocol.CommandPrompt.log_to_file()`, and print a refreshed
+summary whenever no new lines were written for a few seconds:
+
+```sh
+python3 -m emdbg.analyze.priority log_semaphore_boosts.txt --follow
+```
+
+To analyze how long the priority inversions lasted per semaphore and per
+boosting task, and which inversions overlapped the most:
+
+```sh
+python3 -m emdbg.analyze.priority log_semaphore_boosts.txt --inversions
+```
+
 You can also generate a callgraph with boost operations:
 
 ```sh
@@ -25,12 +40,15 @@ python3 -m emdbg.analyze.callgraph log_semaphore_boosts.txt --svg --type Semapho
 
 from __future__ import annotations
 import re
-from pathlib import Path
-import statistics
+import math
+import bisect
 import itertools
+from array import array
+from pathlib import Path
 from collections import defaultdict
+from typing import Iterable, Iterator
 from ..debug.px4.utils import format_table
-from .utils import read_gdb_log
+from .utils import iter_gdb_log, follow_gdb_log
 
 class _BoostOperation:
     PATTERN = re.compile(r"L(\d+) +(\d+)us> +(0x[0-9a-f]+|<opti-out>): +(.*?) +(\d+) +([\\/_]+) +(\d+) *(.*)")
@@ -55,94 +73,359 @@ class _BoostOperation:
         return f"{self.task} {self.prio_from} {self.operation} {self.prio_to}"
 
 
+class _RunningStatistics:
+    """Mean and standard deviation using Welford's online algorithm"""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def stdev(self) -> float:
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count >= 2 else 0.0
+
+
+class _IntervalStatistics:
+    """Number of operations and the statistics of the time between them"""
+    def __init__(self):
+        self.count = 0
+        self.intervals = _RunningStatistics()
+        self._last_uptime = None
+
+    def add(self, uptime: int):
+        self.count += 1
+        if self._last_uptime is not None:
+            self.intervals.add(uptime - self._last_uptime)
+        self._last_uptime = uptime
+
+    def row(self, kind: str) -> list:
+        return [kind, self.count, int(self.intervals.mean / 1e3), int(self.intervals.stdev / 1e3)]
+
+
+class _TaskStatistics:
+    def __init__(self):
+        self.boosts = 0
+        self.min_prio = None
+        self.max_prio = None
+        self.reasons = set()
+        self.max_boosts = 0
+        self.max_reasons = set()
+
+    def add(self, op: _BoostOperation):
+        is_up = op.operation == "_/"
+        if is_up: self.boosts += 1
+        if self.min_prio is None or op.prio_from < self.min_prio:
+            self.min_prio = op.prio_from
+        if self.max_prio is None or op.prio_to > self.max_prio:
+            self.max_prio = op.prio_to
+            self.max_boosts = 0
+            self.max_reasons = set()
+        if op.reason is not None:
+            self.reasons.add(op.reason)
+        if op.prio_to == self.max_prio:
+            if is_up: self.max_boosts += 1
+            if op.reason is not None: self.max_reasons.add(op.reason)
+
+
+class BoostLogSummary:
+    """
+    Incremental statistical summary of a semaphore boost log. The lines are
+    consumed one by one and only running statistics per task and semaphore are
+    kept, so that arbitrarily long logs are summarized in a single pass and the
+    summary can be formatted at any time, for example while the log is still
+    being written. The lines must be in chronological order.
+    """
+    def __init__(self):
+        self.min_uptime = None
+        """The smallest uptime in µs of all boost operations"""
+        self.max_uptime = None
+        """The largest uptime in µs of all boost operations"""
+        self._kinds = {"All": _IntervalStatistics(), "Up": _IntervalStatistics(),
+                       "Down": _IntervalStatistics(), "255": _IntervalStatistics()}
+        self._tasks = defaultdict(_TaskStatistics)
+        self._semaphores = {}
+        self.changed = False
+        """Set when a boost operation was added, reset it after formatting the summary"""
+
+    @property
+    def operations(self) -> int:
+        """The number of boost operations"""
+        return self._kinds["All"].count
+
+    def add(self, line: str) -> bool:
+        """
+        Adds a line of the boost log to the summary.
+
+        :return: `True` if the line contains a boost operation.
+        """
+        op = _BoostOperation(line)
+        if not op.is_valid: return False
+
+        self.changed = True
+        if self.min_uptime is None or op.uptime < self.min_uptime: self.min_uptime = op.uptime
+        if self.max_uptime is None or op.uptime > self.max_uptime: self.max_uptime = op.uptime
+        self._kinds["All"].add(op.uptime)
+        if op.operation == "_/":
+            self._kinds["Up"].add(op.uptime)
+            if op.prio_to == 255: self._kinds["255"].add(op.uptime)
+        elif op.operation == "\\_":
+            self._kinds["Down"].add(op.uptime)
+        self._tasks[op.task].add(op)
+        if op.semaphore is not None:
+            boosts, tasks, reasons = self._semaphores.setdefault(op.semaphore, [0, set(), set()])
+            self._semaphores[op.semaphore][0] = boosts + 1
+            tasks.add(op.task)
+            if op.reason: reasons.add(op.reason)
+        return True
+
+    def update(self, lines: Iterable[str]) -> int:
+        """
+        Adds all lines of the boost log to the summary.
+
+        :return: The number of boost operations in the lines.
+        """
+        return sum(1 for line in lines if self.add(line))
+
+    def format(self) -> str:
+        """:return: A formatted string containing the summary."""
+        if not self.operations: return "No task boosts found!"
+        output = []
+
+        uptime = self.max_uptime
+        sample_time = self.max_uptime - self.min_uptime
+        output.append(f"Uptime: {uptime/1e6:.1f}s = {uptime/6e7:.1f}min")
+        output.append(f"Sample time: {sample_time/1e6:.1f}s = {sample_time/6e7:.1f}min")
+
+        # Print summary statistics
+        prios = [stats.row(kind) for kind, stats in self._kinds.items()]
+        fmtstr = "{:%d}  {:>%d} ~{:>%d}ms ±{:>%d}ms"
+        header = ["KIND", "#BOOSTS", "MEAN", "STDEV"]
+        output.append("")
+        output.append(format_table(fmtstr, header, prios))
+
+        # Print summary statistics per task
+        fmtstr = "{:%d}  {:>%d} {:>%d}%%  [{:>%d}, {:>%d}]   {:%d}   {:>%d}  {:%d}"
+        header = ["TASK", "#BOOSTS", "PCT", "MIN", "MAX", "REASONS", "#MAX", "REASONS FOR MAX"]
+        boosts_up = self._kinds["Up"].count
+        task_prios = [[
+                task,
+                stats.boosts,
+                f"{stats.boosts * 100 / boosts_up if boosts_up else 0:.1f}",
+                stats.min_prio,
+                stats.max_prio,
+                ", ".join(sorted(stats.reasons)),
+                stats.max_boosts,
+                ", ".join(sorted(stats.max_reasons))
+            ]
+            for task, stats in self._tasks.items()]
+        task_prios.sort(key=lambda t: (t[4], t[3], t[0], t[1]))
+        output.append("")
+        output.append(format_table(fmtstr, header, task_prios))
+
+        semtasks = [[hex(s), boosts, ", ".join(sorted(tasks)), ", ".join(sorted(reasons))]
+                    for s, (boosts, tasks, reasons) in self._semaphores.items()]
+        semtasks.sort(key=lambda s: -s[1])
+        fmtstr = "{:%d}  {:>%d}  {:%d}  {:%d}"
+        header = ["SEMAPHORE", "#BOOSTS", "BOOSTS THESE TASKS", "BECAUSE OF THESE TASKS"]
+        output.append("")
+        output.append(format_table(fmtstr, header, semtasks))
+
+        return "\n".join(output)
+
+
+class _Inversion:
+    """A task that is boosted on a semaphore until its priority is restored"""
+    __slots__ = ("start", "base_prio", "max_prio", "reasons")
+
+    def __init__(self, op: _BoostOperation):
+        self.start = op.uptime
+        self.base_prio = op.prio_from
+        self.max_prio = op.prio_to
+        self.reasons = set()
+
+
+def _percentile(durations: list[int], percent: float) -> int:
+    # Nearest-rank percentile of sorted durations
+    return durations[max(0, math.ceil(len(durations) * percent / 100) - 1)]
+
+
+class InversionAnalysis:
+    """
+    Reconstructs the priority inversion intervals from a semaphore boost log.
+    An interval starts when a task is boosted (`_/`) on a semaphore and ends
+    when its priority is restored (`\\_`) to the priority before the first
+    boost. Nested boosts on the same semaphore extend the interval. The boosting
+    tasks are the reasons of all boosts of the interval.
+
+    The lines are consumed one by one in chronological order. The intervals are
+    stored in compact arrays sorted by their end, so that the overlapping
+    inversions can be found with a sweep line and queried with `active_at()`.
+    """
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self):
+        self._open = {}
+        self._names = {}
+        self._starts = array("q")
+        self._ends = array("q")
+        self._tasks = array("l")
+        self._semaphores = array("q")
+        self._reasons = []
+        self._max_duration = 0
+        self._sorted_starts = None
+
+    def _name(self, name: str) -> int:
+        return self._names.setdefault(name, len(self._names))
+
+    def add(self, line: str) -> bool:
+        """
+        Adds a line of the boost log to the analysis.
+
+        :return: `True` if the line contains a boost operation.
+        """
+        op = _BoostOperation(line)
+        if not op.is_valid: return False
+        key = (op.task, op.semaphore)
+        inversion = self._open.get(key)
+        if op.operation == "_/":
+            if inversion is None:
+                inversion = self._open[key] = _Inversion(op)
+            inversion.max_prio = max(inversion.max_prio, op.prio_to)
+            if op.reason: inversion.reasons.add(op.reason)
+        elif inversion is not None and op.prio_to <= inversion.base_prio:
+            del self._open[key]
+            self._starts.append(inversion.start)
+            self._ends.append(op.uptime)
+            self._tasks.append(self._name(op.task))
+            self._semaphores.append(-1 if op.semaphore is None else op.semaphore)
+            self._reasons.append(tuple(self._name(r) for r in sorted(inversion.reasons)))
+            self._max_duration = max(self._max_duration, op.uptime - inversion.start)
+            self._sorted_starts = None
+        return True
+
+    def update(self, lines: Iterable[str]) -> int:
+        """
+        Adds all lines of the boost log to the analysis.
+
+        :return: The number of boost operations in the lines.
+        """
+        return sum(1 for line in lines if self.add(line))
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    @property
+    def unrestored(self) -> int:
+        """The number of tasks that are still boosted at the end of the log"""
+        return len(self._open)
+
+    def intervals(self) -> Iterator[tuple[int, int, str, int | None, tuple[str, ...]]]:
+        """
+        :return: The start and end uptime in µs, the boosted task, the semaphore
+                 and the boosting tasks of all inversions in the order of their end.
+        """
+        names = list(self._names)
+        for start, end, task, semaphore, reasons in zip(
+                self._starts, self._ends, self._tasks, self._semaphores, self._reasons):
+            yield (start, end, names[task], None if semaphore < 0 else semaphore,
+                   tuple(names[r] for r in reasons))
+
+    def active_at(self, uptime: int) -> list[int]:
+        """
+        :return: The indexes of all inversions that are active at the uptime,
+                 in the order of `intervals()`.
+        """
+        if self._sorted_starts is None:
+            order = sorted(range(len(self._starts)), key=self._starts.__getitem__)
+            self._sorted_starts = (array("q", (self._starts[i] for i in order)), array("q", order))
+        starts, order = self._sorted_starts
+        # Only inversions that started at most the longest duration before can be active
+        first = bisect.bisect_left(starts, uptime - self._max_duration)
+        last = bisect.bisect_right(starts, uptime)
+        return sorted(i for i in order[first:last] if self._ends[i] > uptime)
+
+    def max_overlap(self) -> tuple[int, int | None]:
+        """
+        Finds the time with the most simultaneously active inversions with a
+        sweep line over all start and end times.
+
+        :return: The maximum number of overlapping inversions and the first
+                 uptime at which they occur, or `None` if there are none.
+        """
+        # Ends sort before starts at the same time, since intervals are half-open
+        events = sorted(itertools.chain(((s, 1) for s in self._starts), ((e, -1) for e in self._ends)))
+        active, maximum, uptime = 0, 0, None
+        for time, delta in events:
+            active += delta
+            if active > maximum:
+                maximum, uptime = active, time
+        return maximum, uptime
+
+    def _statistics(self, groups: dict) -> list[list]:
+        rows = []
+        for name, durations in groups.items():
+            durations = sorted(durations)
+            rows.append([name, len(durations), *(_percentile(durations, p) for p in self.PERCENTILES),
+                         durations[-1], sum(durations)])
+        rows.sort(key=lambda r: (-r[-2], -r[-1], r[0]))
+        return rows
+
+    def format(self, top: int = 10) -> str:
+        """
+        :param top: The number of longest and overlapping inversions to show.
+        :return: A formatted string containing the duration statistics.
+        """
+        if not len(self): return "No priority inversions found!"
+        names = list(self._names)
+        per_semaphore, per_reason = defaultdict(list), defaultdict(list)
+        for start, end, semaphore, reasons in zip(self._starts, self._ends, self._semaphores, self._reasons):
+            per_semaphore[hex(semaphore) if semaphore >= 0 else "<opti-out>"].append(end - start)
+            for reason in reasons:
+                per_reason[names[reason]].append(end - start)
+
+        output = [f"Inversions: {len(self)}, still boosted at the end: {self.unrestored}"]
+        percentiles = [f"P{p}" for p in self.PERCENTILES]
+        fmtstr = "{:%d}  {:>%d}" + "  {:>%d}us" * (len(self.PERCENTILES) + 2)
+        for title, groups in (("SEMAPHORE", per_semaphore), ("BOOSTING TASK", per_reason)):
+            header = [title, "#INVERSIONS", *percentiles, "MAX", "TOTAL"]
+            output.append("")
+            output.append(format_table(fmtstr, header, self._statistics(groups)))
+
+        intervals = list(self.intervals())
+        longest = sorted(range(len(intervals)), key=lambda i: intervals[i][0] - intervals[i][1])[:top]
+        count, uptime = self.max_overlap()
+        fmtstr = "{:%d}  {:>%d}us  {:%d}  {:%d}  {:%d}"
+        header = ["START", "DURATION", "TASK", "SEMAPHORE", "BOOSTED BY"]
+        for title, indexes in ((f"Active at {uptime/1e6:.6f}s, the most overlapping inversions: {count}",
+                                self.active_at(uptime)[:top]),
+                               ("Longest inversions", longest)):
+            rows = [[f"{intervals[i][0]/1e6:.6f}s", intervals[i][1] - intervals[i][0], intervals[i][2],
+                     "<opti-out>" if intervals[i][3] is None else hex(intervals[i][3]), ", ".join(intervals[i][4])]
+                    for i in indexes]
+            output.append("")
+            output.append(title)
+            output.append(format_table(fmtstr, header, rows))
+
+        return "\n".join(output)
+
+
 def summarize_semaphore_boostlog(logfile: Path) -> str:
     """
     Analyze a boost log and create a statistical summary and return it.
+    The log is read line by line, see `BoostLogSummary`.
 
     :param logfile: The boostlog file to analyze
     :return: A formatted string containing the analysis.
     """
-    output = []
-
-    ops = []
-    for line in read_gdb_log(logfile).splitlines():
-        op = _BoostOperation(line)
-        if op.is_valid:
-            ops.append(op)
-        # else:
-        #     print(line)
-    if not ops: return "No task boosts found!"
-    ops.sort(key=lambda o: o.uptime)
-
-
-    uptime = ops[-1].uptime
-    sample_time = max(o.uptime for o in ops) - min(o.uptime for o in ops)
-    output.append(f"Uptime: {uptime/1e6:.1f}s = {uptime/6e7:.1f}min")
-    output.append(f"Sample time: {sample_time/1e6:.1f}s = {sample_time/6e7:.1f}min")
-
-    # Print summary statistics
-    prios = []
-    def _mean(values):
-        return int((statistics.fmean(values) if len(values) else 0) / 1e3)
-    def _stdev(values):
-        if len(values) >= 2: return int(statistics.stdev(values) / 1e3)
-        return values[0] if len(values) else 0
-
-    diffs = [n.uptime - p.uptime for p,n in itertools.pairwise(ops)]
-    prios.append(["All", len(ops), _mean(diffs), _stdev(diffs)])
-
-    boost_up = [op for op in ops if op.operation == "_/"]
-    diffs_up = [n.uptime - p.uptime for p,n in itertools.pairwise(boost_up)]
-    prios.append(["Up", len(boost_up), _mean(diffs_up), _stdev(diffs_up)])
-
-    boost_down = [op for op in ops if op.operation == "\\_"]
-    diffs_down = [n.uptime - p.uptime for p,n in itertools.pairwise(boost_down)]
-    prios.append(["Down", len(boost_down), _mean(diffs_down), _stdev(diffs_down)])
-
-    boost_255 = [op for op in ops if op.operation == "_/" and op.prio_to == 255]
-    diffs_255 = [n.uptime - p.uptime for p,n in itertools.pairwise(boost_255)]
-    prios.append(["255", len(boost_255), _mean(diffs_255), _stdev(diffs_255)])
-
-    fmtstr = "{:%d}  {:>%d} ~{:>%d}ms ±{:>%d}ms"
-    header = ["KIND", "#BOOSTS", "MEAN", "STDEV"]
-    output.append("")
-    output.append(format_table(fmtstr, header, prios))
-
-    # Print summary statistics per task
-    fmtstr = "{:%d}  {:>%d} {:>%d}%%  [{:>%d}, {:>%d}]   {:%d}   {:>%d}  {:%d}"
-    header = ["TASK", "#BOOSTS", "PCT", "MIN", "MAX", "REASONS", "#MAX", "REASONS FOR MAX"]
-    tasks = defaultdict(list)
-    for op in ops:
-        tasks[op.task].append(op)
-    task_prios = [[
-            task,
-            boosts := sum(1 for o in ops if o if o.operation == "_/"),
-            f"{boosts * 100 / len(boost_up):.1f}",
-            min(o.prio_from for o in ops),
-            max_prio := max(o.prio_to for o in ops),
-            ", ".join(sorted({o.reason for o in ops if o.reason is not None})),
-            sum(1 for o in ops if o if o.operation == "_/" and o.prio_to == max_prio),
-            ", ".join(sorted({o.reason for o in ops if o.reason is not None and o.prio_to == max_prio}))
-        ]
-        for task, ops in tasks.items()]
-    task_prios.sort(key=lambda t: (t[4], t[3], t[0], t[1]))
-    output.append("")
-    output.append(format_table(fmtstr, header, task_prios))
-
-    semtasks = defaultdict(list)
-    semtasksr = defaultdict(list)
-    for op in ops:
-        if op.semaphore is not None:
-            semtasks[op.semaphore].append(op.task)
-            if op.reason: semtasksr[op.semaphore].append(op.reason)
-    semtasks = [[hex(s), len(ts), ", ".join(sorted(set(ts))), ", ".join(sorted(set(semtasksr.get(s, []))))] for s, ts in semtasks.items()]
-    semtasks.sort(key=lambda s: -s[1])
-    fmtstr = "{:%d}  {:>%d}  {:%d}  {:%d}"
-    header = ["SEMAPHORE", "#BOOSTS", "BOOSTS THESE TASKS", "BECAUSE OF THESE TASKS"]
-    output.append("")
-    output.append(format_table(fmtstr, header, semtasks))
-
-    return "\n".join(output)
+    summary = BoostLogSummary()
+    summary.update(line for _, line in iter_gdb_log(logfile))
+    return summary.format()
 
 
 # -----------------------------------------------------------------------------
@@ -154,9 +437,40 @@ if __name__ == "__main__":
         "file",
         type=Path,
         help="The GDB log containing the semaphore boost trace.")
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Wait for new lines at the end of the log and refresh the summary.")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=5,
+        help="Refresh the summary after this many seconds without new lines, "
+             "if boosts were added since the last refresh.")
+    parser.add_argument(
+        "--inversions",
+        action="store_true",
+        help="Analyze the durations of the priority inversions.")
     args = parser.parse_args()
 
-    print(summarize_semaphore_boostlog(args.file))
+    if args.inversions:
+        inversions = InversionAnalysis()
+        inversions.update(line for _, line in iter_gdb_log(args.file))
+        print(inversions.format())
+    elif not args.follow:
+        print(summarize_semaphore_boostlog(args.file))
+    else:
+        summary = BoostLogSummary()
+        try:
+            for _, line in follow_gdb_log(args.file, timeout=args.interval):
+                if line is not None:
+                    summary.add(line)
+                elif summary.changed:
+                    # Only refresh the summary if new boosts were added
+                    print(summary.format(), end="\n\n", flush=True)
+                    summary.changed = False
+        except KeyboardInterrupt:
+            print(summary.format())
 
 
 
@@ -2,21 +2,36 @@
 # Copyright (c) 2024, Auterion AG
 # SPDX-License-Identifier: BSD-3-Clause
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
 from shutil import which
+from typing import Iterator
 import argparse
+import hashlib
+import io
+import json
 import logging
+import mmap
+import os
 import re
+import sqlite3
 import subprocess
+import time
 
 import rich
 from rich.console import Console
 from rich.table import Table
 
+from .mapfile import MapFile
+
 _LOGGER = logging.getLogger(__name__)
 _BLOATY_CMD = "bloaty"
+_ENGINES = ("native", "bloaty")
+_AR_MAGIC = b"!<arch>\n"
+_AR_THIN_MAGIC = b"!<thin>\n"
+_AR_SYMBOL_TABLES = ("/", "/SYM64/", "__.SYMDEF", "__.SYMDEF SORTED")
+_SHF_ALLOC = 0x2
 
 
 # -----------------------------------------------------------------------------
@@ -38,6 +53,209 @@ def is_bloaty_installed() -> bool:
     return which(_BLOATY_CMD) is not None
 
 
+# -----------------------------------------------------------------------------
+def _archive_members(file_path: Path, data) -> Iterator[tuple[str, bytes]]:
+    """
+    Iterates over the members of a GNU, BSD or thin `ar` archive.
+
+    :param file_path: path of the archive, thin archives refer to their members relative to it.
+    :param data: the content of the archive.
+
+    :return: the name and content of every member except the symbol tables.
+    """
+    thin = data[:8] == _AR_THIN_MAGIC
+    names = b""
+    pos = 8
+    while pos + 60 <= len(data):
+        header = bytes(data[pos:pos + 60])
+        name = header[:16].decode(errors="replace").rstrip()
+        size = int(header[48:58])
+        start = pos = pos + 60
+        if name.startswith("#1/"):
+            # BSD stores long names in front of the content
+            name_size = int(name[3:])
+            name = bytes(data[start:start + name_size]).rstrip(b"\0").decode(errors="replace")
+            start += name_size
+        if name == "//":
+            names = bytes(data[start:pos + size])
+        elif name not in _AR_SYMBOL_TABLES:
+            if name.startswith("/") and name[1:].isdigit():
+                offset = int(name[1:])
+                name = names[offset:names.index(b"\n", offset)].decode(errors="replace")
+            name = name.rstrip("/")
+            if thin:
+                yield name, (file_path.parent / name).read_bytes()
+                continue
+            yield name, bytes(data[start:pos + size])
+        # Thin archives only contain the symbol and name tables
+        pos += size + (size & 1)
+
+
+def _elf_files(file_path: Path) -> Iterator[tuple[str, object]]:
+    """
+    Iterates over the ELF files of an archive or the file itself. The file is
+    memory-mapped instead of read into memory.
+
+    :return: the member name and a stream of every ELF file.
+    """
+    from elftools.elf.elffile import ELFFile
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0: return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:8] in (_AR_MAGIC, _AR_THIN_MAGIC):
+                for name, member in _archive_members(file_path, data):
+                    if member[:4] == b"\x7fELF":
+                        yield name, ELFFile(io.BytesIO(member))
+            elif data[:4] == b"\x7fELF":
+                yield file_path.name, ELFFile(data)
+
+
+def _native_section_sizes(elf_file) -> Iterator[tuple[str, int, int]]:
+    """:return: the name, VM size and file size of all sections of the ELF file."""
+    for section in elf_file.iter_sections():
+        if section["sh_type"] == "SHT_NULL": continue
+        size = section["sh_size"]
+        yield (section.name, size if section["sh_flags"] & _SHF_ALLOC else 0,
+               0 if section["sh_type"] == "SHT_NOBITS" else size)
+
+
+def _native_symbol_sizes(member: str, elf_file) -> Iterator[tuple[str, str, int, str]]:
+    """
+    Attributes the sized function and object symbols to their source files. For
+    relocatable objects, this is the `STT_FILE` symbol or the member name, for
+    linked files the compilation unit of the symbol address in `.debug_aranges`.
+
+    :return: the name, section, size and source file of all symbols.
+    """
+    from elftools.elf.sections import SymbolTableSection
+    section_names = [section.name for section in elf_file.iter_sections()]
+    aranges, units = None, {}
+    if elf_file["e_type"] != "ET_REL" and elf_file.has_dwarf_info():
+        dwarf_info = elf_file.get_dwarf_info()
+        aranges = dwarf_info.get_aranges()
+
+    def unit_name(address: int) -> str | None:
+        if aranges is None or (offset := aranges.cu_offset_at_addr(address)) is None: return None
+        if offset not in units:
+            attrs = dwarf_info.get_CU_at(offset).get_top_DIE().attributes
+            units[offset] = attrs["DW_AT_name"].value.decode() if "DW_AT_name" in attrs else None
+        return units[offset]
+
+    for symtab in elf_file.iter_sections():
+        if not isinstance(symtab, SymbolTableSection): continue
+        source = None
+        for symbol in symtab.iter_symbols():
+            info = symbol["st_info"]
+            if info["type"] == "STT_FILE":
+                source = symbol.name
+                continue
+            if (info["type"] not in ("STT_FUNC", "STT_OBJECT") or not symbol["st_size"] or
+                    not isinstance(symbol["st_shndx"], int)):
+                continue
+            if elf_file["e_type"] == "ET_REL":
+                name = source or member
+            else:
+                # Global symbols follow all local symbols, so `STT_FILE` only applies to locals
+                name = unit_name(symbol["st_value"] & ~1)
+                if name is None: name = source if info["bind"] == "STB_LOCAL" else ""
+            yield symbol.name, section_names[symbol["st_shndx"]], symbol["st_size"], name or ""
+
+
+def _native_sizes(file_path: Path, symbols: bool) -> tuple[list, list | None]:
+    """
+    Computes the sizes of an ELF file or all ELF files of an archive with pyelftools.
+    The sections of the same name are accumulated.
+
+    :return: the name, VM size and file size of all sections sorted by VM size,
+             and the symbol sizes if requested.
+    """
+    sections, symbol_sizes = {}, [] if symbols else None
+    for member, elf_file in _elf_files(file_path):
+        for name, vm_size, file_size in _native_section_sizes(elf_file):
+            sizes = sections.setdefault(name, [0, 0])
+            sizes[0] += vm_size
+            sizes[1] += file_size
+        if symbols:
+            symbol_sizes.extend(_native_symbol_sizes(member, elf_file))
+    rows = sorted(([name, *sizes] for name, sizes in sections.items()), key=lambda r: (-r[1], -r[2], r[0]))
+    return rows, symbol_sizes
+
+
+def _bloaty_sizes(output: str) -> list | None:
+    """:return: the name, VM size and file size of all sections in the bloaty CSV output."""
+    rows = []
+    for line in output.splitlines()[1:]:
+        line_split = line.split(",")
+
+        if len(line_split) == 3 and line_split[1].isdigit() and line_split[2].isdigit():
+            rows.append([line_split[0], int(line_split[1]), int(line_split[2])])
+        else:
+            _LOGGER.error(f"bloaty output contains invalid line: {line}")
+            return None
+    return rows
+
+
+def _file_sizes(args: tuple[Path, str, bool]) -> tuple[list, list | None] | None:
+    """
+    Computes the sizes of a file with the given engine. Only the native engine computes symbol sizes.
+
+    :return: the section and symbol sizes or `None` on errors.
+    """
+    file_path, engine, symbols = args
+    if engine == "bloaty":
+        if (output := SectionAnalyzer.get_bloaty_output(file_path)) is None: return None
+        if (rows := _bloaty_sizes(output)) is None: return None
+        return rows, None
+    try:
+        return _native_sizes(file_path, symbols)
+    except Exception as e:
+        _LOGGER.error(f"Analyzing {file_path} failed: {e}")
+        return None
+
+
+# -----------------------------------------------------------------------------
+class _SizeCache:
+    """
+    SQLite cache of the sizes per file content, so that only the files that
+    changed since a previous build need to be analyzed again.
+    """
+    VERSION = 2
+    MAX_AGE = 30 * 24 * 3600
+    """entries that were not used for this many seconds are removed."""
+
+    def __init__(self, path: Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            self._db.executescript(f"""
+                DROP TABLE IF EXISTS outputs;
+                DROP TABLE IF EXISTS sizes;
+                CREATE TABLE sizes (key TEXT PRIMARY KEY, sizes TEXT, used INTEGER);
+                PRAGMA user_version = {self.VERSION};""")
+        self._db.execute("DELETE FROM sizes WHERE used < ?", (int(time.time()) - self.MAX_AGE, ))
+        self._db.commit()
+
+    @staticmethod
+    def key(file_path: Path, engine: str, symbols: bool) -> str:
+        hasher = hashlib.blake2b(digest_size=20)
+        with open(file_path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                hasher.update(chunk)
+        return f"{hasher.hexdigest()}:{engine}:{int(symbols)}"
+
+    def lookup(self, key: str) -> tuple[list, list | None] | None:
+        row = self._db.execute("SELECT sizes FROM sizes WHERE key = ?", (key, )).fetchone()
+        if row is not None:
+            self._db.execute("UPDATE sizes SET used = ? WHERE key = ?", (int(time.time()), key))
+            self._db.commit()
+            return tuple(json.loads(row[0]))
+        return None
+
+    def store(self, key: str, sizes: tuple[list, list | None]):
+        self._db.execute("INSERT OR REPLACE INTO sizes VALUES (?, ?, ?)", (key, json.dumps(sizes), int(time.time())))
+        self._db.commit()
+
+
 # -----------------------------------------------------------------------------
 class SectionType(Enum):
     """
@@ -67,6 +285,22 @@ class Section:
     """file size that the linker section uses"""
 
 
+# -----------------------------------------------------------------------------
+@dataclass
+class Symbol:
+    """
+    The class `Symbol` represents a function or object symbol.
+    """
+    name: str
+    """name of the symbol."""
+    section: str
+    """name of the linker section that contains the symbol."""
+    size: int
+    """size of the symbol."""
+    source_file: str
+    """source file that defines the symbol, empty if unknown."""
+
+
 # -----------------------------------------------------------------------------
 @dataclass
 class AnalysisResult:
@@ -81,6 +315,15 @@ class AnalysisResult:
     """overall VM size that is used by all sections in the analyzed file."""
     total_file_size: int
     """overall file size that is used by all sections in the analyzed file."""
+    symbols: list[Symbol] = field(default_factory=list)
+    """all symbols in the sections that passed the given filters, if requested."""
+
+    def source_file_sizes(self) -> dict[str, int]:
+        """Returns the accumulated symbol sizes per source file, largest first."""
+        sizes = {}
+        for symbol in self.symbols:
+            sizes[symbol.source_file] = sizes.get(symbol.source_file, 0) + symbol.size
+        return dict(sorted(sizes.items(), key=lambda s: (-s[1], s[0])))
 
     def print(self, console: Console, overall_vm_size: int, overall_file_size: int):
         """
@@ -112,6 +355,36 @@ class AnalysisResult:
 
         console.print(table)
 
+    def print_symbols(self, console: Console, top: int | None = None):
+        """
+        Prints the largest source files and symbols of the analyzed file.
+
+        :param console: console to print the output to.
+        :param top: number of source files and symbols to print. `None` prints all of them.
+        """
+        total_size = sum(symbol.size for symbol in self.symbols)
+
+        table = Table(box=rich.box.MINIMAL_DOUBLE_HEAD)
+        table.add_column("Source file")
+        table.add_column("Size")
+        table.add_column("%")
+
+        for source_file, size in list(self.source_file_sizes().items())[:top]:
+            table.add_row(source_file, str(size), "{:.2f}".format(100 if total_size == 0 else size / total_size * 100))
+
+        console.print(table)
+
+        table = Table(box=rich.box.MINIMAL_DOUBLE_HEAD)
+        table.add_column("Symbol")
+        table.add_column("Section")
+        table.add_column("Source file")
+        table.add_column("Size")
+
+        for symbol in sorted(self.symbols, key=lambda s: (-s.size, s.name))[:top]:
+            table.add_row(symbol.name, symbol.section, symbol.source_file, str(symbol.size))
+
+        console.print(table)
+
     def to_csv_lines(self) -> str:
         """
         Prints the analyzed file with its linker sections into the CSV format. This allows for analysis in another tool.
@@ -126,22 +399,72 @@ class AnalysisResult:
 # -----------------------------------------------------------------------------
 class SectionAnalyzer:
     """
-    The `SectionAnalyzer` extracts information about linker sections using bloaty.
+    The `SectionAnalyzer` extracts information about linker sections and symbols using pyelftools or bloaty.
 
-    :param map_file_content: The contents of the map file. If `None` is passed, the output may contain sections that are removed by the linker.
+    :param map_file_content: The contents of the map file or the parsed `emdbg.analyze.mapfile.MapFile`. If `None` is passed, the output may contain sections that are removed by the linker.
     :param all_vm: Tells whether to include sections with a VM size of 0.
     :param section_filter: Regex that will be used as a filter on section names. `None` in case of no filter.
     :param type_filter: List of section types that shall be considered. Empty in case of no filters.
+    :param cache: Reuse the sizes of files that did not change since a previous analysis. `True` uses
+                  `size.cache` in the default cache directory, otherwise the path of the cache file.
+    :param engine: `native` analyzes the files in-process with pyelftools, `bloaty` runs the bloaty executable.
+    :param symbols: Tells whether to also compute the symbol sizes. This requires the native engine.
+    :param cross_check: Compares the section sizes of the native engine with bloaty and logs all differences.
     """
-    def __init__(self, map_file_content: str | None, all_vm: bool, section_filter: str | None, type_filter: list[str]):
-        self._map_file_content = map_file_content
+    def __init__(self, map_file_content: str | MapFile | None, all_vm: bool, section_filter: str | None, type_filter: list[str],
+                 cache: Path | bool = False, engine: str = "native", symbols: bool = False, cross_check: bool = False):
+        if engine not in _ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', must be one of {', '.join(_ENGINES)}.")
+        if symbols and engine != "native":
+            raise ValueError("Symbol sizes require the native engine.")
+        self._map_file = MapFile(map_file_content) if isinstance(map_file_content, str) else map_file_content
         self._all_vm = all_vm
         self._section_filter = section_filter
         self._type_filter = type_filter
+        self._engine = engine
+        self._symbols = symbols
+        self._cross_check = cross_check and engine == "native"
+        self._cache = None
+        if cache:
+            from .elfindex import default_cache_dir
+            self._cache = _SizeCache(default_cache_dir() / "size.cache" if cache is True else cache)
+        self.reused_files = 0
+        """number of files whose sizes were reused from the cache."""
+        self.total_files = 0
+        """number of files that were analyzed."""
+
+    def analyze(self, file_paths: list[Path], jobs: int = 1) -> list[AnalysisResult]:
+        """
+        Analyzes the given files in parallel. Files that cannot be analyzed are omitted.
+
+        :param file_paths: the files to analyze.
+        :param jobs: Number of processes to analyze the files with. `None` uses all CPUs.
+
+        :return: the `AnalysisResult` of all files in the given order.
+        """
+        if jobs == 1:
+            results = (self.get_sections(file_path) for file_path in file_paths)
+            return [result for result in results if result]
+
+        sizes, misses = {}, []
+        for file_path in file_paths:
+            if (cached := self._lookup(file_path)) is None:
+                misses.append(file_path)
+            else:
+                sizes[file_path] = cached
+
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(jobs or os.cpu_count()) as executor:
+            computed = executor.map(_file_sizes, ((file_path, self._engine, self._symbols) for file_path in misses))
+            for file_path, file_sizes in zip(misses, computed):
+                sizes[file_path] = self._store(file_path, file_sizes)
+
+        results = (self.to_analysis_result(file_path, sizes[file_path]) for file_path in file_paths)
+        return [result for result in results if result]
 
     def get_sections(self, file_path: Path) -> AnalysisResult | None:
         """
-        Analyzes the given file using bloaty and returns all identified `Section`. In case of any errors, `None` will be returned.
+        Analyzes the given file and returns all identified `Section`. In case of any errors, `None` will be returned.
         The sections will only be added to the output, if they pass the given filters.
         If a map file is provided all sections that are removed by the linker will be removed from the output.
 
@@ -149,32 +472,79 @@ class SectionAnalyzer:
 
         :return: on success, all identified `Section`. Otherwise, `None` will be returned.
         """
+        if (sizes := self._lookup(file_path)) is None:
+            sizes = self._store(file_path, _file_sizes((file_path, self._engine, self._symbols)))
+        return self.to_analysis_result(file_path, sizes)
+
+    def _lookup(self, file_path: Path) -> tuple[list, list | None] | None:
+        self.total_files += 1
+        if self._cache is not None:
+            if (sizes := self._cache.lookup(_SizeCache.key(file_path, self._engine, self._symbols))) is not None:
+                self.reused_files += 1
+                return sizes
+        return None
+
+    def _store(self, file_path: Path, sizes: tuple[list, list | None] | None) -> tuple[list, list | None] | None:
+        if sizes is None: return None
+        if self._cache is not None:
+            self._cache.store(_SizeCache.key(file_path, self._engine, self._symbols), sizes)
+        if self._cross_check:
+            self.cross_check(file_path, sizes[0])
+        return sizes
+
+    def cross_check(self, file_path: Path, rows: list) -> bool:
+        """
+        Compares the section sizes with the output of bloaty and logs all differences.
+        Sections that only one of them reports, like the pseudo sections of bloaty, are ignored.
+
+        :param file_path: the analyzed file.
+        :param rows: the name, VM size and file size of all sections.
+
+        :return: `True` if all sizes match.
+        """
+        if (output := self.get_bloaty_output(file_path)) is None or (bloaty_rows := _bloaty_sizes(output)) is None:
+            return False
+        bloaty_sizes = {name: (vm_size, file_size) for name, vm_size, file_size in bloaty_rows}
+        matches = True
+        for name, vm_size, file_size in rows:
+            if (expected := bloaty_sizes.get(name)) is not None and expected != (vm_size, file_size):
+                _LOGGER.warning(f"{file_path}: {name} has VM size {vm_size} and file size {file_size}, "
+                                f"but bloaty reports {expected[0]} and {expected[1]}")
+                matches = False
+        return matches
+
+    def to_analysis_result(self, file_path: Path, sizes: tuple[list, list | None] | None) -> AnalysisResult | None:
+        """
+        Filters the section and symbol sizes of a file.
+
+        :param file_path: the analyzed file.
+        :param sizes: the section and symbol sizes of the file or `None` in case of errors.
+
+        :return: on success, the filtered sections and symbols. Otherwise, `None` will be returned.
+        """
+        if not sizes:
+            return None
+
         sections = []
         total_vm_size = 0
         total_file_size = 0
-        bloaty_output = self.get_bloaty_output(file_path)
-
-        if bloaty_output:
-            for line in bloaty_output.splitlines()[1:]:
-                line_split = line.split(",")
-
-                if len(line_split) == 3 and line_split[1].isdigit() and line_split[2].isdigit():
-                    section_type = self.get_section_type(line_split[0])
-                    section = Section(line_split[0], section_type, int(line_split[1]), int(line_split[2]))
-
-                    if section.vm_size > 0 or self._all_vm:
-                        if self.check_section_map_file(section) and self.check_section_filter(section) and self.check_section_type_filter(section):
-                            sections.append(section)
-                            total_vm_size = total_vm_size + section.vm_size
-                            total_file_size = total_file_size + section.file_size
-                else:
-                    _LOGGER.error(f"bloaty output contains invalid line: {line}")
-                    return None
-            return AnalysisResult(file_path, sections, total_vm_size, total_file_size)
-        else:
-            return None
+        section_rows, symbol_rows = sizes
 
-    def get_bloaty_output(self, file_path: Path) -> str | None:
+        for name, vm_size, file_size in section_rows:
+            section = Section(name, self.get_section_type(name), vm_size, file_size)
+
+            if section.vm_size > 0 or self._all_vm:
+                if self.check_section_map_file(section) and self.check_section_filter(section) and self.check_section_type_filter(section):
+                    sections.append(section)
+                    total_vm_size = total_vm_size + section.vm_size
+                    total_file_size = total_file_size + section.file_size
+
+        section_names = {section.name for section in sections}
+        symbols = [Symbol(*row) for row in symbol_rows or [] if row[1] in section_names]
+        return AnalysisResult(file_path, sections, total_vm_size, total_file_size, symbols)
+
+    @staticmethod
+    def get_bloaty_output(file_path: Path) -> str | None:
         """
         Runs bloaty on the given file and collects its stdout if bloaty returns successfully. If it reports an error, `None` will be returned.
         The following args are passed to bloaty:
@@ -203,7 +573,7 @@ class SectionAnalyzer:
 
     def check_section_map_file(self, section: Section) -> bool:
         """Check if the section is contained in the map file (and thus was not removed by the linker)."""
-        return self._map_file_content is None or section.name in self._map_file_content
+        return self._map_file is None or self._map_file.is_kept(section.name)
 
     def check_section_filter(self, section: Section) -> bool:
         """Check if the section name matches the user given regex. If no regex is given, always returns True."""
@@ -219,7 +589,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Section size analyzer.")
     parser.add_argument(
         "--build-dir",
-        help="Path to the build directory. If not given, the current working directory will be used instead."
+        action="append",
+        help="Path to the build directory. Can be given multiple times to analyze several builds. If not given, the current working directory will be used instead."
     )
     parser.add_argument(
         "--map-file",
@@ -245,23 +616,60 @@ if __name__ == "__main__":
         default=False,
         help="Also include sections with a VM size of 0."
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Reuse the results of files that did not change since the analysis of a previous build."
+    )
+    parser.add_argument(
+        "--engine",
+        choices=_ENGINES,
+        default="native",
+        help="Analyze the files in-process with pyelftools (native) or with the bloaty executable."
+    )
+    parser.add_argument(
+        "--cross-check",
+        action="store_true",
+        default=False,
+        help="Compare the section sizes of the native engine with bloaty."
+    )
+    parser.add_argument(
+        "--symbols",
+        type=int,
+        nargs="?",
+        const=20,
+        help="Also print the largest source files and symbols of every file, 20 by default."
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of processes to analyze the files with, 0 uses all CPUs."
+    )
 
     args = parser.parse_args()
 
-    build_dir = Path().cwd()
-    map_file_content = None
+    build_dirs = [Path().cwd()]
+    map_file = None
     type_filter = []
 
-    if not is_bloaty_installed():
+    if (args.engine == "bloaty" or args.cross_check) and not is_bloaty_installed():
         _LOGGER.error("bloaty is not installed. Please install it to use this tool.")
         exit(1)
 
+    if args.symbols is not None and args.engine != "native":
+        _LOGGER.error("Symbol sizes require the native engine.")
+        exit(1)
+
     if args.build_dir:
-        build_dir = Path(args.build_dir)
+        build_dirs = [Path(build_dir) for build_dir in args.build_dir]
 
-        if not build_dir.exists():
-            _LOGGER.error(f"Given build directory: {build_dir} does not exist.")
-            exit(1)
+        for build_dir in build_dirs:
+            if not build_dir.exists():
+                _LOGGER.error(f"Given build directory: {build_dir} does not exist.")
+                exit(1)
 
     if args.map_file:
         map_file_path = Path(args.map_file)
@@ -269,8 +677,7 @@ if __name__ == "__main__":
         if not map_file_path.exists():
             _LOGGER.error(f"Given map file: {map_file_path} does not exist.")
             exit(1)
-        with open(args.map_file, "r") as f:
-            map_file_content = f.read()
+        map_file = MapFile.from_file(map_file_path)
 
     if args.type_filter:
         type_filter = _remove_all_spaces(args.type_filter).split(",")
@@ -283,22 +690,19 @@ if __name__ == "__main__":
             exit(1)
 
     console = Console()
-    section_analyzer = SectionAnalyzer(map_file_content, args.all_vm, args.section_filter, type_filter)
-
-    res = []
-    overall_vm_size = 0
-    overall_file_size = 0
+    section_analyzer = SectionAnalyzer(map_file, args.all_vm, args.section_filter, type_filter, args.incremental,
+                                       args.engine, args.symbols is not None, args.cross_check)
 
-    for file_path in build_dir.rglob("*.a"):
-        analysis_result = section_analyzer.get_sections(file_path)
-
-        if analysis_result:
-            res.append(analysis_result)
-            overall_vm_size = overall_vm_size + analysis_result.total_vm_size
-            overall_file_size = overall_file_size + analysis_result.total_file_size
+    file_paths = [file_path for build_dir in build_dirs for file_path in build_dir.rglob("*.a")]
+    res = section_analyzer.analyze(file_paths, args.jobs or None)
+    overall_vm_size = sum(analysis_result.total_vm_size for analysis_result in res)
+    overall_file_size = sum(analysis_result.total_file_size for analysis_result in res)
 
     res.sort(key=lambda x: x.total_vm_size, reverse=True)
 
+    if args.incremental:
+        console.print(f"Reused files: {section_analyzer.reused_files} of {section_analyzer.total_files}")
+
     if args.csv:
         with open("output.csv", "w") as f:
             f.write("file_path,section,type,vm_size,file_size\n")
@@ -310,4 +714,6 @@ if __name__ == "__main__":
         for analysis_result in res:
             if analysis_result.total_vm_size > 0 or args.all_vm:
                 analysis_result.print(console, overall_vm_size, overall_file_size)
+                if args.symbols is not None:
+                    analysis_result.print_symbols(console, args.symbols)
                 console.print("")
@@ -0,0 +1,292 @@
+# Copyright (c) 2023, Auterion AG
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+# Crash Triage
+
+Clusters a large corpus of PX4 hardfault logs and GDB fuzz logs (as written by
+`scripts/out_of_memory_fuzzer.py`) by their fault signature. The signature
+consists of:
+
+- the symbols of the PC and LR registers,
+- the names of the set CFSR and HFSR fault bits,
+- the top symbolized frames. For GDB logs, these are the first backtrace
+  frames, for hardfault logs, these are the return addresses found by scanning
+  the stack dump for code addresses, which requires the ELF file.
+
+The logs are parsed in a process pool and the clusters are ranked by their
+number of logs. For every cluster of hardfault logs one representative sparse
+ELF core file is written, see `emdbg.analyze.hardfault.convert_to_elf()`.
+
+
+## Command Line Interface
+
+```sh
+python3 -m emdbg.analyze.triage path/to/logs --elf firmware.elf --jobs 8
+# Write a representative coredump per cluster
+python3 -m emdbg.analyze.triage path/to/logs --elf firmware.elf --output triage
+```
+"""
+
+from __future__ import annotations
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from .backtrace import Frame
+from .hardfault import _parse as _parse_hardfault, _UNKNOWN_MEM, convert_to_elf
+
+_CFSR_BITS = {
+    0: "IACCVIOL", 1: "DACCVIOL", 3: "MUNSTKERR", 4: "MSTKERR", 5: "MLSPERR",
+    8: "IBUSERR", 9: "PRECISERR", 10: "IMPRECISERR", 11: "UNSTKERR", 12: "STKERR",
+    13: "LSPERR", 16: "UNDEFINSTR", 17: "INVSTATE", 18: "INVPC", 19: "NOCP",
+    24: "UNALIGNED", 25: "DIVBYZERO",
+}
+_HFSR_BITS = {1: "VECTTBL", 30: "FORCED", 31: "DEBUGEVT"}
+_SCB_CFSR = 0xE000_ED28
+_SCB_HFSR = 0xE000_ED2C
+_FRAME_LINE = re.compile(r"^#\d+ ", re.MULTILINE)
+# Rows of the `px4_registers` table and the `arm scb /h` output
+_REGISTER = re.compile(r"^\s*(pc|lr|cfsr|hfsr)\b[\s│:=|]+(?:0x)?([0-9a-f]+)\b",
+                       re.MULTILINE | re.IGNORECASE)
+# Stack memory of the hardfault log, excluding the peripherals
+_RAM_END = 0x4000_0000
+
+
+@dataclass(frozen=True)
+class Signature:
+    """The fault signature of a crash log"""
+    kind: str
+    """The kind of log: `hardfault`, or `assert`, `error` or `silent` for GDB logs"""
+    pc: str = None
+    """Symbol of the program counter"""
+    lr: str = None
+    """Symbol of the link register"""
+    faults: tuple[str, ...] = ()
+    """Names of the set CFSR and HFSR bits"""
+    frames: tuple[str, ...] = ()
+    """The top symbolized frames"""
+
+    def __str__(self) -> str:
+        parts = [f"pc={self.pc}", f"lr={self.lr}"] if self.pc or self.lr else []
+        if self.faults: parts.append("|".join(self.faults))
+        if self.frames: parts.append(" < ".join(self.frames))
+        return " ".join(parts) or "(no signature)"
+
+
+@dataclass
+class Cluster:
+    """Logs with the same signature"""
+    signature: Signature
+    logs: list[Path] = field(default_factory=list)
+    """All logs of this cluster in sorted order"""
+
+    @property
+    def representative(self) -> Path:
+        """The first log of the cluster"""
+        return self.logs[0]
+
+
+def _fault_names(cfsr: int, hfsr: int) -> tuple[str, ...]:
+    return (tuple(name for bit, name in _CFSR_BITS.items() if cfsr & (1 << bit)) +
+            tuple(name for bit, name in _HFSR_BITS.items() if hfsr & (1 << bit)))
+
+
+# The symbolizer of each worker process
+_SYMBOLIZER = None
+
+def _init_worker(elf: Path, cache: Path | bool = False):
+    global _SYMBOLIZER
+    if elf is not None:
+        from .pcsample import ElfSymbolizer
+        _SYMBOLIZER = ElfSymbolizer(elf, cache)
+
+
+def _symbol(address: int | None) -> str | None:
+    if address is None or address == _UNKNOWN_MEM: return None
+    if _SYMBOLIZER and (symbol := _SYMBOLIZER.lookup(address & ~1)):
+        return symbol[0]
+    return f"{address:#010x}"
+
+
+def _hardfault_signature(log: str, depth: int) -> Signature:
+    known_mems, regs = _parse_hardfault(log)
+    frames = []
+    if _SYMBOLIZER is not None:
+        # Scan the stack for Thumb return addresses into functions
+        sp = regs["sp"] if regs["sp"] != _UNKNOWN_MEM else 0
+        for address in sorted(a for a in known_mems if sp <= a < _RAM_END):
+            if len(frames) >= depth: break
+            value = known_mems[address]
+            if value & 1 and (symbol := _SYMBOLIZER.lookup(value & ~1)):
+                if not frames or frames[-1] != symbol[0]:
+                    frames.append(symbol[0])
+    return Signature("hardfault", _symbol(regs["pc"]), _symbol(regs["lr"]),
+                     _fault_names(known_mems.get(_SCB_CFSR, 0), known_mems.get(_SCB_HFSR, 0)),
+                     tuple(frames))
+
+
+def _gdb_log_signature(log: str, depth: int) -> Signature:
+    if "<signal handler called>" in log: kind = "hardfault"
+    elif "up_assert" in log: kind = "assert"
+    elif "ERROR" in log: kind = "error"
+    else: kind = "silent"
+    # Use the first backtrace of the log
+    frames = []
+    for line in log.splitlines():
+        if not _FRAME_LINE.match(line):
+            if frames: break
+            continue
+        if (frame := Frame(line)).is_valid:
+            frames.append(frame.function_name.strip())
+    registers = {m.group(1).lower(): int(m.group(2), 16) for m in _REGISTER.finditer(log)}
+    pc, lr = registers.get("pc"), registers.get("lr")
+    faults = _fault_names(registers.get("cfsr", 0), registers.get("hfsr", 0))
+    return Signature(kind, _symbol(pc), _symbol(lr), faults, tuple(frames[:depth]))
+
+
+def _is_hardfault_log(log: str) -> bool:
+    # GDB logs contain backtraces, hardfault logs only registers and memory
+    return _FRAME_LINE.search(log) is None and " sp:" in log
+
+
+def signature(logfile: Path, depth: int = 5) -> Signature:
+    """
+    Extracts the fault signature of a hardfault log or a GDB log. Call
+    `_init_worker()` with the ELF file first to symbolize the addresses.
+
+    :param logfile: The hardfault log or GDB log file.
+    :param depth: The number of top frames to include.
+    :return: The signature of the log.
+    """
+    log = Path(logfile).read_text(errors="replace")
+    if _is_hardfault_log(log):
+        return _hardfault_signature(log, depth)
+    return _gdb_log_signature(log, depth)
+
+
+def _signature_of(args: tuple[Path, int]) -> Signature:
+    return signature(*args)
+
+
+def triage(logfiles: list[Path], elf: Path = None, depth: int = 5,
+           jobs: int = None, cache: Path | bool = False) -> list[Cluster]:
+    """
+    Extracts the signatures of all logs in parallel and clusters them.
+
+    :param logfiles: The hardfault logs and GDB logs.
+    :param elf: The ELF file of the firmware to symbolize the addresses with.
+    :param depth: The number of top frames to include in the signature.
+    :param jobs: Number of processes, defaults to the number of CPUs.
+    :param cache: Read the symbols from the persistent index of the ELF file,
+        see `emdbg.analyze.pcsample.ElfSymbolizer`.
+    :return: The clusters sorted by their number of logs, largest first.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    logfiles = sorted(Path(l) for l in logfiles)
+    if elf is not None and cache:
+        # Build the index once instead of in every worker
+        from .elfindex import ElfIndex
+        ElfIndex(elf, None if cache is True else cache).close()
+    clusters = {}
+    jobs = jobs or os.cpu_count() or 1
+    # Large chunks amortize the inter-process overhead of small logs
+    chunksize = min(max(1, len(logfiles) // (4 * jobs)), 256)
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(elf, cache)) as executor:
+        signatures = executor.map(_signature_of, ((l, depth) for l in logfiles),
+                                  chunksize=chunksize)
+        for logfile, sig in zip(logfiles, signatures):
+            clusters.setdefault(sig, Cluster(sig)).logs.append(logfile)
+    return sorted(clusters.values(), key=lambda c: (-len(c.logs), str(c.signature)))
+
+
+def write_representatives(clusters: list[Cluster], output: Path) -> dict[Signature, Path]:
+    """
+    Writes a sparse ELF core file of the representative of every cluster of
+    hardfault logs into the output directory.
+
+    :return: The core file of every cluster signature.
+    """
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    cores = {}
+    for rank, cluster in enumerate(clusters, start=1):
+        log = cluster.representative.read_text(errors="replace")
+        if not _is_hardfault_log(log): continue
+        core = output / f"cluster_{rank}_{cluster.representative.stem}.core"
+        convert_to_elf(log, core)
+        cores[cluster.signature] = core
+    return cores
+
+
+def clusters_as_table(clusters: list[Cluster], total: int = None,
+                      cores: dict[Signature, Path] = None) -> "rich.table.Table":
+    """:return: a rich table of the ranked clusters"""
+    import rich.box
+    from rich.table import Table
+    total = total or sum(len(c.logs) for c in clusters) or 1
+    table = Table(box=rich.box.MINIMAL_DOUBLE_HEAD)
+    table.add_column("#", justify="right")
+    table.add_column("Logs", justify="right")
+    table.add_column("%", justify="right")
+    table.add_column("Kind")
+    table.add_column("Signature")
+    table.add_column("Representative")
+    for rank, cluster in enumerate(clusters, start=1):
+        representative = str(cluster.representative)
+        if cores and (core := cores.get(cluster.signature)):
+            representative += f"\n{core}"
+        table.add_row(str(rank), str(len(cluster.logs)), f"{len(cluster.logs) / total * 100:.1f}",
+                      cluster.signature.kind, str(cluster.signature), representative)
+    return table
+
+
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+    import argparse, rich
+
+    parser = argparse.ArgumentParser(description="Crash Triage")
+    parser.add_argument(
+        "directory",
+        type=Path,
+        help="The directory containing the logs.")
+    parser.add_argument(
+        "--pattern",
+        action="append",
+        help="Glob patterns of the logs, defaults to `hardfault*.log` and `log_*.txt`.")
+    parser.add_argument(
+        "--elf",
+        type=Path,
+        help="The ELF file to symbolize the addresses with.")
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=5,
+        help="Number of top frames in the signature.")
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="Number of processes, defaults to the number of CPUs.")
+    parser.add_argument(
+        "--top",
+        type=int,
+        help="Only show the largest clusters.")
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        help="Write a representative coredump per cluster into this directory.")
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        default=False,
+        help="Read the symbols from the persistent index of the ELF file.")
+    args = parser.parse_args()
+
+    logfiles = {log for pattern in (args.pattern or ["hardfault*.log", "log_*.txt"])
+                for log in args.directory.rglob(pattern)}
+    clusters = triage(logfiles, args.elf, args.frames, args.jobs, args.cache)
+    cores = write_representatives(clusters, args.output) if args.output else None
+    rich.print(f"{len(logfiles)} logs in {len(clusters)} clusters")
+    rich.print(clusters_as_table(clusters[:args.top], len(logfiles), cores))
@@ -2,7 +2,15 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 from __future__ import annotations
+import re
+import time
 from pathlib import Path
+from typing import Iterator
+
+_BACKTRACE_SEPARATOR = re.compile(r"(?:Breakpoint|Hardware .*?watchpoint) \d")
+# How much of the log is inspected to detect the GDB/MI format
+_MI_DETECTION_SIZE = 64 * 1024
+
 
 def read_gdb_log(logfile: Path) -> str:
     """
@@ -13,3 +21,178 @@ def read_gdb_log(logfile: Path) -> str:
         lines = text.splitlines()
         text = "\n".join(l[2:-1].encode("latin-1").decode('unicode_escape').strip() for l in lines if l.startswith('~"'))
     return text
+
+
+def _decode_mi_line(line: str) -> str:
+    return line[2:-1].encode("latin-1").decode('unicode_escape').strip()
+
+
+def is_mi_log(logfile: Path) -> bool:
+    """:return: `True` if the GDB log file is in the GDB/MI format"""
+    with Path(logfile).open("rb") as f:
+        sample = f.read(_MI_DETECTION_SIZE)
+    return sample.startswith(b'~"') or b'\n~"' in sample
+
+
+def iter_gdb_log(logfile: Path, offset: int = 0, is_mi: bool = None) -> Iterator[tuple[int, str]]:
+    """
+    Reads a GDB log file line by line and converts the GDB/MI format back into
+    normal lines. In contrast to `read_gdb_log()` the file is never loaded
+    into memory at once.
+
+    :param logfile: The GDB log file to read.
+    :param offset: The byte offset in the file to start reading from. Must be at
+        the start of a line.
+    :param is_mi: Whether the log is in GDB/MI format. If `None`, the format is
+        detected from the beginning of the file.
+    :return: a generator of the byte offset of the line in the file and the
+        decoded line.
+    """
+    if is_mi is None:
+        is_mi = is_mi_log(logfile)
+    with Path(logfile).open("rb") as f:
+        f.seek(offset)
+        for raw_line in f:
+            line = raw_line.decode(errors="replace").rstrip("\r\n")
+            if is_mi:
+                if line.startswith('~"'):
+                    yield offset, _decode_mi_line(line)
+            else:
+                yield offset, line
+            offset += len(raw_line)
+
+
+def follow_gdb_log(logfile: Path, offset: int = 0, is_mi: bool = None,
+                   timeout: float = 1) -> Iterator[tuple[int, str | None]]:
+    """
+    Reads a GDB log file line by line like `iter_gdb_log()`, but then waits for
+    new lines at the end of the file forever, for example of a log that is
+    still written by GDB or by `emdbg.serial.protocol.CommandPrompt.log_to_file()`.
+
+    :param logfile: The GDB log file to read.
+    :param offset: The byte offset in the file to start reading from. Must be at
+        the start of a line.
+    :param is_mi: Whether the log is in GDB/MI format. If `None`, the format is
+        detected from the first line.
+    :param timeout: The time in seconds without new lines after which `None`
+        is yielded instead of a line.
+    :return: a generator of the byte offset of the line in the file and the
+        decoded line, or `None` after every timeout.
+    """
+    with Path(logfile).open("rb") as f:
+        f.seek(offset)
+        partial, last_line = b"", time.monotonic()
+        while True:
+            if raw_line := f.readline():
+                # Wait for the rest of a line that is still being written
+                partial += raw_line
+                if not partial.endswith(b"\n"): continue
+                line = partial.decode(errors="replace").rstrip("\r\n")
+                if is_mi is None:
+                    is_mi = line.startswith('~"')
+                if not is_mi:
+                    yield offset, line
+                elif line.startswith('~"'):
+                    yield offset, _decode_mi_line(line)
+                offset += len(partial)
+                partial, last_line = b"", time.monotonic()
+                continue
+            if time.monotonic() - last_line >= timeout:
+                yield offset, None
+                last_line = time.monotonic()
+            time.sleep(min(timeout, 0.1))
+
+
+def iter_gdb_log_records(logfile: Path, separator: re.Pattern = None, offset: int = 0,
+                         end: int = None, is_mi: bool = None) -> Iterator[tuple[int, str]]:
+    """
+    Splits a GDB log file into records at every separator match while reading
+    it line by line. This yields the same records as a `re.split()` over the
+    output of `read_gdb_log()` with constant memory usage.
+
+    :param logfile: The GDB log file to read.
+    :param separator: The compiled pattern to split the records on. Must not
+        match across lines. Defaults to breakpoint and watchpoint hits.
+    :param offset: The byte offset in the file to start reading from. Must be at
+        the start of a line.
+    :param end: The byte offset of a line containing a separator as returned
+        by `record_offsets()`. The last record ends at this separator.
+    :param is_mi: Whether the log is in GDB/MI format. If `None`, the format is
+        detected from the beginning of the file.
+    :return: a generator of the byte offset of the line the record starts on,
+        and the record text.
+    """
+    if separator is None:
+        separator = _BACKTRACE_SEPARATOR
+    record, record_offset = [], offset
+    for line_offset, line in iter_gdb_log(logfile, offset, is_mi):
+        if end is not None and line_offset >= end:
+            if match := separator.search(line):
+                record.append(line[:match.start()])
+            break
+        start = 0
+        for match in separator.finditer(line):
+            record.append(line[start:match.start()])
+            yield record_offset, "\n".join(record)
+            record, record_offset = [], line_offset
+            start = match.end()
+        record.append(line[start:])
+    yield record_offset, "\n".join(record)
+
+
+def record_offsets(logfile: Path, count: int, separator: re.Pattern = None,
+                   start: int = 0, is_mi: bool = None) -> list[int]:
+    """
+    Finds the byte offsets of lines containing a record separator to split a
+    GDB log file into roughly equally sized shards. The shards can be read
+    independently with `iter_gdb_log_records()` using the offsets as `offset`
+    and `end` arguments, where every shard except the first one yields the
+    text before the separator as its first record, which must be discarded.
+
+    :param logfile: The GDB log file to read.
+    :param count: The maximum number of shards.
+    :param separator: The compiled pattern to split the records on.
+    :param start: The byte offset in the file to start splitting from.
+    :param is_mi: Whether the log is in GDB/MI format. If `None`, the format is
+        detected from the beginning of the file.
+    :return: a sorted list of at most `count - 1` unique byte offsets larger
+        than `start`.
+    """
+    if separator is None:
+        separator = _BACKTRACE_SEPARATOR
+    if is_mi is None:
+        is_mi = is_mi_log(logfile)
+    size = Path(logfile).stat().st_size
+    offsets = []
+    with Path(logfile).open("rb") as f:
+        for index in range(1, count):
+            position = start + (size - start) * index // count
+            position = max(position, (offsets[-1] if offsets else start) + 1)
+            if position >= size: break
+            # Skip the partial line unless we are at the start of one
+            f.seek(position - 1)
+            if f.read(1) != b"\n":
+                position += len(f.readline())
+            for raw_line in f:
+                line = raw_line.decode(errors="replace").rstrip("\r\n")
+                if is_mi:
+                    line = _decode_mi_line(line) if line.startswith('~"') else ""
+                if separator.search(line):
+                    break
+                position += len(raw_line)
+            else:
+                break
+            offsets.append(position)
+    return offsets
+
+
+def iter_backtraces(logfile: Path) -> Iterator[str]:
+    """
+    Reads a GDB log file containing the output of the `px4_commands_backtrace`
+    commands and yields the text of every breakpoint or watchpoint hit.
+
+    :param logfile: The GDB log file to read.
+    :return: a generator of backtrace descriptions for `emdbg.analyze.backtrace`.
+    """
+    for _, record in iter_gdb_log_records(logfile):
+        yield record
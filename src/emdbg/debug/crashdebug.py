@@ -29,17 +29,22 @@ class CrashProbeBackend(ProbeBackend):
             self.coredump = coredump
             self._tmpfile = None
         else:
-            contents = coredump.read_text()
-            if "arm_hardfault" in contents:
+            with coredump.open("rb") as f:
+                is_elf = f.read(4) == b"\x7fELF"
+            if is_elf:
+                from .px4.elfcore import read_elf_core, format_crashdebug
+                contents = format_crashdebug(*read_elf_core(coredump))
+            elif "arm_hardfault" in (contents := coredump.read_text()):
                 from ..analyze import convert_hardfault
-                tmpfile = tempfile.NamedTemporaryFile(mode="w+t", delete=False)
-                tmpfile.writelines(convert_hardfault(contents))
-                tmpfile.flush()
-                self.coredump = tmpfile.name
-                self._tmpfile = tmpfile
+                contents = convert_hardfault(contents)
             else:
-                raise NotImplementedError("Unknown coredump format! "
-                        "Only coredump_{datetime}.txt or hardfault*.log is supported!")
+                raise NotImplementedError("Unknown coredump format! Only coredump_{datetime}.txt, "
+                        "ELF core files or hardfault*.log is supported!")
+            tmpfile = tempfile.NamedTemporaryFile(mode="w+t", delete=False)
+            tmpfile.writelines(contents)
+            tmpfile.flush()
+            self.coredump = tmpfile.name
+            self._tmpfile = tmpfile
 
         self.binary = "CrashDebug"
         if "Windows" in platform.platform():
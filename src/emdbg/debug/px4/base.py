@@ -4,7 +4,172 @@
 from __future__ import annotations
 import re
 from . import utils
-from functools import cached_property
+import functools
+from typing import Any, Callable
+
+# The number of times GDB stopped, which invalidates all cached properties
+_GENERATION = 0
+
+class cached_property(functools.cached_property):
+    """
+    Drop-in replacement for `functools.cached_property`, whose value is only
+    cached until GDB stops the next time. Every value remembers the stop
+    generation it was computed in and is recomputed lazily on the next access
+    in a later generation. Assigning to the property caches the assigned value
+    for the current generation.
+    """
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        entry = instance.__dict__.get(self.attrname)
+        if entry is None or entry[0] != _GENERATION:
+            entry = instance.__dict__[self.attrname] = (_GENERATION, self.func(instance))
+        return entry[1]
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.attrname] = (_GENERATION, value)
+
+    def __delete__(self, instance):
+        instance.__dict__.pop(self.attrname, None)
+
+
+class MemoryCache:
+    """
+    Page cache of the target memory that is shared by all `Base` objects, so
+    that many small reads of the same memory only cost one transaction with
+    the debug probe. Memory is fetched in aligned pages and consecutive missing
+    pages are fetched in one read. The cache is cleared whenever GDB stopped,
+    the target continued or GDB wrote to its memory.
+
+    Reads whose pages overlap the `bypass` ranges are never cached, since reading
+    peripheral registers can have side effects and their values change while
+    the target is halted. Reads larger than `max_pages` pages are not cached
+    either, so that coredumps do not fill the cache.
+    """
+    BYPASS = [
+        (0x4000_0000, 0x6000_0000), # Peripherals
+        (0xA000_0000, 0xC000_0000), # External memory controller registers
+        (0xE000_0000, 0x1_0000_0000), # System control space and vendor system
+    ]
+
+    def __init__(self, page_size: int = 256, max_pages: int = 16):
+        self.page_size = page_size
+        """The size and alignment of the cached pages in bytes."""
+        self.max_pages = max_pages
+        """Reads that span more pages are passed through."""
+        self.bypass = list(self.BYPASS)
+        """List of uncached `(start, end)` address ranges."""
+        self.enabled = True
+        self._pages = {}
+        self.reads = 0
+        """Number of memory reads."""
+        self.transactions = 0
+        """Number of reads that were forwarded to the target."""
+        self.hits = 0
+        """Number of pages that were read from the cache."""
+        self.misses = 0
+        """Number of pages that were fetched from the target."""
+
+    def clear(self, event=None):
+        """Removes all cached pages."""
+        self._pages.clear()
+
+    def reset_statistics(self):
+        """Resets all counters to zero."""
+        self.reads = self.transactions = self.hits = self.misses = 0
+
+    def is_bypassed(self, address: int, size: int) -> bool:
+        """:return: `True` if the memory range overlaps a bypass range"""
+        return any(start < address + size and address < end for start, end in self.bypass)
+
+    def read(self, gdb, inferior: "gdb.Inferior", address: int, size: int) -> memoryview:
+        """
+        Reads memory through the cache.
+
+        :param gdb: The GDB module.
+        :param inferior: The inferior to read from.
+        :return: The content of the memory.
+        """
+        self.reads += 1
+        page_size = self.page_size
+        first, last = address // page_size, (address + size - 1) // page_size
+        # Whole pages are fetched, so they must not overlap a bypass range either
+        if (not self.enabled or size <= 0 or last - first >= self.max_pages or
+                self.is_bypassed(first * page_size, (last - first + 1) * page_size)):
+            self.transactions += 1
+            return inferior.read_memory(address, size)
+
+        page = first
+        while page <= last:
+            if (inferior.num, page) in self._pages:
+                self.hits += 1
+                page += 1
+                continue
+            end = page
+            while end < last and (inferior.num, end + 1) not in self._pages:
+                end += 1
+            self.transactions += 1
+            try:
+                data = inferior.read_memory(page * page_size, (end - page + 1) * page_size).tobytes()
+            except gdb.MemoryError:
+                # The page may extend beyond the accessible memory
+                self.transactions += 1
+                return inferior.read_memory(address, size)
+            self.misses += end - page + 1
+            for index in range(page, end + 1):
+                offset = (index - page) * page_size
+                self._pages[(inferior.num, index)] = data[offset:offset + page_size]
+            page = end + 1
+
+        offset = address - first * page_size
+        if first == last:
+            return memoryview(self._pages[(inferior.num, first)])[offset:offset + size]
+        data = b"".join(self._pages[(inferior.num, index)] for index in range(first, last + 1))
+        return memoryview(data)[offset:offset + size]
+
+    def __str__(self) -> str:
+        return (f"{self.reads} reads, {self.transactions} transactions "
+                f"({self.reads - self.transactions} saved), "
+                f"{self.hits} page hits, {self.misses} page misses")
+
+
+class LookupCache:
+    """
+    Process-wide cache of the types, enums and symbols that are looked up by
+    name and that only change when GDB loads or unloads an objfile. The cache
+    is therefore only cleared on the `new_objfile` and `clear_objfiles` events
+    and not whenever GDB stopped.
+    """
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        """Number of lookups that were answered from the cache."""
+        self.misses = 0
+        """Number of lookups that were forwarded to GDB."""
+
+    def clear(self, event=None):
+        """Removes all cached lookups."""
+        self._entries.clear()
+
+    def get(self, key: tuple, lookup: Callable[[], Any]) -> Any:
+        """
+        :param key: The unique key of the lookup.
+        :param lookup: Called to look up the value if it is not cached.
+        :return: the cached result of the lookup, which may be `None`.
+        """
+        try:
+            value = self._entries[key]
+            self.hits += 1
+            return value
+        except KeyError:
+            pass
+        self.misses += 1
+        value = self._entries[key] = lookup()
+        return value
+
+    def __str__(self) -> str:
+        return f"{len(self._entries)} entries, {self.hits} hits, {self.misses} misses"
+
 
 class Base:
     """
@@ -12,25 +177,34 @@ class Base:
     Python API, which can be a little verbose.
 
     It also provides a mechanism to invalidate cached properties whenever GDB
-    stopped. This allows the use of `@cached_property` when the target is halted
-    to cache expensive operations.
+    stopped. This allows the use of `@cached_property` from this module when
+    the target is halted to cache expensive operations.
+
+    All memory reads go through the shared `MemoryCache` in `Base.memory_cache`
+    and the lookups of types, enums and symbols by name go through the shared
+    `LookupCache` in `Base.lookup_cache`.
     """
+    memory_cache = MemoryCache()
+    """The page cache of the target memory."""
+    lookup_cache = LookupCache()
+    """The cache of types, enums and symbols."""
+
     def __init__(self, gdb):
         self._gdb = gdb
         self._inf = gdb.selected_inferior()
         self._arch = self._inf.architecture()
         self.register_names = [r.name for r in self._arch.registers()]
         # Registering a callback for every obj makes GDB *really* slow :(
-        global _CACHED_OBJECTS
-        if _CACHED_OBJECTS is None:
+        global _EVENTS_CONNECTED
+        if not _EVENTS_CONNECTED:
             gdb.events.stop.connect(_invalidate_cached_properties)
-            _CACHED_OBJECTS = []
-        _CACHED_OBJECTS.append(self)
-
-    def _invalidate(self):
-        for key, value in self.__class__.__dict__.items():
-            if isinstance(value, cached_property):
-                self.__dict__.pop(key, None)
+            gdb.events.cont.connect(Base.memory_cache.clear)
+            if hasattr(gdb.events, "memory_changed"):
+                gdb.events.memory_changed.connect(Base.memory_cache.clear)
+            for event in ("new_objfile", "clear_objfiles"):
+                if hasattr(gdb.events, event):
+                    getattr(gdb.events, event).connect(Base.lookup_cache.clear)
+            _EVENTS_CONNECTED = True
 
     @cached_property
     def registers(self) -> dict[str, int]:
@@ -73,6 +247,29 @@ class Base:
         regs["r13"] = regs["msp"]
         return regs
 
+    def lookup_type(self, name: str) -> "gdb.Type":
+        """:return: the cached type of this name"""
+        return self.lookup_cache.get(("type", name), lambda: self._gdb.lookup_type(name))
+
+    def pointer_type(self, name: str) -> "gdb.Type":
+        """:return: the cached pointer type to the type of this name"""
+        return self.lookup_cache.get(("pointer", name), lambda: self.lookup_type(name).pointer())
+
+    def enum_dict(self, name: str) -> dict[str, int]:
+        """:return: the cached mapping of enumerator names to values of the enum type"""
+        def _lookup():
+            values = self._gdb.types.make_enum_dict(self.lookup_type(name))
+            return {key: int(value) for key, value in values.items()}
+        return self.lookup_cache.get(("enum", name), _lookup)
+
+    def lookup_global_symbol(self, name: str) -> "gdb.Symbol | None":
+        """:return: the cached global symbol of this name or `None`"""
+        return self.lookup_cache.get(("global", name), lambda: self._gdb.lookup_global_symbol(name))
+
+    def lookup_static_symbol(self, name: str) -> "gdb.Symbol | None":
+        """:return: the cached static symbol of this name or `None`"""
+        return self.lookup_cache.get(("static", name), lambda: self._gdb.lookup_static_symbol(name))
+
     def lookup_static_symbol_in_function(self, symbol_name: str, function_name: str) -> "gdb.Symbol | None":
         """
         Lookup a static symbol inside a function. GDB makes this complicated
@@ -80,25 +277,27 @@ class Base:
 
         :return: the symbol if found or `None`
         """
-        if (function := self._gdb.lookup_global_symbol(function_name)) is None:
+        def _lookup():
+            if (function := self.lookup_global_symbol(function_name)) is None:
+                return None
+            function = function.value()
+            function_block = self._gdb.block_for_pc(int(function.address))
+            for symbol in function_block:
+                if symbol.addr_class == self._gdb.SYMBOL_LOC_STATIC:
+                    if symbol.name == symbol_name:
+                        return symbol
             return None
-        function = function.value()
-        function_block = self._gdb.block_for_pc(int(function.address))
-        for symbol in function_block:
-            if symbol.addr_class == self._gdb.SYMBOL_LOC_STATIC:
-                if symbol.name == symbol_name:
-                    return symbol
-        return None
+        return self.lookup_cache.get(("function static", function_name, symbol_name), _lookup)
 
     def lookup_static_symbol_ptr(self, name: str) -> "gdb.Value":
         """:return: a Value to a static symbol name"""
-        if symbol := self._gdb.lookup_static_symbol(name):
+        if symbol := self.lookup_static_symbol(name):
             return self.value_ptr(symbol)
         return None
 
     def lookup_global_symbol_ptr(self, name) -> "gdb.Value":
         """:return: a Value to a global symbol name"""
-        if symbol := self._gdb.lookup_global_symbol(name):
+        if symbol := self.lookup_global_symbol(name):
             return self.value_ptr(symbol)
         return None
 
@@ -118,20 +317,21 @@ class Base:
 
     def addr_ptr(self, addr: int, type: str) -> "gdb.Value":
         """Cast a memory address to a custom type."""
-        return self._gdb.Value(addr).cast(self._gdb.lookup_type(type).pointer())
+        return self._gdb.Value(addr).cast(self.pointer_type(type))
 
     def read_memory(self, address: int, size: int) -> memoryview:
         """
-        Reads a block of memory and returns its content.
+        Reads a block of memory through the `memory_cache` and returns its content.
         See [Inferiors](https://sourceware.org/gdb/onlinedocs/gdb/Inferiors-In-Python.html).
         """
-        return self._inf.read_memory(address, size)
+        return self.memory_cache.read(self._gdb, self._inf, address, size)
 
     def write_memory(self, address: int, buffer, length: int):
         """
         Writes a block of memory to an address.
         See [Inferiors](https://sourceware.org/gdb/onlinedocs/gdb/Inferiors-In-Python.html).
         """
+        self.memory_cache.clear()
         self._inf.write_memory(address, buffer, length=length)
 
     def read_uint(self, addr: int, size: int, default=None) -> int:
@@ -189,9 +389,10 @@ class Base:
         return self.integer_type(4, True)
 
 
-# Single callback makes GDB much faster, so we do the loop ourselves
-_CACHED_OBJECTS = None
+# Single callback makes GDB much faster and the objects do not need to be
+# tracked, since their cached properties compare the generation on access
+_EVENTS_CONNECTED = False
 def _invalidate_cached_properties(event):
-    global _CACHED_OBJECTS
-    for obj in _CACHED_OBJECTS:
-        if obj: obj._invalidate()
+    global _GENERATION
+    _GENERATION += 1
+    Base.memory_cache.clear()
@@ -2,12 +2,11 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 from __future__ import annotations
-from . import utils
+from . import utils, elfcore
 from dataclasses import dataclass
-from .base import Base
-from functools import cached_property
+from .base import Base, cached_property
 from pathlib import Path
-import re, time
+import time
 import rich.box
 from rich.text import Text
 from rich.table import Table
@@ -224,7 +223,7 @@ class Device(Base):
         The index, handler and argument of the NuttX interrupt table if the
         handler is not empty and is not `irq_unexpected_isr`.
         """
-        g_irqvector = self._gdb.lookup_global_symbol("g_irqvector")
+        g_irqvector = self.lookup_global_symbol("g_irqvector")
         vectors = {}
         for ii, vector in enumerate(utils.gdb_iter(g_irqvector)):
             if handler := vector["handler"]:
@@ -255,49 +254,65 @@ class Device(Base):
                 result.append(g)
         return result
 
-    def coredump(self, memories: list[tuple[int, int]] = None, with_flash: bool = False) -> tuple[str, int]:
-        """
-        Reads the memories and registers and returns them as a formatted string
-        that is compatible with CrashDebug (see `emdbg.debug.crashdebug`).
-
-        :param memories: list of memory ranges (start, size) to dump
-        :param with_flash: also dump the entire non-volatile storage
-        :return: coredump formatted as string and coredump size
-        """
+    def _read_memories(self, memories: list[tuple[int, int]] = None,
+                        with_flash: bool = False, sparse: bool = False) \
+                            -> tuple[list[tuple[int, bytes]], int]:
         if memories is None:
             memories = self._MEMORIES
         if with_flash and self.flash_size:
             memories += [(0x0800_0000, self.flash_size)]
-        lines = []
+        result = []
         total_size = 0
         for addr, size in memories:
             try:
-                data = self.read_memory(addr, size).cast("I")
+                result.append((addr, bytes(self.read_memory(addr, size))))
                 total_size += size
             except Exception as e:
                 print(f"Failed to read whole range [{addr:#x}, {addr+size:#x}]! {e}")
-                data = []
+                data = bytearray()
                 for offset in range(0, size, 4):
                     try:
-                        data.append(self.read_memory(addr + offset, 4).cast("I")[0])
+                        data += bytes(self.read_memory(addr + offset, 4))
                         total_size += 4
                     except Exception as e:
                         print(f"Failed to read uint32_t {addr+offset:#x}! {e}")
-                        data.append(0)
-                        continue
-            for ii, values in enumerate(utils.chunks(data, 4, 0)):
-                values = (hex(v & 0xffffffff) for v in values)
-                lines.append(f"{hex(addr + ii * 16)}: {' '.join(values)}")
-
-        for name, value in self.registers.items():
-            if re.match(r"d\d+", name):
-                lines.append(f"{name:<28} {float(value):<28} (raw {value & 0xffffffffffffffff:#x})")
-            elif re.match(r"s\d+", name):
-                lines.append(f"{name:<28} {float(value):<28} (raw {value & 0xffffffff:#x})")
-            else:
-                lines.append(f"{name:<28} {hex(value & 0xffffffff):<28} {int(value)}")
+                        if sparse:
+                            # Only keep the known memory
+                            if data: result.append((addr + offset - len(data), bytes(data)))
+                            data = bytearray()
+                        else:
+                            data += bytes(4)
+                if data: result.append((addr + size - len(data), bytes(data)))
+        return result, total_size
+
+    def coredump(self, memories: list[tuple[int, int]] = None, with_flash: bool = False) -> tuple[str, int]:
+        """
+        Reads the memories and registers and returns them as a formatted string
+        that is compatible with CrashDebug (see `emdbg.debug.crashdebug`).
 
-        return "\n".join(lines), total_size
+        :param memories: list of memory ranges (start, size) to dump
+        :param with_flash: also dump the entire non-volatile storage
+        :return: coredump formatted as string and coredump size
+        """
+        data, total_size = self._read_memories(memories, with_flash)
+        return elfcore.format_crashdebug(data, self.registers), total_size
+
+    def coredump_elf(self, filename: Path, memories: list[tuple[int, int]] = None,
+                     with_flash: bool = False) -> int:
+        """
+        Reads the memories and registers and writes them into an ARM ELF core
+        file, see `emdbg.debug.px4.elfcore`. Memory that cannot be read is not
+        written. The flash does not need to be dumped, since GDB reads it from
+        the ELF file of the firmware.
+
+        :param filename: The core file to write.
+        :param memories: list of memory ranges (start, size) to dump
+        :param with_flash: also dump the entire non-volatile storage
+        :return: coredump size
+        """
+        data, total_size = self._read_memories(memories, with_flash, sparse=True)
+        elfcore.write_elf_core(filename, data, self.registers)
+        return total_size
 
     @cached_property
     def cpuid(self) -> int:
@@ -481,20 +496,25 @@ def vector_table_as_table(gdb, columns: int = 1) -> Table:
 
 
 def coredump(gdb, memories: list[tuple[int, int]] = None,
-             with_flash: bool = False, filename: Path = None):
+             with_flash: bool = False, filename: Path = None, elf: bool = False):
     """
     Dumps the memories and register state into a file.
 
     :param memories: List of (addr, size) tuples that describe which memories to dump.
     :param with_flash: Also dump the entire non-volatile storage.
     :param filename: Target filename, or `coredump_{datetime}.txt` by default.
+    :param elf: Write an ARM ELF core file instead of the CrashDebug format,
+                with `coredump_{datetime}.core` as default filename.
     """
     if filename is None:
-        filename = utils.add_datetime("coredump.txt")
+        filename = utils.add_datetime("coredump.core" if elf else "coredump.txt")
     print("Starting coredump...", flush=True)
     start = time.perf_counter()
-    output, size = Device(gdb).coredump(memories, with_flash)
-    Path(filename).write_text(output)
+    if elf:
+        size = Device(gdb).coredump_elf(filename, memories, with_flash)
+    else:
+        output, size = Device(gdb).coredump(memories, with_flash)
+        Path(filename).write_text(output)
     end = time.perf_counter()
     print(f"Dumped {size//1000}kB in {(end - start):.1f}s ({int(size/((end - start)*1000))}kB/s)")
 
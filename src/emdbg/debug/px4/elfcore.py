@@ -0,0 +1,176 @@
+# Copyright (c) 2023, Auterion AG
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Reads and writes sparse ARM ELF core files, which GDB can load natively with
+`core-file` and which are a fraction of the size of the CrashDebug text format.
+
+Only the known memory is written as `PT_LOAD` segments. Read-only memory like
+the flash does not need to be included, since GDB reads it from the ELF file
+of the firmware. The core registers are stored in a `NT_PRSTATUS` note and the
+FPU registers in a `NT_ARM_VFP` note. All registers including the special
+purpose registers of the Cortex-M are additionally stored in an `EMDBG` note,
+so that the CrashDebug text format can be regenerated without loss.
+"""
+
+from __future__ import annotations
+import re
+import struct
+from pathlib import Path
+from typing import Iterable
+
+_ELF_HEADER = struct.Struct("<16sHHIIIIIHHHHHH")
+_PROGRAM_HEADER = struct.Struct("<IIIIIIII")
+_NOTE_HEADER = struct.Struct("<III")
+_ET_CORE = 4
+_EM_ARM = 40
+_PT_LOAD = 1
+_PT_NOTE = 4
+_NT_PRSTATUS = 1
+_NT_ARM_VFP = 0x400
+_NT_EMDBG_REGISTERS = 1
+# The prstatus of the Linux ARM ABI with the registers at offset 72
+_PRSTATUS_SIZE = 148
+_PRSTATUS_REGS = 72
+_CORE_REGS = [f"r{i}" for i in range(13)] + ["sp", "lr", "pc", "xpsr"]
+
+
+def words_to_memories(words: dict[int, int]) -> list[tuple[int, bytes]]:
+    """
+    Merges known 32-bit words into contiguous memory ranges.
+
+    :param words: Mapping of word-aligned address to value.
+    :return: a sorted list of (address, data) ranges.
+    """
+    memories = []
+    start, data = None, bytearray()
+    for address in sorted(words):
+        if start is None or address != start + len(data):
+            if start is not None: memories.append((start, bytes(data)))
+            start, data = address, bytearray()
+        data += struct.pack("<I", words[address] & 0xffff_ffff)
+    if start is not None: memories.append((start, bytes(data)))
+    return memories
+
+
+def _note(name: bytes, ntype: int, desc: bytes) -> bytes:
+    name += b"\0"
+    return (_NOTE_HEADER.pack(len(name), len(desc), ntype) +
+            name.ljust((len(name) + 3) & ~3, b"\0") + desc.ljust((len(desc) + 3) & ~3, b"\0"))
+
+
+def _vfp_registers(registers: dict[str, int]) -> bytes | None:
+    doubles = []
+    for index in range(32):
+        if (value := registers.get(f"d{index}")) is None:
+            low, high = registers.get(f"s{index*2}"), registers.get(f"s{index*2+1}")
+            value = None if low is None else (low | (high or 0) << 32)
+        doubles.append(value)
+    if all(d is None for d in doubles): return None
+    return struct.pack("<32QI", *((d or 0) & 0xffff_ffff_ffff_ffff for d in doubles),
+                       registers.get("fpscr", 0) & 0xffff_ffff)
+
+
+def write_elf_core(filename: Path, memories: Iterable[tuple[int, bytes]],
+                   registers: dict[str, int]) -> int:
+    """
+    Writes memories and registers into an ARM ELF core file.
+
+    :param filename: The core file to write.
+    :param memories: The (address, data) ranges of known memory.
+    :param registers: The register names and their unsigned values.
+    :return: the size of the file in bytes.
+    """
+    memories = [(a, bytes(d)) for a, d in memories if len(d)]
+    prstatus = bytearray(_PRSTATUS_SIZE)
+    struct.pack_into("<18I", prstatus, _PRSTATUS_REGS,
+                     *(registers.get(r, 0) & 0xffff_ffff for r in _CORE_REGS), 0)
+    notes = _note(b"CORE", _NT_PRSTATUS, bytes(prstatus))
+    if (vfp := _vfp_registers(registers)) is not None:
+        notes += _note(b"LINUX", _NT_ARM_VFP, vfp)
+    regs = "".join(f"{name}={value:#x}\n" for name, value in registers.items())
+    notes += _note(b"EMDBG", _NT_EMDBG_REGISTERS, regs.encode())
+
+    headers_size = _ELF_HEADER.size + _PROGRAM_HEADER.size * (1 + len(memories))
+    offset = headers_size + len(notes)
+    phdrs = [_PROGRAM_HEADER.pack(_PT_NOTE, headers_size, 0, 0, len(notes), 0, 0, 4)]
+    for address, data in memories:
+        phdrs.append(_PROGRAM_HEADER.pack(_PT_LOAD, offset, address, address,
+                                          len(data), len(data), 7, 4))
+        offset += len(data)
+    ident = b"\x7fELF" + bytes([1, 1, 1, 0]) + bytes(8)
+    header = _ELF_HEADER.pack(ident, _ET_CORE, _EM_ARM, 1, 0, _ELF_HEADER.size, 0, 0,
+                              _ELF_HEADER.size, _PROGRAM_HEADER.size, len(phdrs), 0, 0, 0)
+    with Path(filename).open("wb") as f:
+        f.write(header)
+        f.write(b"".join(phdrs))
+        f.write(notes)
+        for _, data in memories:
+            f.write(data)
+    return offset
+
+
+def read_elf_core(filename: Path) -> tuple[list[tuple[int, bytes]], dict[str, int]]:
+    """
+    Reads an ARM ELF core file written by `write_elf_core()` or another tool.
+
+    :param filename: The core file to read.
+    :return: the (address, data) ranges of memory and the register values.
+    """
+    content = Path(filename).read_bytes()
+    header = _ELF_HEADER.unpack_from(content)
+    if header[0][:6] != b"\x7fELF\x01\x01" or header[1] != _ET_CORE:
+        raise ValueError(f"'{filename}' is not a 32-bit little-endian ELF core file!")
+    phoff, phentsize, phnum = header[5], header[9], header[10]
+    memories, registers, emdbg_registers = [], {}, {}
+    for index in range(phnum):
+        ptype, offset, vaddr, _, filesz, *_ = _PROGRAM_HEADER.unpack_from(
+                content, phoff + index * phentsize)
+        if ptype == _PT_LOAD and filesz:
+            memories.append((vaddr, content[offset:offset + filesz]))
+        elif ptype == _PT_NOTE:
+            end = offset + filesz
+            while offset + _NOTE_HEADER.size <= end:
+                namesz, descsz, ntype = _NOTE_HEADER.unpack_from(content, offset)
+                offset += _NOTE_HEADER.size
+                name = content[offset:offset + namesz].rstrip(b"\0")
+                offset += (namesz + 3) & ~3
+                desc = content[offset:offset + descsz]
+                offset += (descsz + 3) & ~3
+                if name == b"CORE" and ntype == _NT_PRSTATUS:
+                    values = struct.unpack_from("<17I", desc, _PRSTATUS_REGS)
+                    registers.update(zip(_CORE_REGS, values))
+                elif name == b"LINUX" and ntype == _NT_ARM_VFP:
+                    *doubles, fpscr = struct.unpack_from("<32QI", desc)
+                    registers.update({f"d{i}": d for i, d in enumerate(doubles)})
+                    registers["fpscr"] = fpscr
+                elif name == b"EMDBG" and ntype == _NT_EMDBG_REGISTERS:
+                    for line in desc.decode().splitlines():
+                        name, value = line.split("=")
+                        emdbg_registers[name] = int(value, 16)
+    return sorted(memories), emdbg_registers or registers
+
+
+def format_crashdebug(memories: Iterable[tuple[int, bytes]], registers: dict[str, int]) -> str:
+    """
+    Formats memories and registers into the text format of CrashDebug.
+
+    :param memories: The (address, data) ranges of memory.
+    :param registers: The register names and their unsigned values.
+    :return: the coredump as CrashDebug compatible string.
+    """
+    lines = []
+    for address, data in memories:
+        data = bytes(data) + bytes(-len(data) % 16)
+        words = struct.unpack(f"<{len(data) // 4}I", data)
+        for index in range(0, len(words), 4):
+            values = " ".join(hex(v) for v in words[index:index + 4])
+            lines.append(f"{hex(address + index * 4)}: {values}")
+    for name, value in registers.items():
+        if re.match(r"d\d+", name):
+            lines.append(f"{name:<28} {float(value):<28} (raw {value & 0xffffffffffffffff:#x})")
+        elif re.match(r"s\d+", name):
+            lines.append(f"{name:<28} {float(value):<28} (raw {value & 0xffffffff:#x})")
+        else:
+            lines.append(f"{name:<28} {hex(value & 0xffffffff):<28} {int(value)}")
+    return "\n".join(lines)
@@ -0,0 +1,217 @@
+# Copyright (c) 2024, Auterion AG
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Accessing a struct member through `gdb.Value` subscripts is cheap inside GDB,
+however, over the RPyC bridge every subscript and conversion is a separate
+round trip. The `StructLayout` resolves the offset, size and type of the
+accessed fields once from the debug info, so that a struct can be read as a
+single block of memory and its fields decoded locally.
+
+The `walk_list()` and `walk_queue()` functions traverse the intrusive linked
+lists and queues of NuttX using these layouts, reading every node only once.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Iterator
+from .base import Base
+import logging
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class Field:
+    """The location of a (nested) struct field"""
+    offset: int
+    """Byte offset from the start of the struct."""
+    size: int
+    """Size of the field in bytes."""
+    type: "gdb.Type"
+    """The field type with all typedefs stripped."""
+    signed: bool
+    """Whether the integer value of the field is signed."""
+
+
+class StructLayout:
+    """
+    Memoized field layout of a struct type. Fields are addressed by their
+    path, for example `"xcp.regs"` for the `regs` member of the nested `xcp`
+    struct. Each path is resolved only once.
+
+    :param gdb: The GDB module.
+    :param type: The struct type or its name, e.g. `"struct tcb_s"`.
+    """
+    _INT_FORMATS = {1: "b", 2: "h", 4: "i", 8: "q"}
+
+    def __init__(self, gdb, type: "gdb.Type | str"):
+        self._gdb = gdb
+        if isinstance(type, str):
+            type = gdb.lookup_type(type)
+        self.type = type.strip_typedefs()
+        """The struct type with all typedefs stripped."""
+        self.size: int = self.type.sizeof
+        """The size of the struct in bytes."""
+        self._fields: dict[str, Field] = {}
+
+    def _is_signed(self, type: "gdb.Type") -> bool:
+        if type.code not in (self._gdb.TYPE_CODE_INT, self._gdb.TYPE_CODE_CHAR):
+            return False
+        # gdb.Type.is_signed only exists since GDB 12
+        if (signed := getattr(type, "is_signed", None)) is not None:
+            return bool(signed)
+        return not str(type).startswith("unsigned")
+
+    def field(self, path: str) -> Field:
+        """
+        :param path: The dot-separated names of the nested fields.
+        :return: the location of the field.
+        :raises KeyError: if the struct does not contain the field.
+        """
+        if (field := self._fields.get(path)) is not None:
+            return field
+        offset, type = 0, self.type
+        for name in path.split("."):
+            member = next((f for f in type.fields() if f.name == name), None)
+            if member is None:
+                raise KeyError(f"'{type}' has no field '{name}'!")
+            if member.bitsize:
+                raise KeyError(f"Bitfield '{path}' is not supported!")
+            offset += member.bitpos // 8
+            type = member.type.strip_typedefs()
+        field = Field(offset, type.sizeof, type, self._is_signed(type))
+        self._fields[path] = field
+        return field
+
+    def has_field(self, path: str) -> bool:
+        """:return: whether the struct contains the field"""
+        try:
+            self.field(path)
+        except KeyError:
+            return False
+        return True
+
+    def unpack(self, data, path: str, offset: int = 0) -> int:
+        """
+        Decodes an integer, enum or pointer field.
+
+        :param data: The memory of the struct.
+        :param offset: The offset of the struct inside the data.
+        :return: the integer value of the field.
+        """
+        field = self.field(path)
+        start = offset + field.offset
+        return int.from_bytes(data[start:start + field.size], "little", signed=field.signed)
+
+    def array(self, data, path: str, offset: int = 0) -> memoryview:
+        """
+        Decodes an array of integers.
+
+        :param data: The memory of the struct.
+        :param offset: The offset of the struct inside the data.
+        :return: a view of the array elements.
+        """
+        field = self.field(path)
+        element = field.type.target().strip_typedefs()
+        fmt = self._INT_FORMATS[element.sizeof]
+        if not self._is_signed(element): fmt = fmt.upper()
+        start = offset + field.offset
+        return memoryview(data)[start:start + field.size].cast(fmt)
+
+    def string(self, data, path: str, offset: int = 0) -> str:
+        """
+        Decodes a zero-terminated character array.
+
+        :param data: The memory of the struct.
+        :param offset: The offset of the struct inside the data.
+        :return: the string until the first zero character.
+        """
+        field = self.field(path)
+        start = offset + field.offset
+        value = bytes(data[start:start + field.size]).split(b"\0", 1)[0]
+        return value.decode("utf-8", errors="replace")
+
+
+def struct_layout(gdb, name: str) -> StructLayout:
+    """:return: the shared layout of the named struct type from the `Base.lookup_cache`"""
+    return Base.lookup_cache.get(("layout", name), lambda: StructLayout(gdb, name))
+
+
+@dataclass
+class ListNode:
+    """A node of a linked list with its raw memory"""
+    address: int
+    """The address of the node."""
+    data: memoryview
+    """The memory of the node."""
+    layout: StructLayout
+    """The layout of the node type."""
+
+    def __getitem__(self, path: str) -> int:
+        """:return: the integer value of the field"""
+        return self.layout.unpack(self.data, path)
+
+
+def walk_list(base: Base, layout: StructLayout, head: int,
+              link: str = "flink", back_link: str = None, tail: int = None,
+              limit: int = 10_000) -> Iterator[ListNode]:
+    """
+    Traverses an intrusive linked list by reading each node as one block of
+    memory through the memory cache of `base`. Nodes that are allocated close
+    to each other are therefore fetched together.
+
+    The traversal stops cleanly with a warning if the list contains a cycle,
+    a node cannot be read, the back link of a node does not point to the
+    previous node, or there are more than `limit` nodes.
+
+    :param base: The object to read the memory with.
+    :param layout: The layout of the node type.
+    :param head: The address of the first node.
+    :param link: The path of the field that points to the next node.
+    :param back_link: The path of the field that points to the previous node,
+                      which is checked if given.
+    :param tail: The address of the last node, otherwise the list ends with a
+                 zero link.
+    :param limit: The maximum number of nodes.
+    :return: the nodes in list order.
+    """
+    visited, previous, address = set(), 0, head
+    while address:
+        if address in visited:
+            LOGGER.warning(f"Cycle at node {address:#x} in list {head:#x}!")
+            return
+        if len(visited) >= limit:
+            LOGGER.warning(f"List {head:#x} has more than {limit} nodes!")
+            return
+        try:
+            node = ListNode(address, base.read_memory(address, layout.size), layout)
+        except base._gdb.MemoryError:
+            LOGGER.warning(f"Cannot read node {address:#x} in list {head:#x}!")
+            return
+        if back_link is not None and node[back_link] != previous:
+            LOGGER.warning(f"Node {address:#x} in list {head:#x} links back to "
+                           f"{node[back_link]:#x} instead of {previous:#x}!")
+            return
+        yield node
+        if address == tail:
+            return
+        visited.add(address)
+        previous, address = address, node[link]
+
+
+def walk_queue(base: Base, queue: "gdb.Symbol", layout: StructLayout,
+               queue_type: str = "dq_queue_t", **kwargs) -> Iterator[ListNode]:
+    """
+    Traverses a NuttX `sq_queue_t` or `dq_queue_t` from its head to its tail.
+
+    :param base: The object to read the memory with.
+    :param queue: The symbol of the queue.
+    :param layout: The layout of the node type.
+    :param queue_type: The type of the queue.
+    :param kwargs: Passed on to `walk_list()`.
+    :return: the nodes in queue order.
+    """
+    queue_layout = struct_layout(base._gdb, queue_type)
+    data = base.read_memory(int(queue.value().address), queue_layout.size)
+    head, tail = queue_layout.unpack(data, "head"), queue_layout.unpack(data, "tail")
+    yield from walk_list(base, layout, head, tail=tail, **kwargs)
@@ -2,12 +2,12 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 from __future__ import annotations
-from .base import Base
+from .base import Base, cached_property
+from .layout import struct_layout, walk_queue
 from .utils import format_units
 from typing import Callable, Any
 import rich.box, rich.markup
 from rich.table import Table
-from functools import cached_property
 import math
 
 
@@ -16,13 +16,13 @@ class PerfCounter(Base):
     Pretty Printing Perf Counters
     """
 
-    def __init__(self, gdb, perf_ptr: "gdb.Value"):
+    def __init__(self, gdb, perf_ptr: "gdb.Value | int"):
         super().__init__(gdb)
-        self._perf = perf_ptr.cast(gdb.lookup_type("struct perf_ctr_count").pointer())
+        self._perf = self.addr_ptr(int(perf_ptr), "struct perf_ctr_count")
         if self.type == "PC_ELAPSED":
-            self._perf = self._perf.cast(gdb.lookup_type("struct perf_ctr_elapsed").pointer())
+            self._perf = self._perf.cast(self.pointer_type("struct perf_ctr_elapsed"))
         elif self.type == "PC_INTERVAL":
-            self._perf = self._perf.cast(gdb.lookup_type("struct perf_ctr_interval").pointer())
+            self._perf = self._perf.cast(self.pointer_type("struct perf_ctr_interval"))
         # print(self._perf, self.short_type, self.events, self.name)
 
     @cached_property
@@ -38,15 +38,16 @@ class PerfCounter(Base):
         """How many events were counted"""
         return int(self._perf["event_count"])
 
-    @cached_property
-    def _types(self):
-        return self._gdb.types.make_enum_dict(self._gdb.lookup_type("enum perf_counter_type"))
+    @property
+    def _types(self) -> dict[str, int]:
+        return self.enum_dict("enum perf_counter_type")
 
     @cached_property
     def type(self) -> str:
         """Counter type name"""
+        perf_type = int(self._perf["type"])
         for name, value in self._types.items():
-            if value == self._perf["type"]:
+            if value == perf_type:
                 return name
         return "UNKNOWN"
 
@@ -149,18 +150,13 @@ def all_perf_counters_as_table(gdb, filter_: Callable[[PerfCounter], bool] = Non
     :param sort_key: A function to sort the perf counters by key.
     :returns: A rich table with all perf counters or `None` if no counters found.
     """
-    if (queue := gdb.lookup_static_symbol("perf_counters")) is None:
+    base = Base(gdb)
+    if (queue := base.lookup_static_symbol("perf_counters")) is None:
         return None
-    queue = queue.value()
-    item, tail = queue["head"], queue["tail"]
-    counters = []
-    loop_count = 0
-    while item and item != tail:
-        pc = PerfCounter(gdb, item)
-        counters.append(pc)
-        item = item["flink"]
-        loop_count += 1
-        if loop_count > 1000: break
+    # The counters are linked through the sq_entry_t at the start of their header
+    layout = struct_layout(gdb, "sq_entry_t")
+    counters = [PerfCounter(gdb, node.address) for node in
+                walk_queue(base, queue, layout, queue_type="sq_queue_t")]
     # Filter may result in no matches
     if not counters:
         return None
@@ -2,10 +2,10 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 from __future__ import annotations
-from functools import cached_property
 from dataclasses import dataclass
 from . import utils
-from .base import Base
+from .base import Base, cached_property
+from .layout import struct_layout, walk_list
 
 
 class Semaphore(Base):
@@ -41,12 +41,9 @@ class Semaphore(Base):
             return [self.Holder(Task(self._gdb, holder[0]["htcb"]), int(holder[0]["counts"]))]
 
         #if CONFIG_SEM_PREALLOCHOLDERS > 0
-        holders = []
-        holder = self._sem["hhead"]
-        while(holder):
-            holders.append(self.Holder(Task(self._gdb, holder["htcb"]), int(holder["counts"])))
-            holder = holder["flink"]
-        return holders
+        layout = struct_layout(self._gdb, "struct semholder_s")
+        return [self.Holder(Task(self._gdb, node["htcb"]), node["counts"])
+                for node in walk_list(self, layout, int(self._sem["hhead"]))]
 
     @property
     def has_priority_inheritance(self) -> bool:
@@ -2,9 +2,8 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 from __future__ import annotations
-from functools import cached_property
 from . import utils
-from .base import Base
+from .base import Base, cached_property
 from .device import Device
 import logging
 LOGGER = logging.getLogger(__name__)
@@ -2,11 +2,11 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 from __future__ import annotations
-from functools import cached_property
 from . import utils
 from .system_load import system_load
 from .device import Device
-from .base import Base
+from .base import Base, cached_property
+from .layout import struct_layout, walk_queue
 from dataclasses import dataclass
 from collections import defaultdict
 import rich.box
@@ -68,9 +68,23 @@ _XCP_REGS_MAP: dict[str, int] = {
     "fpscr":   27 + 24,
 }
 
+class _MemoryWords:
+    """Array of the 32-bit words in memory that are read on access"""
+    def __init__(self, base: Base, address: int):
+        self._base = base
+        self._address = address
+
+    def __getitem__(self, index: int) -> int | None:
+        return self._base.read_uint(self._address + index * 4, 4)
+
+
 class Task(Base):
     """
     NuttX task
+
+    The TCB is read as one block of memory and its fields are decoded with the
+    shared `StructLayout` of `struct tcb_s`, so that accessing them does not
+    cost any further transactions with GDB or the debug probe.
     """
     _STACK_COLOR = 0xdeadbeef
     _FILE_DESCRIPTORS_PER_BLOCK = 6 # TODO query from ELF
@@ -89,38 +103,53 @@ class Task(Base):
             """Relative runtime within the interval"""
             return self.delta / self.interval if self.interval else 0
 
-    def __init__(self, gdb, tcb_ptr: "gdb.Value"):
+    def __init__(self, gdb, tcb_ptr: "gdb.Value | int", data: bytes = None):
+        """
+        :param tcb_ptr: The address of the TCB.
+        :param data: The memory of the TCB if it was already read.
+        """
         super().__init__(gdb)
-        self._tcb = tcb_ptr
+        self.address = int(tcb_ptr)
+        """The address of the TCB."""
+        self._layout = struct_layout(self._gdb, "struct tcb_s")
+        if data is not None: self._data = data
         self._system_load = system_load(self._gdb)
-        self.pid = self._tcb["pid"]
-        self.init_priority = int(self._tcb["init_priority"])
-        self.stack_limit = int(self._tcb["adj_stack_size"])
-        self.stack_ptr = self._tcb["stack_base_ptr"]
+        self.pid = self._layout.unpack(self._data, "pid")
+        self.init_priority = self._layout.unpack(self._data, "init_priority")
+        self.stack_limit = self._layout.unpack(self._data, "adj_stack_size")
+        self.stack_ptr = self._layout.unpack(self._data, "stack_base_ptr")
         self._is_running_switched = None
 
+    @cached_property
+    def _data(self) -> memoryview:
+        return self.read_memory(self.address, self._layout.size)
+
     @cached_property
     def name(self) -> str:
         """Name of the task"""
         try:
-            return self._tcb["name"].string()
+            return self._layout.string(self._data, "name")
         except:
             return "?"
 
     @cached_property
     def sched_priority(self) -> int:
         """The scheduled priority of the task"""
-        return int(self._tcb["sched_priority"])
+        return self._layout.unpack(self._data, "sched_priority")
+
+    @property
+    def _statenames(self) -> dict[str, int]:
+        return self.enum_dict("enum tstate_e")
 
     @cached_property
-    def _statenames(self):
-        return self._gdb.types.make_enum_dict(self._gdb.lookup_type("enum tstate_e"))
+    def _task_state(self) -> int:
+        return self._layout.unpack(self._data, "task_state")
 
     @cached_property
     def state(self) -> str:
         """Task state name"""
         for name, value in self._statenames.items():
-            if value == self._tcb["task_state"]:
+            if value == self._task_state:
                 return name
         return "UNKNOWN"
 
@@ -133,8 +162,8 @@ class Task(Base):
         return mapping.get(self.state.replace("TSTATE_", ""), "???")
 
     def _is_state_in(self, *states: list[str]) -> bool:
-        states = {int(self._statenames[s]) for s in states}
-        if int(self._tcb["task_state"]) in states:
+        states = {self._statenames[s] for s in states}
+        if self._task_state in states:
             return True
         return False
 
@@ -155,13 +184,14 @@ class Task(Base):
     def stack_used(self) -> int:
         """The amount of stack used by the thread in bytes"""
         if not self.stack_ptr: return 0
-        stack_u32p = self.stack_ptr.cast(self._gdb.lookup_type("unsigned int").pointer())
+        # Only the probed words are read, the final probes share cached pages
+        stack_u32 = _MemoryWords(self, self.stack_ptr)
         # Stack grows from top to bottom, we do a binary search for the
         # 0xdeadbeef value from the bottom upwards
-        watermark = utils.binary_search_last(stack_u32p, self._STACK_COLOR, hi=self.stack_limit // 4) + 1
+        watermark = utils.binary_search_last(stack_u32, self._STACK_COLOR, hi=self.stack_limit // 4) + 1
         # validate the binary search (does not seem necessary)
         # for ii in range(0, watermark):
-        #     if stack_u32p[ii] != self._STACK_COLOR:
+        #     if stack_u32[ii] != self._STACK_COLOR:
         #         print(f"{self.name}: Correcting stack size from {watermark * 4} to {ii * 4}!")
         #         return ii * 4
         return self.stack_limit - watermark * 4
@@ -174,7 +204,7 @@ class Task(Base):
         """
         if self._is_state_in("TSTATE_WAIT_SEM"):
             from .semaphore import Semaphore
-            sem = self._tcb['waitsem']
+            sem = self.addr_ptr(self._layout.unpack(self._data, "waitsem"), "sem_t")
             ostr = f"{int(sem):#08x} "
             if descr := self.description_at(sem): ostr += f"<{descr}> "
             ostr += Semaphore(self._gdb, sem).to_string()
@@ -186,15 +216,24 @@ class Task(Base):
     @cached_property
     def files(self) -> list["gdb.Value"]:
         """The list of inode pointers the task holds"""
-        filelist = self._tcb["group"]["tg_filelist"]
-        rows = filelist["fl_rows"]
-        files = filelist["fl_files"]
+        if not (group := self._layout.unpack(self._data, "group")):
+            return []
+        group_layout = struct_layout(self._gdb, "struct task_group_s")
+        group_data = self.read_memory(group, group_layout.size)
+        rows = group_layout.unpack(group_data, "tg_filelist.fl_rows")
+        files = group_layout.unpack(group_data, "tg_filelist.fl_files")
+        if not rows or not files: return []
+        file_layout = struct_layout(self._gdb, "struct file")
+        ptr_size = group_layout.field("tg_filelist.fl_files").size
+        row_ptrs = self.read_memory(files, rows * ptr_size)
         result = []
         for ri in range(rows):
+            row = int.from_bytes(row_ptrs[ri * ptr_size:(ri + 1) * ptr_size], "little")
+            block = self.read_memory(row, self._FILE_DESCRIPTORS_PER_BLOCK * file_layout.size)
             for ci in range(self._FILE_DESCRIPTORS_PER_BLOCK):
-                file = files[ri][ci]
-                if inode := file["f_inode"]:
-                    result.append(file)
+                if file_layout.unpack(block, "f_inode", ci * file_layout.size):
+                    file = self.addr_ptr(row + ci * file_layout.size, "struct file")
+                    result.append(file.dereference())
         return result
 
     @cached_property
@@ -203,17 +242,27 @@ class Task(Base):
         if self.is_current_task:
             pc = self.read_register("pc")
         else:
-            pc = self._tcb["xcp"]["regs"][32]
+            pc = self._xcp_regs[32]
         block = self.block(pc)
         while block and not block.function:
             block = block.superblock
         return block.function if block else int(pc)
 
+    @cached_property
+    def _xcp_regs(self) -> memoryview:
+        # Older NuttX stores the registers inside the TCB, newer ones on the stack
+        field = self._layout.field("xcp.regs")
+        if field.type.code == self._gdb.TYPE_CODE_PTR:
+            address = self._layout.unpack(self._data, "xcp.regs")
+            count = max(_XCP_REGS_MAP.values()) + 1
+            return self.read_memory(address, count * 4).cast("I")
+        return self._layout.array(self._data, "xcp.regs")
+
     def switch_to(self) -> bool:
         """Switch to this task by writing the register file"""
         if self.is_current_task:
             return False
-        regs = {name: self._tcb["xcp"]["regs"][offset]
+        regs = {name: self._xcp_regs[offset]
                 for name, offset in _XCP_REGS_MAP.items()}
         regs = self.fix_nuttx_sp(regs)
         self.write_registers(regs)
@@ -241,7 +290,7 @@ class Task(Base):
         """The task load based on the system load monitor"""
         if self._system_load is None: return self.Load(0, 0, 0)
         _, interval, sl = self._system_load.sample
-        total, delta = sl.get(int(self._tcb), (0,0))
+        total, delta = sl.get(self.address, (0,0))
         return self.Load(total, interval, delta)
 
     def __repr__(self) -> str:
@@ -258,24 +307,14 @@ class Task(Base):
 
 def all_tasks(gdb) -> list[Task]:
     """Return a list of all tasks"""
-    type_tcb_s = gdb.lookup_type("struct tcb_s").pointer()
+    base = Base(gdb)
+    tcb_layout = struct_layout(gdb, "struct tcb_s")
     def _tasks(name):
-        tcbs = []
-        if (task_list := gdb.lookup_global_symbol(name)) is None:
+        if (task_list := base.lookup_global_symbol(name)) is None:
             return []
-        task_list = task_list.value()
-        current_task = task_list["head"]
-        if current_task:
-            while True:
-                tcbs.append(Task(gdb, current_task.cast(type_tcb_s)))
-                if current_task == task_list["tail"]:
-                    break
-                next_task = current_task["flink"]
-                # if next_task["blink"] == current_task:
-                #   LOGGER.error(f"Task linkage is broken in {tasks}!")
-                #   break
-                current_task = next_task
-        return tcbs
+        # Every TCB is only read once and reused by the task
+        return [Task(gdb, node.address, node.data) for node in
+                walk_queue(base, task_list, tcb_layout, back_link="blink")]
 
     tcbs  = _tasks("g_pendingtasks")
     tcbs += _tasks("g_readytorun")
@@ -377,7 +416,7 @@ def all_tasks_as_table(gdb, sort_key: str = None, with_stack_usage: bool = True,
         # Add all the values per row
         relative = task.load.relative if interval_us else task.load.total / total_interval_us
         stack_overflow = with_stack_usage and task.stack_used >= (task.stack_limit - max(8, task.stack_limit * 0.1))
-        row = [hex(task._tcb), task.pid, task.name,
+        row = [hex(task.address), task.pid, task.name,
                hex(task.location) if isinstance(task.location, int) else task.location.name,
                task.load.total//1000, f"{(relative * 100):.1f}",
                Text.assemble((str(task.stack_used) if with_stack_usage else "", "bold red" if stack_overflow else "")),
@@ -233,6 +233,8 @@ class PX4_Coredump(gdb.Command):
                                  help="Memory range in `start:size` format.")
         self.parser.add_argument("--flash", action="store_true", default=False,
                                  help="Also dump the non-volatile memory.")
+        self.parser.add_argument("--elf", action="store_true", default=False,
+                                 help="Write an ARM ELF core file instead.")
         self.parser.add_argument("--file",
                                  help="Coredump filename, defaults to `coredump_{datetime}.txt`.")
 
@@ -242,7 +244,47 @@ class PX4_Coredump(gdb.Command):
         memories = None
         if args.memory:
             memories = [[int(h, 0) for h in m.split(":")] for m in args.memory]
-        px4.coredump(gdb, memories, args.flash, args.file)
+        px4.coredump(gdb, memories, args.flash, args.file, args.elf)
+
+
+class PX4_Memory_Cache(gdb.Command):
+    """
+    Show and configure the page cache of the target memory.
+    """
+    def __init__(self):
+        super().__init__("px4_memory_cache", gdb.COMMAND_USER)
+        self.parser = argparse.ArgumentParser(self.__doc__)
+        self.parser.add_argument("--enable", action="store_true", default=False,
+                                 help="Enable the cache.")
+        self.parser.add_argument("--disable", action="store_true", default=False,
+                                 help="Disable the cache.")
+        self.parser.add_argument("--page-size", type=int,
+                                 help="Size of the cached pages in bytes.")
+        self.parser.add_argument("--bypass", action="append",
+                                 help="Never cache the memory range in `start:size` format.")
+        self.parser.add_argument("--reset", action="store_true", default=False,
+                                 help="Clear the cache and reset the statistics.")
+
+    @report_exception
+    def invoke(self, argument, from_tty):
+        args = self.parser.parse_args(shlex.split(argument))
+        if args.page_size is not None and args.page_size <= 0:
+            print("The page size must be positive!")
+            return
+        cache = px4.base.Base.memory_cache
+        if args.enable: cache.enabled = True
+        if args.disable: cache.enabled = False
+        if args.page_size:
+            cache.clear()
+            cache.page_size = args.page_size
+        for bypass in args.bypass or []:
+            start, size = (int(h, 0) for h in bypass.split(":"))
+            cache.bypass.append((start, start + size))
+        if args.reset:
+            cache.clear()
+            cache.reset_statistics()
+        print(f"Memory cache {'enabled' if cache.enabled else 'disabled'}, "
+              f"{cache.page_size}B pages: {cache}")
 
 
 class PX4_Watch_Peripheral(gdb.Command):
@@ -384,6 +426,7 @@ PX4_Switch_Task()
 PX4_Relative_Breakpoint()
 PX4_Backtrace()
 PX4_Coredump()
+PX4_Memory_Cache()
 PX4_Watch_Peripheral(px4._SVD_FILE)
 PX4_Show_Peripheral(px4._SVD_FILE)
 
@@ -129,7 +129,8 @@ class CommandPrompt:
             return None
 
         filename = add_dt(filename) if add_datetime else Path(filename)
-        self._logfile = filename.open("wt")
+        # Line buffered, so that the log can be followed while it is written
+        self._logfile = filename.open("wt", buffering=1)
         return filename
 
     def read_lines(self, timeout: float = _TIMEOUT) -> str | None:
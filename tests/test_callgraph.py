@@ -0,0 +1,22 @@
+# Copyright (c) 2024, Auterion AG
+# SPDX-License-Identifier: BSD-3-Clause
+
+from emdbg.analyze import callgraph
+from emdbg.analyze.callgraph import callgraph_from_backtrace
+
+BACKTRACE = """\
+Task=main
+#0  0x08001000 in leaf (arg=1) at src/leaf.c:10
+#1  0x08002000 in caller () at src/caller.c:20
+#2  0x08003000 in main () at src/main.c:30
+"""
+
+
+def test_parallel_list_of_backtraces(monkeypatch):
+    # Use several small batches so that a list would repeat its first batch
+    monkeypatch.setattr(callgraph, "_BATCH_SIZE", 2)
+    backtraces = [BACKTRACE] * 5
+    serial = callgraph_from_backtrace(backtraces)
+    parallel = callgraph_from_backtrace(backtraces, jobs=2)
+    assert set(parallel.nodes) == set(serial.nodes)
+    assert len(parallel.edges) == len(serial.edges)